@@ -0,0 +1,314 @@
+###### 协方差矩阵算子 ######
+
+
+### 模块说明 ###
+
+# 因子协方差和特异风险估计中的矩阵运算。输入和输出均为 float64 的 numpy 数组，收益率数组的行为交易日（按时间先后排序），列为因子或股票。
+
+
+import multiprocessing
+
+import numpy as np
+
+
+def get_exponential_weight(half_life, length):
+
+    # 生成权重后，需要对数组进行倒序（[::-1]）
+
+    return np.cumprod(np.repeat(1/np.exp(np.log(2)/half_life), length))[::-1]
+
+
+def get_lagged_returns(returns, length, number_of_lags):
+
+    # returns 为最近 length + number_of_lags 个交易日的收益率；返回当期 length 个交易日的收益率，以及滞后 1 至 number_of_lags 期、与当期逐日对齐的收益率
+
+    returns = np.asarray(returns, dtype=np.float64)
+
+    current_returns = returns[len(returns) - length:]
+
+    lagged_returns = [returns[len(returns) - length - lag: len(returns) - lag] for lag in range(1, number_of_lags + 1)]
+
+    return current_returns, lagged_returns
+
+
+def newey_west_covariance(current_returns, lagged_returns, half_life, number_of_lags):
+
+    # 指数加权协方差矩阵及 Newey-West 调整（Bartlett 权重）：
+
+    # cov = Γ_0 + sum_{l=1..q} (1 - l / (q + 1)) * (Γ_l + Γ_l')，Γ_l = sum_t w_t * d_t * d_{t-l}' / sum_t w_t，d 为各期去均值后的收益率
+
+    # 各滞后期的 Γ_l 由当期加权收益率与全部滞后收益率横向拼接后的一次矩阵乘法得到；返回日度（未年化）的 K×K 数组
+
+    current_returns = np.asarray(current_returns, dtype=np.float64)
+
+    number_of_lags = 0 if number_of_lags is None or np.isnan(number_of_lags) else int(number_of_lags)
+
+    exp_weight = get_exponential_weight(half_life, len(current_returns))
+
+    demeaned_returns = current_returns - current_returns.mean(axis=0)
+
+    weighted_returns = demeaned_returns * (exp_weight / exp_weight.sum())[:, None]
+
+    covariance = weighted_returns.T.dot(demeaned_returns)
+
+    if number_of_lags > 0:
+
+        number_of_factors = current_returns.shape[1]
+
+        stacked_lagged_returns = np.hstack([lagged - lagged.mean(axis=0) for lagged in np.asarray(lagged_returns[:number_of_lags], dtype=np.float64)])
+
+        lag_covariance = weighted_returns.T.dot(stacked_lagged_returns).reshape(number_of_factors, number_of_lags, number_of_factors).transpose(1, 0, 2)
+
+        bartlett_weight = 1 - np.arange(1, number_of_lags + 1) / (number_of_lags + 1)
+
+        covariance = covariance + np.einsum('l,lij->ij', bartlett_weight, lag_covariance + lag_covariance.transpose(0, 2, 1))
+
+    return covariance
+
+
+def covariance_to_correlation(covariance):
+
+    volatility = np.sqrt(np.diag(covariance))
+
+    return covariance / np.outer(volatility, volatility), volatility
+
+
+def simulate_eigenfactor_bias(eigen_value, number_of_simulations, length, seed=None, chunk_size=500):
+
+    # 特征因子风险调整的蒙特卡洛模拟：在特征因子坐标下，按特征值（特征因子方差）模拟 length 个交易日的特征因子收益率，计算模拟协方差矩阵及其特征分解，
+
+    # 模拟特征向量方向上的真实方差 / 模拟方差即为特征值的偏差。模拟协方差矩阵与真实协方差矩阵只相差一个正交变换，因此无需旋转回因子坐标。
+
+    # 每次生成 chunk_size 次模拟的 chunk_size×length×K 数组，以 einsum 批量计算协方差矩阵，以 eigh 批量进行特征分解；seed 相同则结果相同
+
+    # 返回各特征值的偏差（与 eigen_value 的顺序相同，均为升序）的模拟均值和平方均值（用于计算标准误），以及模拟次数
+
+    eigen_value = np.clip(np.asarray(eigen_value, dtype=np.float64), 0, None)
+
+    random_generator = np.random.default_rng(seed)
+
+    bias_sum = np.zeros(len(eigen_value))
+
+    squared_bias_sum = np.zeros(len(eigen_value))
+
+    completed_simulations = 0
+
+    while completed_simulations < number_of_simulations:
+
+        chunk = min(chunk_size, number_of_simulations - completed_simulations)
+
+        simulated_returns = random_generator.standard_normal((chunk, length, len(eigen_value))) * np.sqrt(eigen_value)
+
+        simulated_returns = simulated_returns - simulated_returns.mean(axis=1, keepdims=True)
+
+        simulated_covariance = np.einsum('mti,mtj->mij', simulated_returns, simulated_returns, optimize=True) / (length - 1)
+
+        simulated_eigen_value, simulated_eigen_vector = np.linalg.eigh(simulated_covariance)
+
+        true_variance = np.einsum('mki,k,mki->mi', simulated_eigen_vector, eigen_value, simulated_eigen_vector)
+
+        bias = true_variance / simulated_eigen_value
+
+        bias_sum += bias.sum(axis=0)
+
+        squared_bias_sum += np.square(bias).sum(axis=0)
+
+        completed_simulations += chunk
+
+    return bias_sum, squared_bias_sum, completed_simulations
+
+
+def eigenfactor_adjusted_covariance(covariance, number_of_simulations=10000, length=252, seed=None, scaling_coefficient=1.0, chunk_size=500):
+
+    # 特征因子风险调整：covariance = U * D * U'，调整后的协方差矩阵 = U * (γ^2 * D) * U'，其中 γ = scaling_coefficient * (v - 1) + 1，v 为模拟得到的特征值偏差的平方根
+
+    # scaling_coefficient 为经验放大系数（默认为 1，即不放大）；返回调整后的协方差矩阵和 v
+
+    # 在当前进程中按 parallel_eigenfactor_adjusted_covariance 的分批随机数流模拟，seed 相同则与并行计算的结果相同
+
+    adjusted_covariance, simulated_volatility_bias, completed_simulations, standard_error = parallel_eigenfactor_adjusted_covariance(covariance, number_of_simulations, length, seed, scaling_coefficient, processes=1, chunk_size=chunk_size)
+
+    return adjusted_covariance, simulated_volatility_bias
+
+
+def _simulate_eigenfactor_bias_batch(arguments):
+
+    eigen_value, number_of_simulations, length, seed_sequence, chunk_size = arguments
+
+    return simulate_eigenfactor_bias(eigen_value, number_of_simulations, length, seed_sequence, chunk_size)
+
+
+def parallel_eigenfactor_adjusted_covariance(covariance, maximum_simulations=10000, length=252, seed=None, scaling_coefficient=1.0, batch_size=500, processes=None, tolerance=None, chunk_size=500):
+
+    # 特征因子风险调整（计算公式见 eigenfactor_adjusted_covariance），模拟分为若干批（每批 batch_size 次），各批使用 SeedSequence(seed).spawn 生成的独立随机数流，由进程池并行计算
+
+    # 各批结果按批次顺序累计，每累计一批更新各特征值偏差 v 的标准误（以 delta 方法由模拟偏差的样本标准差换算）；tolerance 不为 None 时，全部标准误小于 tolerance 即停止模拟
+
+    # 结果只取决于 seed、batch_size 和 tolerance，与进程数无关；processes=1 时在当前进程中计算
+
+    # 返回调整后的协方差矩阵、v、实际模拟次数和 v 的标准误
+
+    eigen_value, eigen_vector = np.linalg.eigh(np.asarray(covariance, dtype=np.float64))
+
+    number_of_batches = int(np.ceil(maximum_simulations / batch_size))
+
+    batch_seeds = np.random.SeedSequence(seed).spawn(number_of_batches)
+
+    batch_arguments = [(eigen_value, min(batch_size, maximum_simulations - batch_number * batch_size), length, batch_seeds[batch_number], chunk_size) for batch_number in range(number_of_batches)]
+
+    bias_sum = np.zeros(len(eigen_value))
+
+    squared_bias_sum = np.zeros(len(eigen_value))
+
+    completed_simulations = 0
+
+    standard_error = np.full(len(eigen_value), np.inf)
+
+    pool = None if processes == 1 else multiprocessing.get_context('spawn').Pool(processes=processes)
+
+    try:
+
+        batch_results = map(_simulate_eigenfactor_bias_batch, batch_arguments) if pool is None else pool.imap(_simulate_eigenfactor_bias_batch, batch_arguments)
+
+        for batch_bias_sum, batch_squared_bias_sum, batch_simulations in batch_results:
+
+            bias_sum += batch_bias_sum
+
+            squared_bias_sum += batch_squared_bias_sum
+
+            completed_simulations += batch_simulations
+
+            mean_bias = bias_sum / completed_simulations
+
+            if completed_simulations > 1:
+
+                bias_variance = np.clip(squared_bias_sum / completed_simulations - np.square(mean_bias), 0, None) * completed_simulations / (completed_simulations - 1)
+
+                standard_error = np.sqrt(bias_variance / completed_simulations) / (2 * np.sqrt(mean_bias))
+
+            if tolerance is not None and np.all(standard_error < tolerance):
+
+                break
+
+    finally:
+
+        # 提前停止时未完成的批次直接终止
+
+        if pool is not None:
+
+            pool.terminate()
+
+            pool.join()
+
+    simulated_volatility_bias = np.sqrt(bias_sum / completed_simulations)
+
+    scaled_volatility_bias = scaling_coefficient * (simulated_volatility_bias - 1) + 1
+
+    adjusted_covariance = (eigen_vector * (np.square(scaled_volatility_bias) * np.clip(eigen_value, 0, None))).dot(eigen_vector.T)
+
+    return adjusted_covariance, simulated_volatility_bias, completed_simulations, standard_error
+
+
+def volatility_regime_bias(returns):
+
+    # 各交易日的横截面偏差统计量：bias_t = sum_k (r_tk / σ_k)^2 / K，σ_k 为窗口内因子收益率的等权标准差，缺失的收益率不计入求和
+
+    returns = np.asarray(returns, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        return np.nansum(np.square(returns / np.nanstd(returns, axis=0, ddof=1)), axis=1) / returns.shape[1]
+
+
+def rolling_volatility_regime_multiplier(returns, half_life, length, chunk_size=250):
+
+    # 以每个交易日为窗口终点（最近 length 个交易日），计算波动率偏误调整系数 λ_F = sqrt(sum_t w_t * bias_t / sum_t w_t)，返回长度为 T - length + 1 的数组
+
+    # bias_t 中的 σ_k 取决于窗口，但 sum_t w_t * bias_t = sum_k (sum_t w_t * r_tk^2) / σ_k^2 / K，因此只需要各窗口的加权平方和与各窗口的标准差
+
+    returns = np.asarray(returns, dtype=np.float64)
+
+    exp_weight = get_exponential_weight(half_life, length)
+
+    # 窗口数×K×length 的视图本身不复制数据，但平方和方差的计算会生成同样大小的临时数组，因此每次计算 chunk_size 个窗口，控制内存
+
+    return_windows = np.lib.stride_tricks.sliding_window_view(returns, length, axis=0)
+
+    weighted_bias = []
+
+    for start in range(0, len(return_windows), chunk_size):
+
+        chunk_windows = return_windows[start: start + chunk_size]
+
+        weighted_squared_returns = np.nansum(np.square(chunk_windows) * exp_weight, axis=2)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+
+            weighted_bias.append(np.sum(weighted_squared_returns / np.nanvar(chunk_windows, axis=2, ddof=1), axis=1) / returns.shape[1])
+
+    return np.sqrt(np.concatenate(weighted_bias) / exp_weight.sum())
+
+
+def newey_west_specific_variance(returns, length, volatility_half_life, correlation_half_life, number_of_lags):
+
+    # 所有股票同时计算特异收益率的 Newey-West 方差：var = Γ_0 + sum_{l=1..q} 2 * (1 - l / (q + 1)) * Γ_l，
+
+    # Γ_0 使用 volatility_half_life 的指数权重，自协方差 Γ_l = sum_t w_t * d_t * d_{t-l} / sum_t w_t 使用 correlation_half_life 的指数权重
+
+    # returns 为 (length + q)×N 的数组，或 D×(length + q)×N 的数组（D 个交易日的窗口，批量计算）；返回日度（未年化）的方差，形状为 N 或 D×N
+
+    # 缺失值以掩码处理：各窗口以不缺失收益率的均值去均值，Γ_l 的分子和分母都只包括 t 和 t-l 期的收益率均不缺失的交易日；窗口内没有收益率的股票为 NaN
+
+    returns = np.asarray(returns, dtype=np.float64)
+
+    number_of_lags = 0 if number_of_lags is None or np.isnan(number_of_lags) else int(number_of_lags)
+
+    def _demean(window):
+
+        available = ~np.isnan(window)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+
+            mean = np.sum(np.where(available, window, 0), axis=-2, keepdims=True) / np.sum(available, axis=-2, keepdims=True)
+
+        return np.where(available, window - mean, 0), available
+
+    demeaned_returns, available_returns = _demean(returns[..., returns.shape[-2] - length:, :])
+
+    volatility_exp_weight = get_exponential_weight(volatility_half_life, length)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+
+        specific_variance = np.einsum('t,...tn->...n', volatility_exp_weight, np.square(demeaned_returns)) / np.einsum('t,...tn->...n', volatility_exp_weight, available_returns.astype(np.float64))
+
+        if number_of_lags > 0:
+
+            correlation_exp_weight = get_exponential_weight(correlation_half_life, length)
+
+            for lag in range(1, number_of_lags + 1):
+
+                demeaned_lagged_returns, available_lagged_returns = _demean(returns[..., returns.shape[-2] - length - lag: returns.shape[-2] - lag, :])
+
+                auto_covariance = np.einsum('t,...tn->...n', correlation_exp_weight, demeaned_returns * demeaned_lagged_returns) / np.einsum('t,...tn->...n', correlation_exp_weight, (available_returns & available_lagged_returns).astype(np.float64))
+
+                specific_variance = specific_variance + 2 * (1 - lag / (number_of_lags + 1)) * auto_covariance
+
+    return specific_variance
+
+
+def rolling_newey_west_specific_variance(returns, length, volatility_half_life, correlation_half_life, number_of_lags, chunk_size=10):
+
+    # 以每个交易日为窗口终点（最近 length + q 个交易日）计算 newey_west_specific_variance，返回 (T - length - q + 1)×N 的数组；每次计算 chunk_size 个窗口，控制内存
+
+    returns = np.asarray(returns, dtype=np.float64)
+
+    window_length = length + (0 if number_of_lags is None or np.isnan(number_of_lags) else int(number_of_lags))
+
+    # 窗口数×N×window_length 的视图，不复制数据
+
+    return_windows = np.lib.stride_tricks.sliding_window_view(returns, window_length, axis=0)
+
+    specific_variance = [newey_west_specific_variance(np.swapaxes(return_windows[start: start + chunk_size], 1, 2), length, volatility_half_life, correlation_half_life, number_of_lags)
+                         for start in range(0, len(return_windows), chunk_size)]
+
+    return np.concatenate(specific_variance, axis=0)
@@ -0,0 +1,192 @@
+###### 指数加权协方差矩阵的递推状态 ######
+
+
+### 模块说明 ###
+
+# get_factor_covariance 每天取回 252 + 5 个交易日的因子收益率，重新计算整个窗口的指数加权协方差矩阵和各滞后期的交叉协方差。
+
+# 本模块保存协方差矩阵的递推状态：窗口内的指数加权外积之和 sum_t w_t * x_t * x_{t-l}'（l = 0..q）、加权一阶和以及等权一阶和（用于去均值），
+
+# 新增一个交易日时，各加权和先乘以衰减系数，加上新交易日的项，再减去移出窗口的交易日的项，计算量为 O(qK^2)，不需要重新读取历史收益率。
+
+# 窗口内的收益率同时保存在状态中，用于确定移出窗口的项；每 rebase_interval 次更新按窗口内的收益率重新精确计算各加权和，消除加减累积的舍入误差。
+
+# 由状态得到的协方差矩阵与 covariance_operators.newey_west_covariance 对同一窗口的计算结果相同（各窗口以自身的等权均值去均值）。
+
+
+### 存储结构 ###
+
+# covariance_state_path/<name>.pkl ：状态字典（半衰期、窗口长度、最大滞后期数、因子、交易日、窗口内的收益率及各加权和）。
+
+
+import os
+import pickle
+
+import numpy as np
+
+
+### paths for saving files ###
+
+covariance_state_path = os.path.join(os.path.expanduser('~'), 'cne5_factors_data', 'covariance_state')
+
+
+def _decay_factor(half_lives):
+
+    return np.exp(-np.log(2) / np.asarray(half_lives, dtype=np.float64))
+
+
+def rebase_covariance_state(state):
+
+    # 按窗口内的收益率重新精确计算各加权和；returns 共 length + number_of_lags 行，当期窗口为最后 length 行，滞后 l 期的窗口向前平移 l 行
+
+    returns = state['returns']
+
+    length, number_of_lags = state['length'], state['number_of_lags']
+
+    # 最新交易日的权重为 1，往前每个交易日乘以衰减系数（与 get_exponential_weight 只相差一个常数倍，归一化后相同）
+
+    exp_weight = _decay_factor(state['half_lives'])[:, None] ** np.arange(length - 1, -1, -1)[None, :]
+
+    current_returns = returns[number_of_lags:]
+
+    lagged_returns = np.array([returns[number_of_lags - lag: len(returns) - lag] for lag in range(number_of_lags + 1)])
+
+    state['weight_sum'] = exp_weight.sum(axis=1)
+
+    state['weighted_sum'] = exp_weight.dot(current_returns)
+
+    state['weighted_lagged_sum'] = np.einsum('ht,ltk->hlk', exp_weight, lagged_returns)
+
+    state['weighted_cross_product'] = np.einsum('ht,ti,ltj->hlij', exp_weight, current_returns, lagged_returns, optimize=True)
+
+    state['lagged_sum'] = lagged_returns.sum(axis=1)
+
+    state['updates_since_rebase'] = 0
+
+    return state
+
+
+def initialize_covariance_state(returns, half_lives, length, number_of_lags, rebase_interval=21):
+
+    # returns 为 DataFrame（行：交易日，列：因子），至少包括最近 length + number_of_lags 个交易日；half_lives 为需要同时维护的各半衰期（例如相关系数和波动率的半衰期）
+
+    # 缺失的因子收益率（NaN）按 0 保存，否则 NaN 会进入各加权和，并在之后的每次递推中一直保留
+
+    returns = returns.iloc[-(length + number_of_lags):]
+
+    state = {'half_lives': np.asarray(half_lives, dtype=np.float64),
+             'length': length,
+             'number_of_lags': number_of_lags,
+             'rebase_interval': rebase_interval,
+             'factors': returns.columns.tolist(),
+             'dates': returns.index.tolist(),
+             'returns': np.nan_to_num(returns.values.astype(np.float64))}
+
+    return rebase_covariance_state(state)
+
+
+def update_covariance_state(state, date, factor_return):
+
+    # 加入一个交易日的因子收益率（与 state['factors'] 顺序相同的数组，缺失值按 0 处理），窗口整体向后平移一个交易日
+
+    length, number_of_lags = state['length'], state['number_of_lags']
+
+    extended_returns = np.vstack([state['returns'], np.nan_to_num(np.asarray(factor_return, dtype=np.float64))[None, :]])
+
+    lags = np.arange(number_of_lags + 1)
+
+    # 移出当期窗口的交易日（及其各滞后期），以及新加入的交易日（及其各滞后期）
+
+    removed_return, removed_lagged_returns = extended_returns[number_of_lags], extended_returns[number_of_lags - lags]
+
+    added_return, added_lagged_returns = extended_returns[-1], extended_returns[-1 - lags]
+
+    decay_factor = _decay_factor(state['half_lives'])
+
+    removed_weight = decay_factor ** length
+
+    state['weighted_sum'] = decay_factor[:, None] * state['weighted_sum'] - removed_weight[:, None] * removed_return + added_return
+
+    state['weighted_lagged_sum'] = decay_factor[:, None, None] * state['weighted_lagged_sum'] - removed_weight[:, None, None] * removed_lagged_returns + added_lagged_returns
+
+    state['weighted_cross_product'] = decay_factor[:, None, None, None] * state['weighted_cross_product'] \
+                                      - removed_weight[:, None, None, None] * np.einsum('i,lj->lij', removed_return, removed_lagged_returns) \
+                                      + np.einsum('i,lj->lij', added_return, added_lagged_returns)
+
+    state['lagged_sum'] = state['lagged_sum'] - removed_lagged_returns + added_lagged_returns
+
+    state['returns'] = extended_returns[1:]
+
+    state['dates'] = state['dates'][1:] + [date]
+
+    state['updates_since_rebase'] += 1
+
+    if state['updates_since_rebase'] >= state['rebase_interval']:
+
+        rebase_covariance_state(state)
+
+    return state
+
+
+def get_state_covariance(state, half_life, number_of_lags):
+
+    # 返回日度（未年化）的 Newey-West 调整后的协方差矩阵（K×K 数组），number_of_lags 不能超过状态的最大滞后期数，为 None 或 NaN 时视为 0
+
+    number_of_lags = 0 if number_of_lags is None or np.isnan(number_of_lags) else int(number_of_lags)
+
+    half_life_index = int(np.flatnonzero(state['half_lives'] == half_life)[0])
+
+    weight_sum = state['weight_sum'][half_life_index]
+
+    weighted_sum = state['weighted_sum'][half_life_index]
+
+    weighted_lagged_sum = state['weighted_lagged_sum'][half_life_index, :number_of_lags + 1]
+
+    mean = state['lagged_sum'][:number_of_lags + 1] / state['length']
+
+    # sum_t w_t * (x_t - m_0) * (x_{t-l} - m_l)' 按外积展开
+
+    lag_covariance = (state['weighted_cross_product'][half_life_index, :number_of_lags + 1]
+                      - np.einsum('i,lj->lij', mean[0], weighted_lagged_sum)
+                      - np.einsum('i,lj->lij', weighted_sum, mean)
+                      + weight_sum * np.einsum('i,lj->lij', mean[0], mean)) / weight_sum
+
+    covariance = lag_covariance[0]
+
+    if number_of_lags > 0:
+
+        bartlett_weight = 1 - np.arange(1, number_of_lags + 1) / (number_of_lags + 1)
+
+        covariance = covariance + np.einsum('l,lij->ij', bartlett_weight, lag_covariance[1:] + lag_covariance[1:].transpose(0, 2, 1))
+
+    return covariance
+
+
+def save_covariance_state(state, name):
+
+    os.makedirs(covariance_state_path, exist_ok=True)
+
+    path = os.path.join(covariance_state_path, name + '.pkl')
+
+    # 先写临时文件再替换，避免写入中断时损坏已有状态
+
+    with open(path + '.tmp', 'wb') as pkfl:
+
+        pickle.dump(state, pkfl)
+
+    os.replace(path + '.tmp', path)
+
+
+def load_covariance_state(name):
+
+    # 状态不存在时返回 None
+
+    path = os.path.join(covariance_state_path, name + '.pkl')
+
+    if not os.path.exists(path):
+
+        return None
+
+    with open(path, 'rb') as pkfl:
+
+        return pickle.load(pkfl)
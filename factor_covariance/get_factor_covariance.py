@@ -8,6 +8,9 @@ from datetime import timedelta
 import rqdatac
 rqdatac.init('rice','rice',('192.168.10.64',16030))
 
+from covariance_operators import *
+from covariance_state import *
+
 
 dailyParameters = {'factor_return_length': 252,
                     'volatility_half_life': 42,
@@ -110,123 +113,121 @@ def get_multiperiod_factor_returns(all_factors, latest_trading_date, parameters)
     return daily_factor_return[-parameters.get('factor_return_length'):], multiperiod_daily_factor_return
 
 
-def get_exponential_weight(half_life, length):
+def Newey_West_adjustment(current_factor_return, multiperiod_factor_returns, all_factors, parameters):
 
-    # 生成权重后，需要对数组进行倒序（[::-1]）
+    # 以矩阵运算计算 Newey West 调整后的协方差矩阵（见 covariance_operators.newey_west_covariance）：
 
-    return np.cumprod(np.repeat(1/np.exp(np.log(2)/half_life), length))[::-1]
+    # 相关系数使用 correlation_half_life 和 NeweyWest_correlation_lags，波动率使用 volatility_half_life 和 NeweyWest_volatility_lags
 
+    current_returns = current_factor_return[all_factors].values.astype(np.float64)
 
-def Newey_West_adjustment(current_factor_return, multiperiod_factor_returns, all_factors, parameters):
+    lagged_returns = [multiperiod_factor_returns['lag_' + str(lag)][all_factors].values.astype(np.float64) for lag in range(1, len(multiperiod_factor_returns) + 1)]
 
-    volatility_exp_weight = get_exponential_weight(parameters['volatility_half_life'], parameters['factor_return_length'])
+    Newey_West_adjustment_cov = 252 * newey_west_covariance(current_returns, lagged_returns, parameters['correlation_half_life'], parameters['NeweyWest_correlation_lags'])
 
-    correlation_exp_weight = get_exponential_weight(parameters['correlation_half_life'], parameters['factor_return_length'])
+    Newey_West_adjustment_var = 252 * newey_west_covariance(current_returns, lagged_returns, parameters['volatility_half_life'], parameters['NeweyWest_volatility_lags'])
 
-    demeaned_current_factor_return = current_factor_return - current_factor_return.mean()
+    # 未经 Newey West 调整的指数加权协方差矩阵（日度）
 
-    estimated_lag_cov = pd.DataFrame(index=all_factors, columns=all_factors)
+    estimated_cov = newey_west_covariance(current_returns, lagged_returns, parameters['correlation_half_life'], 0)
 
-    estimated_lag_var = pd.DataFrame(index=all_factors, columns=all_factors)
+    return _assemble_Newey_West_adjustment(Newey_West_adjustment_cov, Newey_West_adjustment_var, estimated_cov, all_factors)
 
-    exp_factors_return = pd.DataFrame()
 
-    varexp_factors_return = pd.DataFrame()
+def _assemble_Newey_West_adjustment(Newey_West_adjustment_cov, Newey_West_adjustment_var, estimated_cov, all_factors):
 
-    intermediate_cov = pd.DataFrame(index=all_factors, columns=all_factors, data=0)
+    # 计算调整风险矩阵各项 volatility和相关系数
 
-    intermediate_var = pd.DataFrame(index=all_factors, columns=all_factors, data=0)
+    correlation_matrix, factor_volitality_cov = covariance_to_correlation(Newey_West_adjustment_cov)
 
-    # 计算协方差和方差估计矩阵
+    factor_volitality = np.sqrt(np.diag(Newey_West_adjustment_var))
 
-    for factor in all_factors:
+    adjusted_covariance = correlation_matrix * np.outer(factor_volitality, factor_volitality)
 
-        exp_factors_return[factor] = np.sqrt(correlation_exp_weight) * demeaned_current_factor_return[factor] / correlation_exp_weight.sum()
+    adjusted_covariance = pd.DataFrame(adjusted_covariance, index=all_factors, columns=all_factors)
 
-        varexp_factors_return[factor] = np.sqrt(volatility_exp_weight) * demeaned_current_factor_return[factor] / volatility_exp_weight.sum()
+    correlation_matrix = pd.DataFrame(correlation_matrix, index=all_factors, columns=all_factors)
 
-    estimated_cov = exp_factors_return.cov()
+    estimated_cov = pd.DataFrame(estimated_cov, index=all_factors, columns=all_factors)
 
-    estimated_var = varexp_factors_return.cov()
+    return adjusted_covariance, pd.Series(factor_volitality, index=all_factors), correlation_matrix, estimated_cov
 
-    # 计算协方差和方差在不同滞后长度下的协方差和方差矩阵
 
-    for lag in range(1, 6):
+def _get_lags(parameters):
 
-        demeaned_lag_factor_return = multiperiod_factor_returns['lag_' + str(lag)] - multiperiod_factor_returns['lag_' + str(lag)].mean()
+    lags = [parameters['NeweyWest_correlation_lags'], parameters['NeweyWest_volatility_lags']]
 
-        for factor in all_factors:
+    return max([0 if np.isnan(lag) else int(lag) for lag in lags])
 
-            estimated_lag_cov[factor] = np.sqrt(correlation_exp_weight).dot((exp_factors_return[factor].values * demeaned_lag_factor_return[factor]).values)
 
-            estimated_lag_var[factor] = np.sqrt(volatility_exp_weight).dot((varexp_factors_return[factor].values * demeaned_lag_factor_return[factor]).values)
+def get_factor_covariance_state(latest_trading_date, all_factors, parameters, state_name):
 
-        if lag <= parameters['NeweyWest_correlation_lags']:
+    # 读取已保存的协方差状态，只取回状态最后一个交易日之后的因子收益率并逐日递推更新；
 
-            intermediate_cov = intermediate_cov + (1 - lag / (1 + parameters.get('NeweyWest_correlation_lags'))) * (estimated_lag_cov + estimated_lag_cov.T)
+    # 状态不存在、参数改变或 latest_trading_date 早于状态最后一个交易日时，取回 factor_return_length + 滞后期数个交易日的因子收益率重新初始化
 
-        intermediate_var = intermediate_var + (1 - lag / (1 + parameters.get('NeweyWest_volatility_lags'))) * (estimated_lag_var + estimated_lag_var.T).replace(np.nan,0)
+    half_lives = [parameters['correlation_half_life'], parameters['volatility_half_life']]
 
-    Newey_West_adjustment_cov = 252 * (estimated_cov + intermediate_cov)
+    number_of_lags = _get_lags(parameters)
 
-    Newey_West_adjustment_var = 252 * (estimated_var + intermediate_var)
+    state = load_covariance_state(state_name)
 
-    # 计算调整风险矩阵各项 volatility和相关系数
+    if state is None or state['factors'] != all_factors or state['length'] != parameters['factor_return_length'] or state['number_of_lags'] != number_of_lags \
+            or not np.array_equal(state['half_lives'], half_lives) or pd.Timestamp(state['dates'][-1]) > pd.Timestamp(latest_trading_date):
 
-    correlation_matrix = pd.DataFrame(index=all_factors,columns=all_factors)
+        trading_dates = rqdatac.get_trading_dates(latest_trading_date - timedelta(days=400), latest_trading_date, country='cn')[-(parameters['factor_return_length'] + number_of_lags):]
 
-    factor_volitality_cov = pd.Series(data=np.sqrt(np.diag(Newey_West_adjustment_cov.astype(np.float))),index=Newey_West_adjustment_cov.index)
+        # 以百分比为单位，所以乘以 100
 
-    factor_volitality = pd.Series(data=np.sqrt(np.diag(Newey_West_adjustment_var.astype(np.float))),index=Newey_West_adjustment_var.index)
+        daily_factor_return = rqdatac.barra.get_factor_return(trading_dates[0], trading_dates[-1], all_factors) * 100
 
-    adjusted_covariance = pd.DataFrame(index=all_factors,columns=all_factors)
+        state = initialize_covariance_state(daily_factor_return[all_factors], half_lives, parameters['factor_return_length'], number_of_lags)
 
-    for factor in all_factors:
+    elif pd.Timestamp(state['dates'][-1]) < pd.Timestamp(latest_trading_date):
 
-        for factors in all_factors:
+        new_factor_return = rqdatac.barra.get_factor_return(rqdatac.get_next_trading_date(state['dates'][-1]), latest_trading_date, all_factors) * 100
 
-            correlation_matrix[factor].loc[factors] = Newey_West_adjustment_cov[factor][factors]/(factor_volitality_cov.loc[factors] * factor_volitality_cov.loc[factor])
+        for date in new_factor_return.index:
 
-            adjusted_covariance[factor][factors] = correlation_matrix[factor].loc[factors] * factor_volitality.loc[factor] * factor_volitality.loc[factors]
+            state = update_covariance_state(state, date, new_factor_return.loc[date, all_factors].values)
 
-    return adjusted_covariance,factor_volitality,correlation_matrix,estimated_cov
+    save_covariance_state(state, state_name)
 
+    return state
 
-def eigenfactor_risk_adjustment(Newey_West_adjustment_cov,factor_volitality,all_factors,estimated_cov):
 
-    eigen_value, eigen_vector = np.linalg.eig(Newey_West_adjustment_cov.astype(np.float))
+def Newey_West_adjustment_from_state(covariance_state, all_factors, parameters):
 
-    eigen_value_matrix = pd.DataFrame(index=Newey_West_adjustment_cov.index, columns=Newey_West_adjustment_cov.index,data=np.diag(eigen_value.reshape(1, len(Newey_West_adjustment_cov.index))[0]))
+    # 与 Newey_West_adjustment 相同，但由协方差状态直接得到各协方差矩阵，不需要历史收益率
 
-    eigen_vector_matrix = pd.DataFrame(data=eigen_vector,index=Newey_West_adjustment_cov.index,columns=Newey_West_adjustment_cov.index)
+    Newey_West_adjustment_cov = 252 * get_state_covariance(covariance_state, parameters['correlation_half_life'], parameters['NeweyWest_correlation_lags'])
 
-    monte_carlo_sampling_number = 10000
+    Newey_West_adjustment_var = 252 * get_state_covariance(covariance_state, parameters['volatility_half_life'], parameters['NeweyWest_volatility_lags'])
 
-    intermediate_eigen_value = pd.DataFrame(data=0,index=all_factors,columns=all_factors)
+    estimated_cov = get_state_covariance(covariance_state, parameters['correlation_half_life'], 0)
 
-    for m in range(1,monte_carlo_sampling_number):
+    return _assemble_Newey_West_adjustment(Newey_West_adjustment_cov, Newey_West_adjustment_var, estimated_cov, all_factors)
 
-        monte_carlo_simulation = pd.DataFrame(columns=all_factors)
 
-        for factor in all_factors:
+def eigenfactor_risk_adjustment(Newey_West_adjustment_cov, factor_volitality, all_factors, estimated_cov=None, monte_carlo_sampling_number=10000, seed=None, processes=1, tolerance=None, return_simulation_statistics=False):
 
-            monte_carlo_simulation[factor] = np.random.normal(0, factor_volitality.loc[factor], size=252)
+    # 特征因子风险调整（见 covariance_operators.parallel_eigenfactor_adjusted_covariance）：在特征因子坐标下分批模拟 monte_carlo_sampling_number 次 252 个交易日的收益率，
 
-        monte_carlo_cov = (monte_carlo_simulation.dot(eigen_vector_matrix)).cov()
+    # 以模拟协方差矩阵特征向量方向上的真实方差 / 模拟方差估计各特征值的偏差，并以此放大特征值；各批使用由 seed 生成的独立随机数流，seed 相同则结果相同，与 processes 无关
 
-        eigen_value_m, eigen_vector_m = np.linalg.eig(monte_carlo_cov.astype(np.float))
+    # 特征因子的方差已包含在 Newey_West_adjustment_cov 中，factor_volitality 和 estimated_cov 不再参与计算，保留参数以兼容原有调用
 
-        eigen_value_m_matrix = pd.DataFrame(index=monte_carlo_cov.index,columns=monte_carlo_cov.index,data=np.diag(eigen_value_m.reshape(1, len(monte_carlo_cov.index))[0]))
+    # processes 不为 1 时由进程池并行模拟；monte_carlo_sampling_number 为模拟次数上限，特征值偏差的标准误全部小于 tolerance 时提前停止（例如盘中 1000 次，盘后 10000 次）
 
-        eigen_value_adjust, eigen_vector_adjust = np.linalg.eig((monte_carlo_cov+estimated_cov).astype(np.float))
+    # return_simulation_statistics 为 True 时同时返回实际模拟次数和各特征值偏差的标准误（Series，按特征值升序），供调用方判断模拟是否充分
 
-        eigen_value_adjust_matrix = pd.DataFrame(index=monte_carlo_cov.index,columns=monte_carlo_cov.index,data=np.diag(eigen_value_adjust.reshape(1, len(monte_carlo_cov.index))[0]))
+    eigenfactor_risk_adjustment_cov, simulated_volatility_bias, completed_simulations, standard_error = parallel_eigenfactor_adjusted_covariance(Newey_West_adjustment_cov.loc[all_factors, all_factors].values, monte_carlo_sampling_number, 252, seed, processes=processes, tolerance=tolerance)
 
-        intermediate_eigen_value = intermediate_eigen_value + (eigen_value_adjust_matrix/eigen_value_m_matrix).replace(np.nan,0)
+    eigenfactor_risk_adjustment_cov = pd.DataFrame(eigenfactor_risk_adjustment_cov, index=all_factors, columns=all_factors)
 
-    pai = intermediate_eigen_value/monte_carlo_sampling_number
+    if return_simulation_statistics:
 
-    eigenfactor_risk_adjustment_cov = eigen_vector_matrix.dot(pai.dot(eigen_value_matrix).dot(eigen_vector_matrix.T))
+        return eigenfactor_risk_adjustment_cov, completed_simulations, pd.Series(standard_error)
 
     return eigenfactor_risk_adjustment_cov
 
@@ -235,13 +236,7 @@ def volatility_regime_adjustment(eigenfactor_risk_adjustment_cov,current_factor_
 
     volatility_regime_exp_weight = get_exponential_weight(parameters['volatilityRegimeAdjustment_half_life'], parameters['factor_return_length'])
 
-    empirical_factor_volitality = pd.Series(data=np.sqrt(np.diag(current_factor_return.cov())),index=current_factor_return.columns)
-
-    bias = pd.Series(index=current_factor_return.index)
-
-    for date in current_factor_return.index.tolist():
-
-        bias.loc[date] = np.square(current_factor_return.loc[date]/empirical_factor_volitality).sum()/len(current_factor_return.columns)
+    bias = volatility_regime_bias(current_factor_return.values)
 
     lambda_f = np.sqrt(volatility_regime_exp_weight.dot(bias)/volatility_regime_exp_weight.sum())
 
@@ -250,7 +245,21 @@ def volatility_regime_adjustment(eigenfactor_risk_adjustment_cov,current_factor_
     return volatility_regime_adjustment_cov
 
 
-def get_factor_covariance(date, parameters):
+def get_volatility_regime_multiplier_series(factor_return, parameters):
+
+    # 回测使用：factor_return 为一段历史的因子收益率（行：交易日，列：因子），返回以每个交易日为窗口终点的 λ_F（从第 factor_return_length 个交易日开始），
+
+    # 与逐日调用 volatility_regime_adjustment 的系数相同；协方差矩阵乘以 λ_F 的平方即为调整后的协方差矩阵
+
+    lambda_f = rolling_volatility_regime_multiplier(factor_return.values, parameters['volatilityRegimeAdjustment_half_life'], parameters['factor_return_length'])
+
+    return pd.Series(lambda_f, index=factor_return.index[parameters['factor_return_length'] - 1:])
+
+
+def get_factor_covariance(date, parameters, state_name=None):
+
+    # 协方差矩阵由保存在本地的协方差状态逐日递推得到（见 get_factor_covariance_state），state_name 默认按参数命名，不同参数的状态分别保存
+
     industry_factors = ['CNE5S_ENERGY', 'CNE5S_CHEM', 'CNE5S_CONMAT', 'CNE5S_MTLMIN', 'CNE5S_MATERIAL', 'CNE5S_AERODEF',
                         'CNE5S_BLDPROD', 'CNE5S_CNSTENG', 'CNE5S_ELECEQP', 'CNE5S_INDCONG', 'CNE5S_MACH',
                         'CNE5S_TRDDIST',
@@ -270,8 +279,16 @@ def get_factor_covariance(date, parameters):
 
     latest_trading_date = rqdatac.get_previous_trading_date((datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)))
 
-    current_factor_return, multiperiod_factor_returns = get_multiperiod_factor_returns(all_factors, latest_trading_date,
-                                                                                       parameters)
+    if state_name is None:
+
+        state_name = 'factor_covariance_' + '_'.join(str(parameters[key]) for key in sorted(parameters))
+
+    covariance_state = get_factor_covariance_state(latest_trading_date, all_factors, parameters, state_name)
+
+    # 状态中保存了窗口内的因子收益率，最后 factor_return_length 个交易日即为当期窗口，用于经验协方差矩阵和波动率偏误调整
+
+    current_factor_return = pd.DataFrame(covariance_state['returns'][-parameters['factor_return_length']:],
+                                         index=covariance_state['dates'][-parameters['factor_return_length']:], columns=all_factors)
 
     # 计算经验协方差矩阵，同时进行年化处理（乘以 252）
 
@@ -281,7 +298,7 @@ def get_factor_covariance(date, parameters):
 
     reformatted_empirical_factor_covariance = empirical_factor_covariance.reset_index()
 
-    Newey_West_adjustment_cov, factor_volitality, correlation_matrix,estimated_cov = Newey_West_adjustment(current_factor_return,multiperiod_factor_returns,all_factors, parameters)
+    Newey_West_adjustment_cov, factor_volitality, correlation_matrix,estimated_cov = Newey_West_adjustment_from_state(covariance_state, all_factors, parameters)
 
     eigenfactor_risk_adjustment_cov = eigenfactor_risk_adjustment(Newey_West_adjustment_cov, factor_volitality,
                                                                   all_factors)
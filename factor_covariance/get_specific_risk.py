@@ -8,6 +8,8 @@ from datetime import timedelta
 import rqdatac
 rqdatac.init('rice','rice',('192.168.10.64',16030))
 
+from covariance_operators import *
+
 
 dailyParameters = {'factor_return_length': 252,
                     'sepcific_volatility_half_life': 42,
@@ -54,52 +56,42 @@ def get_multiperiod_stock_returns(stock_list, latest_trading_date, parameters):
     return daily_specific_return[-parameters.get('factor_return_length'):], multiperiod_specific_return
 
 
-def get_exponential_weight(half_life, length):
-
-    # 生成权重后，需要对数组进行倒序（[::-1]）
-
-    return np.cumprod(np.repeat(1/np.exp(np.log(2)/half_life), length))[::-1]
-
-
 def Newey_West_adjustment(daily_specific_return, multiperiod_specific_return, parameters):
 
-    # 计算经验协方差矩阵，同时进行年化处理（乘以 252）
-
-    stock_list = daily_specific_return.columns.tolist()
-
-    volatility_exp_weight = get_exponential_weight(parameters['sepcific_volatility_half_life'], parameters['factor_return_length'])
+    # 以矩阵运算同时计算所有股票的 Newey West 调整后的特异方差（见 covariance_operators.newey_west_specific_variance），同时进行年化处理（乘以 252）
 
-    correlation_exp_weight = get_exponential_weight(parameters['Newey_West_Auto_correlation_half_life'], parameters['factor_return_length'])
+    # 方差使用 sepcific_volatility_half_life，各滞后期的自协方差使用 Newey_West_Auto_correlation_half_life，Bartlett 权重使用 Newey_West_Auto_Correlation_Lags
 
-    demeaned_daily_specific_return = daily_specific_return - daily_specific_return.mean()
+    number_of_lags = len(multiperiod_specific_return)
 
-    exp_weighted_var = pd.Series(index=stock_list,data=0)
+    # 当期收益率之前补上 number_of_lags 个交易日，得到 (factor_return_length + number_of_lags)×N 的收益率
 
-    estimated_var = pd.Series(index=stock_list,data=0)
+    if number_of_lags > 0:
 
-    intermediate_var = pd.Series(index=stock_list,data=0)
+        specific_returns = np.vstack([multiperiod_specific_return['lag_' + str(number_of_lags)].values[:number_of_lags], daily_specific_return.values])
 
-    for stock in stock_list:
+    else:
 
-        estimated_var.loc[stock] = volatility_exp_weight.dot(demeaned_daily_specific_return[stock].values * demeaned_daily_specific_return[stock].values) / volatility_exp_weight.sum()
+        specific_returns = daily_specific_return.values
 
-    for lag in range(1, 6):
+    specific_variance = newey_west_specific_variance(specific_returns, parameters['factor_return_length'], parameters['sepcific_volatility_half_life'],
+                                                     parameters['Newey_West_Auto_correlation_half_life'], number_of_lags)
 
-        demeaned_lag_specific_return = multiperiod_specific_return['lag_' + str(lag)] - multiperiod_specific_return['lag_' + str(lag)].mean()
+    return pd.Series(252 * specific_variance, index=daily_specific_return.columns)
 
-        for stock in stock_list:
 
-            exp_weighted_var.loc[stock] = correlation_exp_weight.dot(demeaned_lag_specific_return[stock].values * demeaned_lag_specific_return[stock].values) / correlation_exp_weight.sum()
+def get_specific_variance_series(specific_return, parameters):
 
-        intermediate_var = intermediate_var + (1-lag/(1+parameters.get('Newey_West_Auto_correlation_half_life')))*(exp_weighted_var + exp_weighted_var.T)
+    # 回测使用：specific_return 为一段历史的特异收益率（行：交易日，列：股票），返回以每个交易日为窗口终点的 Newey West 调整后的年化特异方差（行：交易日，列：股票），
 
-    Newey_West_adjustment_var = 252 * (estimated_var + intermediate_var)
+    # 从第 factor_return_length + Newey_West_Auto_Correlation_Lags 个交易日开始
 
-    specific_risk_newey_west_adjuestment = Newey_West_adjustment_var * estimated_var
+    number_of_lags = parameters['Newey_West_Auto_Correlation_Lags']
 
-    # 计算该步骤调整风险矩阵各项 volatility和相关系数
+    specific_variance = rolling_newey_west_specific_variance(specific_return.values, parameters['factor_return_length'], parameters['sepcific_volatility_half_life'],
+                                                             parameters['Newey_West_Auto_correlation_half_life'], number_of_lags)
 
-    return specific_risk_newey_west_adjuestment
+    return pd.DataFrame(252 * specific_variance, index=specific_return.index[parameters['factor_return_length'] + number_of_lags - 1:], columns=specific_return.columns)
 
 
 def structural_risk_adjustment(Newey_West_adjustment_var):
@@ -4,6 +4,7 @@ sys.path.append("/Users/rice/Documents/cne5_factors/factor_exposure/")
 
 from operators import *
 from intermediate_variables import *
+from market_data_store import *
 
 
 import numpy as np
@@ -17,7 +18,7 @@ import rqdatac
 rqdatac.init("ricequant", "Ricequant123", ('rqdatad-pro.ricequant.com', 16004))
 
 
-def get_daily_standard_deviation(stock_excess_return, market_cap_on_current_day):
+def get_weighted_standard_deviation(stock_excess_return):
 
     exp_weight = get_exponential_weight(half_life = 42, length = 252)
 
@@ -25,30 +26,19 @@ def get_daily_standard_deviation(stock_excess_return, market_cap_on_current_day)
 
     sum_of_squares = (weighted_stock_excess_return - weighted_stock_excess_return.mean()).pow(2).sum()
 
-    weighted_stock_standard_deviation = sum_of_squares.divide(len(stock_excess_return) - 1).pow(0.5)
-
-    processed_weighted_stock_standard_deviation = winsorization_and_market_cap_weighed_standardization(weighted_stock_standard_deviation, market_cap_on_current_day)
-
-    return processed_weighted_stock_standard_deviation
+    return sum_of_squares.divide(len(stock_excess_return) - 1).pow(0.5)
 
 
-def get_cumulative_range(stock_list, date, market_cap_on_current_day):
-
-    trading_date_253_before = rqdatac.get_trading_dates(date - timedelta(days=500), date, country='cn')[-253]
-
-    daily_return = rqdatac.get_price(stock_list, trading_date_253_before, date, frequency='1d', fields='close').fillna(method='ffill').pct_change()[1:]
-
-    # 剔除收益率数据存在空值的股票
+def get_daily_standard_deviation(stock_excess_return, market_cap_on_current_day):
 
-    inds = daily_return.isnull().sum()[daily_return.isnull().sum() > 0].index
+    weighted_stock_standard_deviation = get_weighted_standard_deviation(stock_excess_return)
 
-    daily_return = daily_return.drop(daily_return[inds], axis=1)
+    processed_weighted_stock_standard_deviation = winsorization_and_market_cap_weighed_standardization(weighted_stock_standard_deviation, market_cap_on_current_day)
 
-    # 把复利无风险日收益率转为日收益率
+    return processed_weighted_stock_standard_deviation
 
-    compounded_risk_free_return = rqdatac.get_yield_curve(start_date=trading_date_253_before, end_date=date, tenor='3M')
 
-    risk_free_return = (((1 + compounded_risk_free_return) ** (1 / 365)) - 1).loc[daily_return.index]
+def get_cumulative_return_range(daily_return, risk_free_return):
 
     # 每21个交易日为一个时间区间
 
@@ -66,7 +56,20 @@ def get_cumulative_range(stock_list, date, market_cap_on_current_day):
 
     cumulative_return = cumulative_return.cumsum(axis=1)
 
-    processed_cumulative_range = winsorization_and_market_cap_weighed_standardization(cumulative_return.T.max() - cumulative_return.T.min(), market_cap_on_current_day)
+    return cumulative_return.T.max() - cumulative_return.T.min()
+
+
+def get_cumulative_range(market_context):
+
+    # 过去 252 个交易日的日收益率（已剔除收益率数据存在空值的股票）
+
+    daily_return = market_context.stock_daily_return
+
+    risk_free_return = market_context.risk_free_return[['3M']].loc[daily_return.index]
+
+    cumulative_return_range = get_cumulative_return_range(daily_return, risk_free_return)
+
+    processed_cumulative_range = winsorization_and_market_cap_weighed_standardization(cumulative_return_range, market_context.market_cap_on_current_day)
 
     return processed_cumulative_range
 
@@ -79,13 +82,12 @@ def get_historical_sigma(stock_excess_return, market_portfolio_excess_return, ma
 
     weighted_market_portfolio_excess_return = market_portfolio_excess_return.multiply(exp_weight).T
 
-    weighted_residual_volatility = pd.Series()
+    alpha, weighted_residual_volatility = get_alpha_and_residual_volatility(weighted_stock_excess_return, weighted_market_portfolio_excess_return, market_portfolio_beta)
 
-    for stock in stock_excess_return.columns:
+    return get_historical_sigma_exposure(weighted_residual_volatility, market_portfolio_beta_exposure, market_cap_on_current_day)
 
-        alpha =  weighted_stock_excess_return[stock].mean() - market_portfolio_beta[stock] * weighted_market_portfolio_excess_return.mean()
 
-        weighted_residual_volatility[stock] = (weighted_stock_excess_return[stock] - market_portfolio_beta[stock] * weighted_market_portfolio_excess_return - alpha).std()
+def get_historical_sigma_exposure(weighted_residual_volatility, market_portfolio_beta_exposure, market_cap_on_current_day):
 
     # 相对于贝塔正交化，降低波动率因子和贝塔因子的共线性
 
@@ -98,15 +100,15 @@ def get_historical_sigma(stock_excess_return, market_portfolio_excess_return, ma
 
 def get_earnings_to_price_ratio(latest_trading_date,recent_report_type,market_cap_on_current_day):
 
-    net_profit_ttm = get_ttm_sum(rqdatac.financials.income_statement.profit_before_tax, recent_report_type)
+    net_profit_ttm = get_ttm_sum('profit_before_tax', recent_report_type, latest_trading_date)
 
     stock_list = net_profit_ttm.index.tolist()
 
-    stock_price = rqdatac.get_price(stock_list, start_date=latest_trading_date, end_date=latest_trading_date, fields='close', adjust_type='none').T
+    stock_price = get_market_data_on_date(stock_list, latest_trading_date, 'unadjusted_close')
 
-    shares = rqdatac.get_shares(stock_list,start_date=latest_trading_date,end_date=latest_trading_date,fields='total').T
+    shares = get_market_data_on_date(stock_list, latest_trading_date, 'total')
 
-    earning_to_price = net_profit_ttm / (stock_price * shares)[str(latest_trading_date)]
+    earning_to_price = net_profit_ttm / (stock_price * shares)
 
     processed_earning_to_price= winsorization_and_market_cap_weighed_standardization(earning_to_price, market_cap_on_current_day[earning_to_price.index])
 
@@ -115,15 +117,15 @@ def get_earnings_to_price_ratio(latest_trading_date,recent_report_type,market_ca
 
 def get_cash_earnings_to_price_ratio(latest_trading_date,recent_report_type,market_cap_on_current_day):
 
-    cash_ttm = get_ttm_sum(rqdatac.financials.cash_flow_statement.cash_flow_from_operating_activities, recent_report_type)
+    cash_ttm = get_ttm_sum('cash_flow_from_operating_activities', recent_report_type, latest_trading_date)
 
     stock_list = cash_ttm.index.tolist()
 
-    stock_price = rqdatac.get_price(stock_list, start_date=latest_trading_date, end_date=latest_trading_date, fields='close', adjust_type='none').T
+    stock_price = get_market_data_on_date(stock_list, latest_trading_date, 'unadjusted_close')
 
-    shares = rqdatac.get_shares(stock_list,start_date=latest_trading_date,end_date=latest_trading_date,fields='total').T
+    shares = get_market_data_on_date(stock_list, latest_trading_date, 'total')
 
-    cash_earning_to_price = cash_ttm / (stock_price * shares)[str(latest_trading_date)]
+    cash_earning_to_price = cash_ttm / (stock_price * shares)
 
     processed_cash_earning_to_price= winsorization_and_market_cap_weighed_standardization(cash_earning_to_price, market_cap_on_current_day[cash_earning_to_price.index])
 
@@ -147,11 +149,11 @@ def get_market_leverage(market_cap_on_current_day, last_reported_non_current_lia
 
 # DTOA:Debt_to_asset：total debt/total assets
 
-def get_debt_to_assets(market_cap_on_current_day, recent_report_type):
+def get_debt_to_assets(market_cap_on_current_day, recent_report_type, latest_trading_date):
 
-    total_debt = get_last_reported_values(rqdatac.financials.balance_sheet.total_liabilities, recent_report_type)
+    total_debt = get_last_reported_values('total_liabilities', recent_report_type, latest_trading_date)
 
-    total_asset = get_last_reported_values(rqdatac.financials.balance_sheet.total_assets, recent_report_type)
+    total_asset = get_last_reported_values('total_assets', recent_report_type, latest_trading_date)
 
     debt_to_asset = total_debt/total_asset
 
@@ -164,9 +166,9 @@ def get_debt_to_assets(market_cap_on_current_day, recent_report_type):
 
 # 普通股账面价值（book value of common equity，BE）用实收资本（paid in capital）表示
 
-def get_book_leverage(market_cap_on_current_day, last_reported_non_current_liabilities, last_reported_preferred_stock, recent_report_type):
+def get_book_leverage(market_cap_on_current_day, last_reported_non_current_liabilities, last_reported_preferred_stock, recent_report_type, latest_trading_date):
 
-    book_value_of_common_stock = get_last_reported_values(rqdatac.financials.balance_sheet.paid_in_capital, recent_report_type)
+    book_value_of_common_stock = get_last_reported_values('paid_in_capital', recent_report_type, latest_trading_date)
 
     book_leverage = (book_value_of_common_stock + last_reported_preferred_stock + last_reported_non_current_liabilities)/book_value_of_common_stock
 
@@ -177,7 +179,7 @@ def get_book_leverage(market_cap_on_current_day, last_reported_non_current_liabi
 
 def get_sales_growth(date, market_cap_on_current_day, recent_five_annual_shares, recent_report_type):
 
-    recent_five_annual_sales_revenue = recent_five_annual_values(rqdatac.financials.income_statement.revenue, date, recent_report_type)
+    recent_five_annual_sales_revenue = recent_five_annual_values('revenue', date, recent_report_type)
 
     # 上面函数默认取出当前所有上市股票的财务数据，包含一部分在计算日期未上市的股票，因此需要取子集
 
@@ -200,7 +202,7 @@ def get_sales_growth(date, market_cap_on_current_day, recent_five_annual_shares,
 
 def get_earnings_growth(date, market_cap_on_current_day, recent_five_annual_shares, recent_report_type):
 
-    recent_five_annual_net_profit = recent_five_annual_values(rqdatac.financials.income_statement.net_profit, date, recent_report_type)
+    recent_five_annual_net_profit = recent_five_annual_values('net_profit', date, recent_report_type)
 
     # 上面函数默认取出当前所有上市股票的财务数据，包含一部分在计算日期未上市的股票，因此需要取子集
 
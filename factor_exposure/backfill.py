@@ -0,0 +1,192 @@
+###### 历史数据并行回填 ######
+
+
+### 模块说明 ###
+
+# 风格因子暴露度和因子收益率按交易日互相独立，回填历史数据时把交易日分配给多个进程并行计算。
+
+# 每个进程只在启动时导入一次计算模块（模块导入时调用 rqdatac.init），之后在该进程内逐日计算；
+
+# 每个交易日的结果计算完成后立即写入 backfill_path/<task_name>/<date>.pkl，作为断点记录：重新运行时跳过已有结果的交易日，从中断处继续。
+
+# 子进程使用 spawn 方式启动，避免 fork 复制主进程中已经建立的数据服务器连接。
+
+# 子进程共用本地行情数据仓库（market_data_store）和财务报表数据仓库（financial_statement_store）：两者以唯一的临时文件写入、以文件锁保护每个分区的读取-修改-写入，
+
+# 子进程可以安全地下载并写入本地缺失的数据。为避免各子进程重复请求同一批数据，启动进程池之前由主进程一次性下载回填区间所需的行情数据（包括计算股本变化所需的更早的股本数据）。
+
+# 用法：python backfill.py style_factors 2010-01-01 2018-07-18 32
+
+
+import os
+import sys
+import pickle
+import importlib
+import traceback
+import multiprocessing
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from market_data_store import *
+from market_context import benchmark_list
+
+
+### paths for saving files ###
+
+backfill_path = os.path.join(os.path.expanduser('~'), 'cne5_factors_data', 'backfill')
+
+
+# 任务名称：（模块所在目录，模块名称，按交易日计算的函数名称）
+
+backfill_tasks = {
+
+    'style_factors': (os.path.dirname(os.path.abspath(__file__)), 'get_style_factors', 'get_style_factors'),
+
+    'implicit_factor_return': (os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'implicit_factor_return'), 'get_implicit_factor_return', 'get_implicit_factor_return'),
+
+    'pure_factor_return': (os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'implicit_factor_return'), 'pure_factor_returns', 'pure_factor_return'),
+
+    'factor_and_specific_return': (os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'implicit_factor_return'), 'get_implicit_factor_return', 'get_implicit_factor_and_specific_return')}
+
+
+# 每个子进程中按交易日计算的函数，由 _initialize_worker 设置
+
+_worker_function = None
+
+
+def _initialize_worker(task_name):
+
+    global _worker_function
+
+    module_path, module_name, function_name = backfill_tasks[task_name]
+
+    sys.path.insert(0, module_path)
+
+    _worker_function = getattr(importlib.import_module(module_name), function_name)
+
+
+def _get_result_path(task_name, date):
+
+    return os.path.join(backfill_path, task_name, date + '.pkl')
+
+
+def _run_date(task_name_and_date):
+
+    task_name, date = task_name_and_date
+
+    try:
+
+        result = _worker_function(date)
+
+    except Exception:
+
+        return date, traceback.format_exc()
+
+    # 先写临时文件再替换，中断时不会留下不完整的结果，已有结果的交易日即视为完成
+
+    complete_path = _get_result_path(task_name, date)
+
+    temp_path = complete_path + '.tmp'
+
+    with open(temp_path, 'wb') as temp_file:
+
+        pickle.dump(result, temp_file)
+
+    os.replace(temp_path, complete_path)
+
+    return date, None
+
+
+def get_pending_dates(task_name, start_date, end_date):
+
+    trading_dates = [trading_date.strftime('%Y-%m-%d') for trading_date in get_trading_calendar(start_date, end_date)]
+
+    return [date for date in trading_dates if not os.path.exists(_get_result_path(task_name, date))]
+
+
+def warm_market_data_store(start_date, end_date):
+
+    # 风格因子的行情数据窗口最长为 525 个交易日；指数收盘价也需要预先写入，否则子进程会同时登记新的代码
+
+    lookback_start_date = get_trading_date_before(start_date, 525)
+
+    backfill_market_data(lookback_start_date, end_date)
+
+    get_market_data(benchmark_list, lookback_start_date, end_date, 'close')
+
+    # 成长因子和股本相关的细分因子读取最近五个年报（最早为 6 年前）的股本
+
+    backfill_market_data(pd.Timestamp(start_date) - pd.DateOffset(years=7), lookback_start_date, fields=['total_a', 'total'])
+
+
+def run_backfill(task_name, start_date, end_date, processes=None):
+
+    os.makedirs(os.path.join(backfill_path, task_name), exist_ok=True)
+
+    pending_dates = get_pending_dates(task_name, start_date, end_date)
+
+    print(task_name, len(pending_dates), 'trading dates to compute')
+
+    if len(pending_dates) == 0:
+
+        return []
+
+    if task_name == 'style_factors':
+
+        warm_market_data_store(pending_dates[0], pending_dates[-1])
+
+    failed_dates = []
+
+    pool = multiprocessing.get_context('spawn').Pool(processes=processes, initializer=_initialize_worker, initargs=(task_name,))
+
+    try:
+
+        for date, error in pool.imap_unordered(_run_date, [(task_name, date) for date in pending_dates]):
+
+            if error is None:
+
+                print(task_name, date, 'is done')
+
+            else:
+
+                failed_dates.append(date)
+
+                print(task_name, date, 'failed\n', error)
+
+    finally:
+
+        pool.close()
+
+        pool.join()
+
+    # 失败的交易日没有写入结果，再次运行时会重新计算
+
+    print(task_name, len(pending_dates) - len(failed_dates), 'trading dates are done,', len(failed_dates), 'failed')
+
+    return failed_dates
+
+
+def load_backfill_results(task_name, start_date, end_date):
+
+    results = {}
+
+    for trading_date in get_trading_calendar(start_date, end_date):
+
+        complete_path = _get_result_path(task_name, trading_date.strftime('%Y-%m-%d'))
+
+        if os.path.exists(complete_path):
+
+            with open(complete_path, 'rb') as pkfl:
+
+                results[trading_date] = pickle.load(pkfl)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    task_name, start_date, end_date = sys.argv[1], sys.argv[2], sys.argv[3]
+
+    processes = int(sys.argv[4]) if len(sys.argv) > 4 else None
+
+    run_backfill(task_name, start_date, end_date, processes)
@@ -0,0 +1,291 @@
+###### 本地因子数据仓库 ######
+
+
+### 模块说明 ###
+
+# fundamental_based_style_factor_exposure 和 style_factor_exposure_imputation 原本把每个因子（以及基本面数据、细分因子权重）的整段历史各保存为一个 pickle，
+
+# 每次运行都要读入全部历史数据，再重新写出全部历史数据。本模块按因子、按月份分区保存因子数据（行：交易日，列：股票代码），
+
+# 追加一个交易日只需改写当月的分区；读取时使用 memory mapping，只把所需的交易日、股票和因子读入内存。
+
+
+### 存储结构 ###
+
+# factor_store_path/<factor>/order_book_ids.pkl ：该因子的股票代码（或权重名称）列表，只追加不删除，数组的列顺序与其一致；
+
+# factor_store_path/<factor>/<year-month>.npy ：该月份已保存交易日的因子数据（列数为写入时的股票数量，之后新增的股票在读取时补 NaN）；
+
+# factor_store_path/<factor>/<year-month>_dates.npy ：该月份已保存的交易日。
+
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from market_data_store import _save_array, _load_pickle, _register_order_book_ids, _file_lock
+
+
+### paths for saving files ###
+
+factor_store_path = os.path.join(os.path.expanduser('~'), 'cne5_factors_data', 'factor_store')
+
+
+def _order_book_ids_path(factor_name):
+
+    return os.path.join(factor_store_path, factor_name, 'order_book_ids.pkl')
+
+
+def _partition_paths(factor_name, month):
+
+    factor_path = os.path.join(factor_store_path, factor_name)
+
+    return os.path.join(factor_path, month + '.npy'), os.path.join(factor_path, month + '_dates.npy')
+
+
+def _get_months(factor_name):
+
+    factor_path = os.path.join(factor_store_path, factor_name)
+
+    if not os.path.exists(factor_path):
+
+        return []
+
+    return sorted(file_name[:7] for file_name in os.listdir(factor_path) if len(file_name) == 11 and file_name.endswith('.npy'))
+
+
+def _load_partition(factor_name, month, mmap_mode='r'):
+
+    values_path, dates_path = _partition_paths(factor_name, month)
+
+    if not os.path.exists(dates_path):
+
+        return pd.DatetimeIndex([]), np.empty((0, 0))
+
+    dates, values = pd.DatetimeIndex(np.load(dates_path)), np.load(values_path, mmap_mode=mmap_mode)
+
+    # 两个文件分别替换，写入中断时行数可能不一致：视为分区不存在
+
+    if len(dates) != values.shape[0]:
+
+        return pd.DatetimeIndex([]), np.empty((0, 0))
+
+    return dates, values
+
+
+def factor_data_exists(factor_name):
+
+    return os.path.exists(_order_book_ids_path(factor_name))
+
+
+def _write_partition(factor_name, month, month_data, all_order_book_ids, column_positions):
+
+    dates, values = _load_partition(factor_name, month, mmap_mode=None)
+
+    updated_dates = dates.union(month_data.index)
+
+    updated_values = np.full((len(updated_dates), len(all_order_book_ids)), np.nan)
+
+    updated_values[updated_dates.get_indexer(dates), :values.shape[1]] = values
+
+    rows = updated_dates.get_indexer(month_data.index)
+
+    updated_values[rows, :] = np.nan
+
+    updated_values[np.ix_(rows, column_positions)] = month_data.values.astype(np.float64)
+
+    values_path, dates_path = _partition_paths(factor_name, month)
+
+    # 交易日最后写入
+
+    _save_array(values_path, updated_values)
+
+    _save_array(dates_path, updated_dates.values.astype('datetime64[D]'))
+
+
+def append_factor_data(factor_name, factor_data):
+
+    # factor_data 为 DataFrame（index 为交易日，columns 为股票代码），或某一交易日的横截面 Series（name 为交易日）
+
+    # 写入的交易日整行替换已保存的数据，其余交易日不变；只改写涉及的月份分区
+
+    if isinstance(factor_data, pd.Series):
+
+        factor_data = factor_data.to_frame().T
+
+    factor_data = factor_data.copy()
+
+    factor_data.index = pd.DatetimeIndex(factor_data.index).normalize()
+
+    all_order_book_ids = _register_order_book_ids(factor_data.columns, _order_book_ids_path(factor_name))
+
+    column_positions = pd.Series(np.arange(len(all_order_book_ids)), index=all_order_book_ids)[factor_data.columns].values
+
+    for month, month_data in factor_data.groupby(factor_data.index.strftime('%Y-%m')):
+
+        values_path, dates_path = _partition_paths(factor_name, month)
+
+        # 读取-修改-写入持有分区的排他锁；其他进程可能已登记新的代码，在锁内重新读取代码列表（只追加，已有代码的位置不变）
+
+        with _file_lock(values_path):
+
+            all_order_book_ids = _register_order_book_ids(factor_data.columns, _order_book_ids_path(factor_name))
+
+            _write_partition(factor_name, month, month_data, all_order_book_ids, column_positions)
+
+
+def get_factor_dates(factor_name):
+
+    # 返回该因子已保存的全部交易日，只读取各月份分区的交易日文件
+
+    dates = [_load_partition(factor_name, month)[0] for month in _get_months(factor_name)]
+
+    return dates[0].append(dates[1:]) if len(dates) > 0 else pd.DatetimeIndex([])
+
+
+def get_missing_dates(factor_names, dates):
+
+    # dates 中尚未保存在 factor_names 任一因子中的交易日，用于只计算新增的交易日
+
+    dates = pd.DatetimeIndex(dates).normalize()
+
+    stored_dates = [get_factor_dates(factor_name) for factor_name in factor_names]
+
+    return dates[~np.all([dates.isin(factor_dates) for factor_dates in stored_dates], axis=0)] if len(stored_dates) > 0 else dates
+
+
+def get_factor_data(factor_name, start_date=None, end_date=None, order_book_ids=None):
+
+    # 返回 DataFrame，index 为交易日，columns 为 order_book_ids（默认为该因子已保存的全部股票）；不指定 start_date / end_date 时读取全部历史
+
+    # factor_name 为列表时返回字典，key 为因子名称
+
+    if isinstance(factor_name, list):
+
+        return {name: get_factor_data(name, start_date, end_date, order_book_ids) for name in factor_name}
+
+    complete_path = _order_book_ids_path(factor_name)
+
+    all_order_book_ids = _load_pickle(complete_path) if os.path.exists(complete_path) else []
+
+    order_book_ids = all_order_book_ids if order_book_ids is None else list(order_book_ids)
+
+    column_positions = pd.Series(np.arange(len(all_order_book_ids)), index=all_order_book_ids).reindex(order_book_ids).values
+
+    start_date = pd.Timestamp.min if start_date is None else pd.Timestamp(start_date)
+
+    end_date = pd.Timestamp.max if end_date is None else pd.Timestamp(end_date)
+
+    factor_data = []
+
+    for month in _get_months(factor_name):
+
+        if month < start_date.strftime('%Y-%m') or month > end_date.strftime('%Y-%m'):
+
+            continue
+
+        dates, values = _load_partition(factor_name, month)
+
+        rows = np.where((dates >= start_date) & (dates <= end_date))[0]
+
+        # 分区写入之后才出现的股票，以及仓库中没有的股票，取值为 NaN
+
+        stored_columns = ~np.isnan(column_positions) & (np.nan_to_num(column_positions, nan=-1) < values.shape[1])
+
+        month_values = np.full((len(rows), len(order_book_ids)), np.nan)
+
+        month_values[:, stored_columns] = values[np.ix_(rows, column_positions[stored_columns].astype(np.int64))]
+
+        factor_data.append(pd.DataFrame(month_values, index=dates[rows], columns=order_book_ids))
+
+    if len(factor_data) == 0:
+
+        return pd.DataFrame(columns=order_book_ids, dtype=np.float64)
+
+    return pd.concat(factor_data, axis=0)
+
+
+def _get_store_mtime(factor_name):
+
+    # 该因子最后一次写入或导入的时间（各月份分区文件和代码列表文件修改时间的最大值）；仓库中没有该因子时为 None
+
+    partition_paths = [path for month in _get_months(factor_name) for path in _partition_paths(factor_name, month)]
+
+    if len(partition_paths) == 0:
+
+        return None
+
+    # 导入 pickle 时更新代码列表文件的修改时间（见 _append_changed_rows）
+
+    return max(os.path.getmtime(path) for path in partition_paths + [_order_book_ids_path(factor_name)])
+
+
+def _append_changed_rows(factor_name, factor_data):
+
+    # 只写入新增或取值发生变化的交易日（上游重新生成的 pickle 通常只在最后新增交易日），未变化的月份分区不改写
+
+    factor_data = factor_data.astype(np.float64)
+
+    factor_data.index = pd.DatetimeIndex(factor_data.index).normalize()
+
+    stored_data = get_factor_data(factor_name, factor_data.index.min(), factor_data.index.max(), factor_data.columns).reindex(factor_data.index)
+
+    changed_rows = ~((stored_data.values == factor_data.values) | (np.isnan(stored_data.values) & np.isnan(factor_data.values))).all(axis=1)
+
+    changed_rows |= ~factor_data.index.isin(get_factor_dates(factor_name))
+
+    if changed_rows.any():
+
+        append_factor_data(factor_name, factor_data[changed_rows])
+
+    # 记录导入时间：pickle 未再重新生成时不再重复比较
+
+    if factor_data_exists(factor_name):
+
+        os.utime(_order_book_ids_path(factor_name))
+
+
+def import_factor_pickle(pickle_path, factor_name=None):
+
+    # 把原有的整段历史 pickle 导入因子数据仓库：DataFrame（index 为交易日）保存为 factor_name（默认为文件名）；
+
+    # Panel 或字典（例如 df_fundamental.pkl）的每个字段分别保存为一个因子。仓库中已有的交易日只在取值变化时改写
+
+    data = _load_pickle(pickle_path)
+
+    if isinstance(data, pd.DataFrame):
+
+        _append_changed_rows(os.path.splitext(os.path.basename(pickle_path))[0] if factor_name is None else factor_name, data)
+
+    else:
+
+        for field in data.keys():
+
+            _append_changed_rows(field, data[field])
+
+
+def refresh_factor_pickle(factor_name, pickle_path):
+
+    # 上游步骤仍以 pickle 形式输出的因子：仓库中尚无该因子，或 pickle 在仓库最后一次写入之后重新生成时，重新导入
+
+    factor_names = factor_name if isinstance(factor_name, list) else [factor_name]
+
+    if not os.path.exists(pickle_path):
+
+        return
+
+    store_mtimes = [_get_store_mtime(name) for name in factor_names]
+
+    if any(store_mtime is None or os.path.getmtime(pickle_path) > store_mtime for store_mtime in store_mtimes):
+
+        import_factor_pickle(pickle_path, None if isinstance(factor_name, list) else factor_name)
+
+
+def load_factor_data(factor_name, pickle_path, start_date=None, end_date=None):
+
+    # 读取因子数据（不指定 start_date / end_date 时读取全部历史）；读取前检查上游的 pickle 是否重新生成，若是则先导入新增或变化的交易日
+
+    refresh_factor_pickle(factor_name, pickle_path)
+
+    return get_factor_data(factor_name, start_date, end_date)
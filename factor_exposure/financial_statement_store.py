@@ -0,0 +1,202 @@
+###### 本地财务报表数据仓库 ######
+
+
+### 模块说明 ###
+
+# get_ttm_sum、get_last_reported_values 和 recent_five_annual_values 原本每次调用都向数据服务器请求全市场的财务报表数据，
+
+# 而同一报告期的财务数据在披露截止日之后基本不再变化。本模块按（字段，报告期）把全市场财务数据保存在本地，每个报告期只下载一次。
+
+# 同时保存每只股票每个报告期的公告日期（announce_date），可按计算日期剔除当时尚未公告的数据（point-in-time）。
+
+
+### 存储结构 ###
+
+# financial_statement_path/<field>/<quarter>.pkl ：（下载日期，该报告期全市场股票的字段取值 Series）；
+
+# 报告期在披露截止日之前下载的数据视为不完整（部分公司尚未公告），计算日期晚于下载日期时重新下载。
+
+
+import os
+
+import numpy as np
+import pandas as pd
+
+import rqdatac
+
+rqdatac.init("ricequant", "Ricequant123", ('rqdatad-pro.ricequant.com', 16004))
+
+from market_data_store import _save_pickle, _load_pickle, _file_lock
+
+
+### paths for saving files ###
+
+financial_statement_path = os.path.join(os.path.expanduser('~'), 'cne5_factors_data', 'financial_statements')
+
+
+# 字段名称与 rqdatac 财务报表字段的对应关系
+
+financial_statement_fields = {
+
+    'announce_date': rqdatac.financials.announce_date,
+
+    'profit_before_tax': rqdatac.financials.income_statement.profit_before_tax,
+
+    'net_profit': rqdatac.financials.income_statement.net_profit,
+
+    'revenue': rqdatac.financials.income_statement.revenue,
+
+    'basic_earnings_per_share': rqdatac.financials.income_statement.basic_earnings_per_share,
+
+    'earnings_per_share': rqdatac.financials.financial_indicator.earnings_per_share,
+
+    'cash_flow_from_operating_activities': rqdatac.financials.cash_flow_statement.cash_flow_from_operating_activities,
+
+    'total_liabilities': rqdatac.financials.balance_sheet.total_liabilities,
+
+    'total_assets': rqdatac.financials.balance_sheet.total_assets,
+
+    'paid_in_capital': rqdatac.financials.balance_sheet.paid_in_capital,
+
+    'total_equity': rqdatac.financials.balance_sheet.total_equity,
+
+    'non_current_liabilities': rqdatac.financials.balance_sheet.non_current_liabilities,
+
+    'equity_prefer_stock': rqdatac.financials.balance_sheet.equity_prefer_stock}
+
+
+# 各报告期的法定披露截止日（一季报 4 月 30 日，半年报 8 月 31 日，三季报 10 月 31 日，年报次年 4 月 30 日）
+
+def get_disclosure_deadline(quarter):
+
+    year = int(quarter[:4])
+
+    deadlines = {'q1': str(year) + '-04-30', 'q2': str(year) + '-08-31', 'q3': str(year) + '-10-31', 'q4': str(year + 1) + '-04-30'}
+
+    return pd.Timestamp(deadlines[quarter[-2:]])
+
+
+def _quarter_number(quarter):
+
+    return int(quarter[:4]) * 4 + int(quarter[-1]) - 1
+
+
+def get_previous_quarters(quarter, number_of_quarters):
+
+    # 返回以 quarter 结尾的 number_of_quarters 个报告期，按时间先后排序，例如 get_previous_quarters('2017q2', 3) = ['2016q4', '2017q1', '2017q2']
+
+    return [str(number // 4) + 'q' + str(number % 4 + 1) for number in range(_quarter_number(quarter) - number_of_quarters + 1, _quarter_number(quarter) + 1)]
+
+
+def _statement_path(field, quarter):
+
+    return os.path.join(financial_statement_path, field, quarter + '.pkl')
+
+
+def _is_outdated(field, quarter, date):
+
+    complete_path = _statement_path(field, quarter)
+
+    if not os.path.exists(complete_path):
+
+        return True
+
+    fetched_date, statement = _load_pickle(complete_path)
+
+    # 披露截止日之后下载的数据不再更新；截止日之前下载的数据，在之后的交易日重新下载
+
+    return fetched_date <= get_disclosure_deadline(quarter) and fetched_date < pd.Timestamp(date).normalize()
+
+
+def _fetch_financial_statements(fields, quarters):
+
+    # 一次请求取出 quarters 中最早至最晚报告期之间的全部数据，公告日期与字段一起取出
+
+    query_fields = list(fields) if 'announce_date' in fields else list(fields) + ['announce_date']
+
+    fetched_quarters = get_previous_quarters(quarters[-1], _quarter_number(quarters[-1]) - _quarter_number(quarters[0]) + 1)
+
+    financial_data = rqdatac.get_financials(rqdatac.query(*[financial_statement_fields[field] for field in query_fields]), quarter=quarters[-1], interval=str(len(fetched_quarters)) + 'q', country='cn')
+
+    fetched_date = pd.Timestamp.today().normalize()
+
+    for field in query_fields:
+
+        # 多个字段时 rqdatac 返回 Panel（items 为字段名称，major_axis 为报告期，minor_axis 为股票代码）
+
+        field_data = financial_data[field]
+
+        os.makedirs(os.path.join(financial_statement_path, field), exist_ok=True)
+
+        # 区间内的报告期都已下载，一并保存
+
+        for quarter in fetched_quarters:
+
+            statement = field_data.loc[quarter] if quarter in field_data.index else pd.Series(np.nan, index=field_data.columns)
+
+            _save_pickle(_statement_path(field, quarter), (fetched_date, statement))
+
+
+def prefetch_financial_statements(fields, quarters, date=None):
+
+    # 对需要更新的字段发出一次多字段请求，之后各因子函数调用 get_financial_statements 时直接读取本地数据
+
+    date = pd.Timestamp.today() if date is None else pd.Timestamp(date)
+
+    quarters = sorted(quarters)
+
+    outdated_fields = [field for field in fields if any(_is_outdated(field, quarter, date) for quarter in quarters)]
+
+    if len(outdated_fields) > 0:
+
+        # 多个进程同时回填时，持有排他锁后重新检查，已由其他进程下载的字段不再下载
+
+        with _file_lock(os.path.join(financial_statement_path, 'fetch')):
+
+            outdated_fields = [field for field in fields if any(_is_outdated(field, quarter, date) for quarter in quarters)]
+
+            if len(outdated_fields) > 0:
+
+                _fetch_financial_statements(outdated_fields, quarters)
+
+
+def _parse_announce_dates(announce_dates):
+
+    # 公告日期为 20170428 形式的整数；同一列存在缺失值时为浮点数（20170428.0），直接转为字符串无法解析，先转为整数
+
+    announce_dates = pd.to_numeric(announce_dates, errors='coerce').dropna()
+
+    return pd.to_datetime(announce_dates.astype(np.int64).astype(str), format='%Y%m%d', errors='coerce')
+
+
+def get_financial_statements(field, quarters, date=None):
+
+    # 返回 DataFrame，index 为股票代码，columns 为报告期；若指定 date，剔除在 date 之后才公告的数据
+
+    date = pd.Timestamp.today() if date is None else pd.Timestamp(date)
+
+    quarters = sorted(quarters)
+
+    outdated_quarters = [quarter for quarter in quarters if _is_outdated(field, quarter, date)]
+
+    # 未经 prefetch_financial_statements 批量下载的数据，在此单独下载
+
+    if len(outdated_quarters) > 0:
+
+        with _file_lock(os.path.join(financial_statement_path, 'fetch')):
+
+            outdated_quarters = [quarter for quarter in quarters if _is_outdated(field, quarter, date)]
+
+            if len(outdated_quarters) > 0:
+
+                _fetch_financial_statements([field], outdated_quarters)
+
+    # 下载字段时同时下载了公告日期，因此公告日期文件一定存在
+
+    financial_statements = pd.DataFrame({quarter: _load_pickle(_statement_path(field, quarter))[1] for quarter in quarters})
+
+    announce_dates = pd.DataFrame({quarter: _load_pickle(_statement_path('announce_date', quarter))[1] for quarter in quarters}).reindex(financial_statements.index)
+
+    announce_dates = announce_dates.apply(_parse_announce_dates)
+
+    return financial_statements.where(~(announce_dates > date))
@@ -1,6 +1,7 @@
 
 from intermediate_variables import *
 from operators import *
+from market_data_store import *
 
 import numpy as np
 import pandas as pd
@@ -20,13 +21,7 @@ def get_market_portfolio_beta(stock_excess_return, market_portfolio_excess_retur
 
     weighted_market_portfolio_excess_return = market_portfolio_excess_return.multiply(exp_weight).T
 
-    weighted_market_portfolio_variance = weighted_market_portfolio_excess_return.var()
-
-    beta = [weighted_market_portfolio_excess_return.cov(
-        weighted_stock_excess_return[stock]) / weighted_market_portfolio_variance for stock in
-            stock_excess_return.columns]
-
-    market_portfolio_beta = pd.Series(beta, index=stock_excess_return.columns)
+    market_portfolio_beta = get_beta_matrix(weighted_stock_excess_return, weighted_market_portfolio_excess_return)
 
     market_portfolio_beta_exposure = winsorization_and_market_cap_weighed_standardization(market_portfolio_beta,
                                                                                           market_cap_on_current_day)
@@ -48,8 +43,7 @@ def get_momentum(stock_list, date, market_cap_on_current_day):
 
     # 提取股票价格数据，对于退市情况，考虑作股价向前填补（日收益率为0）
 
-    daily_return = rqdatac.get_price(stock_list, trading_date_525_before, trading_date_21_before, frequency='1d',
-                                     fields='close').fillna(method='ffill').pct_change()[1:]
+    daily_return = get_market_data(stock_list, trading_date_525_before, trading_date_21_before, 'close').fillna(method='ffill').pct_change()[1:]
 
     # 剔除收益率数据存在空值的股票
 
@@ -92,7 +86,7 @@ def get_cumulative_range(stock_list, date, market_cap_on_current_day):
 
     trading_date_253_before = rqdatac.get_trading_dates(date - timedelta(days=500), date, country='cn')[-253]
 
-    daily_return = rqdatac.get_price(stock_list, trading_date_253_before, date, frequency='1d', fields='close').fillna(method='ffill').pct_change()[1:]
+    daily_return = get_market_data(stock_list, trading_date_253_before, date, 'close').fillna(method='ffill').pct_change()[1:]
 
     # 剔除收益率数据存在空值的股票
 
@@ -135,13 +129,7 @@ def get_historical_sigma(stock_excess_return, market_portfolio_excess_return, ma
 
     weighted_market_portfolio_excess_return = market_portfolio_excess_return.multiply(exp_weight).T
 
-    weighted_residual_volatility = pd.Series()
-
-    for stock in stock_excess_return.columns:
-
-        alpha =  weighted_stock_excess_return[stock].mean() - market_portfolio_beta[stock] * weighted_market_portfolio_excess_return.mean()
-
-        weighted_residual_volatility[stock] = (weighted_stock_excess_return[stock] - market_portfolio_beta[stock] * weighted_market_portfolio_excess_return - alpha).std()
+    alpha, weighted_residual_volatility = get_alpha_and_residual_volatility(weighted_stock_excess_return, weighted_market_portfolio_excess_return, market_portfolio_beta)
 
     # 相对于贝塔正交化，降低波动率因子和贝塔因子的共线性
 
@@ -214,16 +202,17 @@ def get_momentum_and_res_vol(date):
 
     style_factors_exposure = style_factors_exposure.loc[stock_list]
 
-    # 用回归方法处理细分因子的缺失值
+    # 行业标记只获取一次，细分因子和风格因子的缺失值处理共用
+
+    industry_label = get_shenwan_industry_label(stock_list, latest_trading_date.strftime('%Y-%m-%d'))
 
-    imputed_atomic_descriptors = pd.DataFrame()
+    # 用回归方法处理细分因子的缺失值（全部细分因子一次完成）
 
-    for atomic_descriptor in atomic_descriptors_exposure.columns:
-        imputed_atomic_descriptors[atomic_descriptor] = individual_factor_imputation(stock_list, atomic_descriptors_exposure[atomic_descriptor], market_cap_on_current_day,latest_trading_date.strftime('%Y-%m-%d'))
+    imputed_atomic_descriptors = style_factors_imputation(atomic_descriptors_exposure, market_cap_on_current_day, latest_trading_date.strftime('%Y-%m-%d'), industry_label)
 
     # 用回归方法处理风格因子暴露度的缺失值
 
-    imputed_style_factors_exposure = style_factors_imputation(style_factors_exposure, market_cap_on_current_day,latest_trading_date.strftime('%Y-%m-%d'))
+    imputed_style_factors_exposure = style_factors_imputation(style_factors_exposure, market_cap_on_current_day,latest_trading_date.strftime('%Y-%m-%d'), industry_label)
 
     # 若经过缺失值处理后因子暴露度依旧存在缺失值，使用全市场股票进行回归，填补缺失值
 
@@ -3,41 +3,55 @@ import pandas as pd
 from datetime import datetime
 from datetime import timedelta
 from sklearn import linear_model
-from operators import individual_factor_imputation
+from operators import style_factors_imputation, get_beta_matrix
 from intermediate_variables import *
+from market_data_store import *
+from market_context import benchmark_list
 
 
 import rqdatac
 rqdatac.init("ricequant", "Ricequant123", ('rqdatad-pro.ricequant.com', 16004))
 
 
-def get_stock_beta(stock_list, stock_excess_return, benchmark, latest_trading_date, market_cap_on_current_day):
+def get_raw_stock_betas(market_context, benchmarks=benchmark_list):
 
-    trading_date_253_before = rqdatac.get_trading_dates(latest_trading_date - timedelta(days=500), latest_trading_date, country='cn')[-253]
+    # 一次计算全部股票对多个基准的 beta（未填补缺失值）：基准收益率一次取出，指数权重只生成一次
+
+    stock_excess_return = market_context.stock_excess_return
 
     exp_weight = get_exponential_weight(half_life = 63, length = 252)
 
     weighted_stock_excess_return = stock_excess_return.T.multiply(exp_weight).T
 
-    compounded_risk_free_return = rqdatac.get_yield_curve(start_date=trading_date_253_before, end_date=latest_trading_date, tenor='3M')
+    risk_free_return = market_context.risk_free_return['3M'].loc[stock_excess_return.index]
+
+    benchmark_daily_return = market_context.get_benchmark_daily_return(list(benchmarks), market_context.trading_date_before(252), market_context.latest_trading_date)
+
+    benchmark_excess_return = benchmark_daily_return.subtract(risk_free_return, axis=0)
+
+    weighted_benchmark_excess_return = benchmark_excess_return.multiply(exp_weight, axis=0)
+
+    return get_beta_matrix(weighted_stock_excess_return, weighted_benchmark_excess_return)
+
+
+def stock_beta_imputation(stock_beta, market_cap_on_current_day, date, industry_label):
 
-    risk_free_return = (((1 + compounded_risk_free_return) ** (1 / 365)) - 1).loc[stock_excess_return.index]
+    # 用回归方法处理 beta 的缺失值（与逐个基准调用 individual_factor_imputation 相同，包括收益率数据缺失而被剔除的股票）
 
-    market_portfolio_daily_return = rqdatac.get_price(benchmark, trading_date_253_before,latest_trading_date,frequency='1d', fields='close').fillna(method='ffill').pct_change()[1:]
+    stock_beta = stock_beta.reindex(stock_beta.index.union(market_cap_on_current_day.index).union(industry_label.index))
 
-    market_portfolio_excess_return = market_portfolio_daily_return.subtract(risk_free_return.iloc[:,0])
+    return style_factors_imputation(stock_beta, market_cap_on_current_day, date, industry_label)
 
-    weighted_market_portfolio_excess_return = market_portfolio_excess_return.multiply(exp_weight).T
 
-    weighted_market_portfolio_variance = weighted_market_portfolio_excess_return.var()
+def get_stock_betas(market_context, benchmarks=benchmark_list):
 
-    beta = [weighted_market_portfolio_excess_return.cov(weighted_stock_excess_return[stock])/weighted_market_portfolio_variance for stock in stock_excess_return.columns]
+    # 缺失值填补对所有基准一起进行
 
-    stock_beta = pd.Series(beta, index = stock_excess_return.columns)
+    stock_beta = get_raw_stock_betas(market_context, benchmarks)
 
-    # 用回归方法处理 beta 的缺失值
+    return stock_beta_imputation(stock_beta, market_context.market_cap_on_current_day, market_context.latest_trading_date.strftime('%Y-%m-%d'), market_context.industry_label)
 
-    imputed_stock_beta = individual_factor_imputation(stock_list, stock_beta, market_cap_on_current_day, latest_trading_date.strftime('%Y-%m-%d'))
 
-    return imputed_stock_beta
+def get_stock_beta(market_context, benchmark):
 
+    return get_stock_betas(market_context, [benchmark])[benchmark]
@@ -7,6 +7,8 @@ from intermediate_variables import *
 from operators import *
 from atomic_descriptors import *
 from get_stock_beta import *
+from market_data_store import *
+from market_context import *
 
 import numpy as np
 import pandas as pd
@@ -19,44 +21,35 @@ import rqdatac
 rqdatac.init("ricequant", "Ricequant123", ('rqdatad-pro.ricequant.com', 16004))
 
 
-def get_market_portfolio_beta(stock_excess_return, market_portfolio_excess_return, market_cap_on_current_day):
+def get_market_descriptors(market_context):
 
-    exp_weight = get_exponential_weight(half_life=63, length=252)
-
-    weighted_stock_excess_return = stock_excess_return.T.multiply(exp_weight).T
-
-    weighted_market_portfolio_excess_return = market_portfolio_excess_return.multiply(exp_weight).T
+    # 计算市场类细分因子的原始值（未经标准化），get_style_factors_range 逐日滚动计算相同的原始值
 
-    weighted_market_portfolio_variance = weighted_market_portfolio_excess_return.var()
+    stock_excess_return = market_context.stock_excess_return
 
-    beta = [weighted_market_portfolio_excess_return.cov(
-        weighted_stock_excess_return[stock]) / weighted_market_portfolio_variance for stock in
-            stock_excess_return.columns]
+    # 每只股票对各个基准的 beta，其中对中证全指（market portfolio）的 beta 即为 beta 因子的原始值
 
-    market_portfolio_beta = pd.Series(beta, index=stock_excess_return.columns)
+    stock_beta = get_raw_stock_betas(market_context, benchmark_list)
 
-    market_portfolio_beta_exposure = winsorization_and_market_cap_weighed_standardization(market_portfolio_beta,
-                                                                                          market_cap_on_current_day)
+    market_portfolio_beta = stock_beta[market_portfolio]
 
-    # 细分因子 historical_sigma 的计算需要 beta 的原始值，所以同时返回原始暴露度和标准化暴露度
-
-    return market_portfolio_beta, market_portfolio_beta_exposure
+    # historical_sigma
 
+    exp_weight = get_exponential_weight(half_life=63, length=252)
 
-def get_momentum(stock_list, date, market_cap_on_current_day):
+    weighted_stock_excess_return = stock_excess_return.T.multiply(exp_weight).T
 
-    trading_date_525_before = rqdatac.get_trading_dates(date - timedelta(days=1000), date, country='cn')[-525]
+    weighted_market_portfolio_excess_return = market_context.market_portfolio_excess_return.multiply(exp_weight)
 
-    trading_date_21_before = rqdatac.get_trading_dates(date - timedelta(days=40), date, country='cn')[-21]
+    alpha, historical_sigma = get_alpha_and_residual_volatility(weighted_stock_excess_return, weighted_market_portfolio_excess_return, market_portfolio_beta)
 
-    # 共需要 525 - 21 = 504 个交易日的收益率
+    # cumulative_range 使用过去 252 个交易日的日收益率（已剔除收益率数据存在空值的股票）
 
-    exp_weight = get_exponential_weight(half_life=126, length=504)
+    cumulative_range = get_cumulative_return_range(market_context.stock_daily_return, market_context.risk_free_return[['3M']].loc[market_context.stock_daily_return.index])
 
-    # 提取股票价格数据，对于退市情况，考虑作股价向前填补（日收益率为0）
+    # relative strength：共需要 525 - 21 = 504 个交易日的收益率，对于退市情况，考虑作股价向前填补（日收益率为0）
 
-    daily_return = rqdatac.get_price(stock_list, trading_date_525_before, trading_date_21_before, frequency='1d',
-                                     fields='close').fillna(method='ffill').pct_change()[1:]
+    daily_return = market_context.get_daily_return(market_context.trading_date_before(524), market_context.trading_date_before(21))
 
     # 剔除收益率数据存在空值的股票
 
@@ -64,13 +57,34 @@ def get_momentum(stock_list, date, market_cap_on_current_day):
 
     daily_return = daily_return.drop(daily_return[inds], axis=1)
 
-    # 把复利无风险日收益率转为日收益率
+    risk_free_return = market_context.risk_free_return[['0S']].loc[daily_return.index]
+
+    relative_strength = np.log(1 + daily_return).T.subtract(np.log(1 + risk_free_return.iloc[:, 0])).dot(get_exponential_weight(half_life=126, length=504))
 
-    compounded_risk_free_return = rqdatac.get_yield_curve(start_date=trading_date_525_before, end_date=date, tenor='0S')
+    # 换手率：剔除计算日期成交量为0的股票
 
-    risk_free_return = (((1 + compounded_risk_free_return) ** (1 / 365)) - 1).loc[daily_return.index]
+    trading_volume = market_context.trading_volume
 
-    relative_strength = np.log(1 + daily_return).T.subtract(np.log(1 + risk_free_return.iloc[:, 0])).dot(exp_weight)
+    inds = trading_volume.iloc[-1][trading_volume.iloc[-1].values == 0].index.tolist()
+
+    stock_list = list(set(market_context.stock_list) - set(inds))
+
+    daily_turnover_rate = trading_volume[stock_list].divide(market_context.outstanding_shares[stock_list])
+
+    market_descriptors = {'market_portfolio_beta': market_portfolio_beta,
+                          'stock_beta': stock_beta,
+                          'daily_standard_deviation': get_weighted_standard_deviation(stock_excess_return),
+                          'cumulative_range': cumulative_range,
+                          'historical_sigma': historical_sigma,
+                          'relative_strength': relative_strength,
+                          'one_month_turnover': daily_turnover_rate.iloc[-21:].sum(),
+                          'three_months_turnover': daily_turnover_rate.iloc[-63:].sum(),
+                          'twelve_months_turnover': daily_turnover_rate.iloc[-252:].sum()}
+
+    return market_descriptors
+
+
+def get_momentum(relative_strength, market_cap_on_current_day):
 
     processed_relative_strength = winsorization_and_market_cap_weighed_standardization(relative_strength, market_cap_on_current_day[relative_strength.index])
 
@@ -95,13 +109,13 @@ def get_earnings_yield(latest_trading_date, market_cap_on_current_day, recent_re
     return earnings_to_price_ratio, cash_earnings_to_price_ratio, earnings_yield
 
 
-def get_residual_volatility(stock_list, latest_trading_date, stock_excess_return, market_portfolio_excess_return,market_cap_on_current_day, market_portfolio_beta_exposure, market_portfolio_beta):
+def get_residual_volatility(daily_standard_deviation, cumulative_range, historical_sigma, market_portfolio_beta_exposure, market_cap_on_current_day):
 
-    daily_standard_deviation_exposure = get_daily_standard_deviation(stock_excess_return, market_cap_on_current_day)
+    daily_standard_deviation_exposure = winsorization_and_market_cap_weighed_standardization(daily_standard_deviation, market_cap_on_current_day)
 
-    cumulative_range_exposure = get_cumulative_range(stock_list, latest_trading_date, market_cap_on_current_day)
+    cumulative_range_exposure = winsorization_and_market_cap_weighed_standardization(cumulative_range, market_cap_on_current_day)
 
-    historical_sigma_exposure = get_historical_sigma(stock_excess_return, market_portfolio_excess_return,market_portfolio_beta, market_portfolio_beta_exposure,market_cap_on_current_day)
+    historical_sigma_exposure = get_historical_sigma_exposure(historical_sigma, market_portfolio_beta_exposure, market_cap_on_current_day)
 
     atomic_descriptors_df = pd.concat([daily_standard_deviation_exposure, cumulative_range_exposure, historical_sigma_exposure], axis=1)
 
@@ -139,9 +153,9 @@ def get_growth(latest_trading_date, market_cap_on_current_day, recent_five_annua
 
 # book-to-price = (股东权益合计-优先股)/市值
 
-def get_book_to_price_ratio(market_cap_on_current_day, last_reported_preferred_stock, recent_report_type):
+def get_book_to_price_ratio(market_cap_on_current_day, last_reported_preferred_stock, recent_report_type, latest_trading_date):
 
-    last_reported_total_equity = get_last_reported_values(rqdatac.financials.balance_sheet.total_equity,recent_report_type)
+    last_reported_total_equity = get_last_reported_values('total_equity', recent_report_type, latest_trading_date)
 
     book_to_price_ratio = (last_reported_total_equity - last_reported_preferred_stock) / market_cap_on_current_day[last_reported_total_equity.index]
 
@@ -150,13 +164,13 @@ def get_book_to_price_ratio(market_cap_on_current_day, last_reported_preferred_s
     return processed_book_to_price_ratio
 
 
-def get_leverage(market_cap_on_current_day, last_reported_non_current_liabilities, last_reported_preferred_stock,recent_report_type):
+def get_leverage(market_cap_on_current_day, last_reported_non_current_liabilities, last_reported_preferred_stock, recent_report_type, latest_trading_date):
 
     market_leverage = get_market_leverage(market_cap_on_current_day, last_reported_non_current_liabilities,last_reported_preferred_stock)
 
-    debt_to_assets = get_debt_to_assets(market_cap_on_current_day, recent_report_type)
+    debt_to_assets = get_debt_to_assets(market_cap_on_current_day, recent_report_type, latest_trading_date)
 
-    book_leverage = get_book_leverage(market_cap_on_current_day, last_reported_non_current_liabilities,last_reported_preferred_stock, recent_report_type)
+    book_leverage = get_book_leverage(market_cap_on_current_day, last_reported_non_current_liabilities,last_reported_preferred_stock, recent_report_type, latest_trading_date)
 
     atomic_descriptors_df = pd.concat([market_leverage, debt_to_assets, book_leverage], axis=1)
 
@@ -171,27 +185,15 @@ def get_leverage(market_cap_on_current_day, last_reported_non_current_liabilitie
     return market_leverage, debt_to_assets, book_leverage, processed_leverage_exposure
 
 
-def get_liquidity(stock_list, date, market_cap_on_current_day):
-
-    trading_date_252_before = rqdatac.get_trading_dates(date - timedelta(days=500), date, country='cn')[-252]
-
-    trading_volume = rqdatac.get_price(stock_list, trading_date_252_before, date, frequency='1d', fields='volume')
-
-    inds = trading_volume.loc[date][trading_volume.loc[date].values == 0].index.tolist()
-
-    stock_list = list(set(stock_list) - set(inds))
-
-    outstanding_shares = rqdatac.get_shares(stock_list, trading_date_252_before, date, fields='total_a')
-
-    daily_turnover_rate = trading_volume[stock_list].divide(outstanding_shares)
+def get_liquidity(one_month_turnover, three_months_turnover, twelve_months_turnover, market_cap_on_current_day):
 
     # 对于对应时期内换手率为 0 的股票，其细分因子暴露度也设为0
 
-    one_month_share_turnover = winsorization_and_market_cap_weighed_standardization(np.log(daily_turnover_rate.iloc[-21:].sum().replace(0, np.nan)), market_cap_on_current_day)
+    one_month_share_turnover = winsorization_and_market_cap_weighed_standardization(np.log(one_month_turnover.replace(0, np.nan)), market_cap_on_current_day)
 
-    three_months_share_turnover = winsorization_and_market_cap_weighed_standardization(np.log(daily_turnover_rate.iloc[-63:].sum().replace(0, np.nan) / 3), market_cap_on_current_day)
+    three_months_share_turnover = winsorization_and_market_cap_weighed_standardization(np.log(three_months_turnover.replace(0, np.nan) / 3), market_cap_on_current_day)
 
-    twelve_months_share_turnover = winsorization_and_market_cap_weighed_standardization(np.log(daily_turnover_rate.iloc[-252:].sum().replace(0, np.nan) / 12), market_cap_on_current_day)
+    twelve_months_share_turnover = winsorization_and_market_cap_weighed_standardization(np.log(twelve_months_turnover.replace(0, np.nan) / 12), market_cap_on_current_day)
 
     atomic_descriptors_df = pd.concat([one_month_share_turnover, three_months_share_turnover, twelve_months_share_turnover], axis=1)
 
@@ -219,19 +221,12 @@ def get_non_linear_size(size_exposure, market_cap_on_current_day):
     return processed_orthogonalized_cubed_size
 
 
-def get_style_factors(date):
-
-    latest_trading_date = rqdatac.get_previous_trading_date(datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1))
-
-    trading_date_252_before = rqdatac.get_trading_dates(latest_trading_date - timedelta(days=500), latest_trading_date, country='cn')[-252]
-
-    stock_list = rqdatac.all_instruments(type='CS', date=latest_trading_date)['order_book_id'].values.tolist()
+def get_style_factors_from_market_descriptors(latest_trading_date, stock_list, market_cap_on_current_day, industry_label, market_descriptors):
 
-    ### 获取因子计算共用的行情数据和财务数据
+    ### 获取因子计算所需的财务数据
 
-    recent_report_type, annual_report_type, market_cap_on_current_day, \
-    stock_excess_return, market_portfolio_excess_return, recent_five_annual_shares, \
-    last_reported_non_current_liabilities, last_reported_preferred_stock = get_financial_and_market_data(stock_list,latest_trading_date,trading_date_252_before)
+    recent_report_type, annual_report_type, recent_five_annual_shares, \
+    last_reported_non_current_liabilities, last_reported_preferred_stock = get_financial_data(stock_list, latest_trading_date)
 
     # 风格因子计算
 
@@ -239,30 +234,25 @@ def get_style_factors(date):
 
     non_linear_size = get_non_linear_size(size, market_cap_on_current_day)
 
-    market_portfolio_beta, market_portfolio_beta_exposure = get_market_portfolio_beta(stock_excess_return,market_portfolio_excess_return,market_cap_on_current_day)
+    market_portfolio_beta_exposure = winsorization_and_market_cap_weighed_standardization(market_descriptors['market_portfolio_beta'], market_cap_on_current_day)
 
-    # 获取每只股票的 beta
+    # 获取每只股票的 beta，缺失值填补对所有基准一起进行
 
-    benchmark_list = ['000016.XSHG', '000300.XSHG', '000905.XSHG', '000906.XSHG', '000985.XSHG']
-
-    stock_beta = pd.DataFrame()
-
-    for benchmark in benchmark_list:
-        stock_beta[benchmark] = get_stock_beta(stock_list, stock_excess_return, benchmark, latest_trading_date,market_cap_on_current_day)
+    stock_beta = stock_beta_imputation(market_descriptors['stock_beta'], market_cap_on_current_day, latest_trading_date.strftime('%Y-%m-%d'), industry_label)
 
     daily_standard_deviation, cumulative_range, historical_sigma, residual_volatility = get_residual_volatility(
-        stock_list, latest_trading_date, stock_excess_return, market_portfolio_excess_return, market_cap_on_current_day,
-        market_portfolio_beta_exposure, market_portfolio_beta)
+        market_descriptors['daily_standard_deviation'], market_descriptors['cumulative_range'], market_descriptors['historical_sigma'], market_portfolio_beta_exposure, market_cap_on_current_day)
 
-    momentum = get_momentum(stock_list, latest_trading_date, market_cap_on_current_day)
+    momentum = get_momentum(market_descriptors['relative_strength'], market_cap_on_current_day)
 
-    one_month_share_turnover, three_months_share_turnover, twelve_months_share_turnover, liquidity = get_liquidity(stock_list, latest_trading_date, market_cap_on_current_day)
+    one_month_share_turnover, three_months_share_turnover, twelve_months_share_turnover, liquidity = get_liquidity(
+        market_descriptors['one_month_turnover'], market_descriptors['three_months_turnover'], market_descriptors['twelve_months_turnover'], market_cap_on_current_day)
 
     earnings_to_price_ratio, cash_earnings_to_price_ratio, earnings_yield = get_earnings_yield(latest_trading_date,market_cap_on_current_day,recent_report_type)
 
-    book_to_price = get_book_to_price_ratio(market_cap_on_current_day, last_reported_preferred_stock,recent_report_type)
+    book_to_price = get_book_to_price_ratio(market_cap_on_current_day, last_reported_preferred_stock,recent_report_type, latest_trading_date)
 
-    market_leverage, debt_to_assets, book_leverage, leverage = get_leverage(market_cap_on_current_day,last_reported_non_current_liabilities,last_reported_preferred_stock,recent_report_type)
+    market_leverage, debt_to_assets, book_leverage, leverage = get_leverage(market_cap_on_current_day,last_reported_non_current_liabilities,last_reported_preferred_stock,recent_report_type, latest_trading_date)
 
     sales_growth, earnings_growth, growth = get_growth(latest_trading_date, market_cap_on_current_day,recent_five_annual_shares, recent_report_type)
 
@@ -288,16 +278,13 @@ def get_style_factors(date):
 
     style_factors_exposure = style_factors_exposure.loc[stock_list]
 
-    # 用回归方法处理细分因子的缺失值
+    # 用回归方法处理细分因子的缺失值（全部细分因子一次完成）
 
-    imputed_atomic_descriptors = pd.DataFrame()
-
-    for atomic_descriptor in atomic_descriptors_exposure.columns:
-        imputed_atomic_descriptors[atomic_descriptor] = individual_factor_imputation(stock_list, atomic_descriptors_exposure[atomic_descriptor], market_cap_on_current_day,latest_trading_date.strftime('%Y-%m-%d'))
+    imputed_atomic_descriptors = style_factors_imputation(atomic_descriptors_exposure, market_cap_on_current_day, latest_trading_date.strftime('%Y-%m-%d'), industry_label)
 
     # 用回归方法处理风格因子暴露度的缺失值
 
-    imputed_style_factors_exposure = style_factors_imputation(style_factors_exposure, market_cap_on_current_day,latest_trading_date.strftime('%Y-%m-%d'))
+    imputed_style_factors_exposure = style_factors_imputation(style_factors_exposure, market_cap_on_current_day,latest_trading_date.strftime('%Y-%m-%d'), industry_label)
 
     # 若经过缺失值处理后因子暴露度依旧存在缺失值，使用全市场股票进行回归，填补缺失值
 
@@ -314,3 +301,203 @@ def get_style_factors(date):
         stock_beta = factor_imputation(market_cap_on_current_day, stock_beta)
 
     return imputed_atomic_descriptors, imputed_style_factors_exposure, stock_beta
+
+
+def get_style_factors(date):
+
+    ### 获取因子计算共用的行情数据（只获取一次，各细分因子函数共用）
+
+    market_context = MarketContext(date)
+
+    market_descriptors = get_market_descriptors(market_context)
+
+    return get_style_factors_from_market_descriptors(market_context.latest_trading_date, market_context.stock_list, market_context.market_cap_on_current_day, market_context.industry_label, market_descriptors)
+
+
+def update_exponential_sum(exponential_sum, decay, length, new_value, expired_value):
+
+    # 窗口内的指数加权和 sum(decay^(k+1) * x_(t-k))，k = 0, ..., length - 1，权重与 get_exponential_weight 一致（最新一天权重为 decay）
+
+    return decay * (exponential_sum + new_value) - decay ** (length + 1) * expired_value
+
+
+def iterate_market_descriptors(market_panel):
+
+    # 逐日滚动更新窗口内的累计量，每个交易日只处理新进入和移出窗口的一行数据，结果与逐日调用 get_market_descriptors 相同
+
+    stock_list = np.array(market_panel.stock_list)
+
+    close_price = market_panel.close_price.values
+
+    daily_return = market_panel.close_price.fillna(method='ffill').pct_change().values
+
+    # 窗口起点前一交易日收盘价存在的股票，窗口内收益率没有空值（与 MarketContext 剔除收益率存在空值的股票一致）
+
+    filled_daily_return = np.where(np.isnan(daily_return), 0, daily_return)
+
+    # 递推的累计量一旦进入空值，之后所有交易日都为空值（逐个窗口计算时，空值移出窗口后即恢复），因此进入累计量之前填补空值：
+
+    # 收益率曲线缺失的交易日沿用前一交易日的无风险利率，指数尚未发布（或窗口第一天）的收益率记为 0
+
+    risk_free_return = market_panel.risk_free_return.ffill().bfill()
+
+    risk_free_return_3m = risk_free_return['3M'].values
+
+    risk_free_return_0s = risk_free_return['0S'].values
+
+    stock_excess_return = filled_daily_return - risk_free_return_3m[:, None]
+
+    benchmark_daily_return = market_panel.benchmark_close_price[benchmark_list].fillna(method='ffill').pct_change().values
+
+    benchmark_excess_return = np.where(np.isnan(benchmark_daily_return), 0, benchmark_daily_return) - risk_free_return_3m[:, None]
+
+    benchmark_excess_return[0] = 0
+
+    # 动量使用的对数超额收益率，以及 cumulative range 使用的对数超额收益率的前缀和
+
+    log_excess_return_0s = np.log(1 + filled_daily_return) - np.log(1 + risk_free_return_0s)[:, None]
+
+    cumulative_log_excess_return = np.vstack([np.zeros(len(stock_list)), np.cumsum(np.log(1 + filled_daily_return) - np.log(1 + risk_free_return_3m)[:, None], axis=0)])
+
+    trading_volume = market_panel.trading_volume.values
+
+    daily_turnover_rate = trading_volume / market_panel.outstanding_shares.values
+
+    cumulative_turnover_rate = np.vstack([np.zeros(len(stock_list)), np.cumsum(np.where(np.isnan(daily_turnover_rate), 0, daily_turnover_rate), axis=0)])
+
+    beta_decay = 0.5 ** (1 / 63)
+
+    standard_deviation_decay = 0.5 ** (1 / 42)
+
+    momentum_decay = 0.5 ** (1 / 126)
+
+    # 窗口内累计量：stock（s）、benchmark（b）的加权和、加权平方和与加权交叉乘积和
+
+    sum_s, sum_ss = np.zeros(len(stock_list)), np.zeros(len(stock_list))
+
+    sum_b, sum_bb = np.zeros(len(benchmark_list)), np.zeros(len(benchmark_list))
+
+    sum_bs = np.zeros((len(benchmark_list), len(stock_list)))
+
+    standard_deviation_sum_s, standard_deviation_sum_ss = np.zeros(len(stock_list)), np.zeros(len(stock_list))
+
+    relative_strength_sum = np.zeros(len(stock_list))
+
+    first_position = len(market_panel.trading_dates) - len(market_panel.trading_dates_in_range)
+
+    market_position = benchmark_list.index(market_portfolio)
+
+    n = 252
+
+    for position in range(len(market_panel.trading_dates)):
+
+        s = stock_excess_return[position]
+
+        b = benchmark_excess_return[position]
+
+        expired_s = stock_excess_return[position - n] if position >= n else np.zeros(len(stock_list))
+
+        expired_b = benchmark_excess_return[position - n] if position >= n else np.zeros(len(benchmark_list))
+
+        sum_s = update_exponential_sum(sum_s, beta_decay, n, s, expired_s)
+
+        sum_ss = update_exponential_sum(sum_ss, beta_decay ** 2, n, s ** 2, expired_s ** 2)
+
+        sum_b = update_exponential_sum(sum_b, beta_decay, n, b, expired_b)
+
+        sum_bb = update_exponential_sum(sum_bb, beta_decay ** 2, n, b ** 2, expired_b ** 2)
+
+        sum_bs = update_exponential_sum(sum_bs, beta_decay ** 2, n, np.outer(b, s), np.outer(expired_b, expired_s))
+
+        standard_deviation_sum_s = update_exponential_sum(standard_deviation_sum_s, standard_deviation_decay, n, s, expired_s)
+
+        standard_deviation_sum_ss = update_exponential_sum(standard_deviation_sum_ss, standard_deviation_decay ** 2, n, s ** 2, expired_s ** 2)
+
+        # 动量窗口为 t-523 至 t-20 共 504 个交易日
+
+        if position >= 20:
+
+            expired_log_excess_return = log_excess_return_0s[position - 20 - 504] if position - 20 >= 504 else np.zeros(len(stock_list))
+
+            relative_strength_sum = update_exponential_sum(relative_strength_sum, momentum_decay, 504, log_excess_return_0s[position - 20], expired_log_excess_return)
+
+        if position < first_position:
+
+            continue
+
+        date = market_panel.trading_dates[position]
+
+        is_listed = market_panel.is_listed(date)
+
+        is_included = is_listed & ~np.isnan(close_price[position - n])
+
+        is_momentum_included = is_listed & ~np.isnan(close_price[position - 524])
+
+        # beta 与 historical_sigma
+
+        benchmark_variance = (sum_bb - sum_b ** 2 / n) / (n - 1)
+
+        covariance = (sum_bs - np.outer(sum_b, sum_s) / n) / (n - 1)
+
+        beta = covariance / benchmark_variance[:, None]
+
+        stock_beta = pd.DataFrame(beta[:, is_included].T, index=stock_list[is_included], columns=benchmark_list)
+
+        stock_variance = (sum_ss - sum_s ** 2 / n) / (n - 1)
+
+        residual_variance = stock_variance + beta[market_position] ** 2 * benchmark_variance[market_position] - 2 * beta[market_position] * covariance[market_position]
+
+        historical_sigma = np.sqrt(np.maximum(residual_variance, 0))
+
+        daily_standard_deviation = np.sqrt(np.maximum((standard_deviation_sum_ss - standard_deviation_sum_s ** 2 / n) / (n - 1), 0))
+
+        # cumulative range：窗口内前 21、42、...、252 个交易日的累计对数超额收益率
+
+        spliting_points = position - n + 1 + np.arange(0, 273, 21)
+
+        cumulative_return = (cumulative_log_excess_return[spliting_points[1:]] - cumulative_log_excess_return[spliting_points[0]]).cumsum(axis=0)
+
+        cumulative_range = cumulative_return.max(axis=0) - cumulative_return.min(axis=0)
+
+        # 换手率：剔除计算日期成交量为0的股票
+
+        is_trading = is_listed & ~(trading_volume[position] == 0)
+
+        turnover = {}
+
+        for length in [21, 63, 252]:
+
+            turnover[length] = pd.Series((cumulative_turnover_rate[position + 1] - cumulative_turnover_rate[position + 1 - length])[is_trading], index=stock_list[is_trading])
+
+        market_descriptors = {'market_portfolio_beta': stock_beta[market_portfolio],
+                              'stock_beta': stock_beta,
+                              'daily_standard_deviation': pd.Series(daily_standard_deviation[is_included], index=stock_list[is_included]),
+                              'cumulative_range': pd.Series(cumulative_range[is_included], index=stock_list[is_included]),
+                              'historical_sigma': pd.Series(historical_sigma[is_included], index=stock_list[is_included]),
+                              'relative_strength': pd.Series(relative_strength_sum[is_momentum_included], index=stock_list[is_momentum_included]),
+                              'one_month_turnover': turnover[21],
+                              'three_months_turnover': turnover[63],
+                              'twelve_months_turnover': turnover[252]}
+
+        yield date, list(stock_list[is_listed]), market_descriptors
+
+
+def get_style_factors_range(start_date, end_date):
+
+    # 日期区间模式：行情数据只读取一次，市场类细分因子逐日滚动计算；返回的三个 dataframe 以 (date, order_book_id) 为 index，因子为 columns
+
+    market_panel = MarketPanel(start_date, end_date)
+
+    atomic_descriptors_panel, style_factors_panel, stock_beta_panel = {}, {}, {}
+
+    for date, stock_list, market_descriptors in iterate_market_descriptors(market_panel):
+
+        market_cap_on_current_day = market_panel.get_market_cap_on_current_day(date)
+
+        industry_label = get_shenwan_industry_label(stock_list, date.strftime('%Y-%m-%d'))
+
+        atomic_descriptors_panel[date], style_factors_panel[date], stock_beta_panel[date] = get_style_factors_from_market_descriptors(date.date(), stock_list, market_cap_on_current_day, industry_label, market_descriptors)
+
+        print(date.strftime('%Y-%m-%d'), 'style factors are done')
+
+    return pd.concat(atomic_descriptors_panel), pd.concat(style_factors_panel), pd.concat(stock_beta_panel)
@@ -4,6 +4,8 @@ import pandas as pd
 from datetime import datetime
 
 from operators import *
+from market_data_store import *
+from financial_statement_store import *
 
 import rqdatac
 rqdatac.init("ricequant", "Ricequant123", ('rqdatad-pro.ricequant.com', 16004))
@@ -48,7 +50,7 @@ def get_daily_excess_return(stock_list, start_date, end_date):
 
     # 提取股票价格数据，对于退市情况，考虑作股价向前填补（日收益率为0）
 
-    stock_daily_return = rqdatac.get_price(stock_list, rqdatac.get_previous_trading_date(start_date), end_date, frequency='1d', fields='close').fillna(method='ffill').pct_change()[1:]
+    stock_daily_return = get_market_data(stock_list, rqdatac.get_previous_trading_date(start_date), end_date, 'close').fillna(method='ffill').pct_change()[1:]
 
     # 剔除收益率数据存在空值的股票
 
@@ -58,7 +60,7 @@ def get_daily_excess_return(stock_list, start_date, end_date):
 
     # 经测试发现，中证全指（000985）作为 market portfolio 的效果最好
 
-    market_portfolio_daily_return = rqdatac.get_price('000985.XSHG', rqdatac.get_previous_trading_date(start_date), end_date, frequency='1d', fields='close').pct_change()[1:]
+    market_portfolio_daily_return = get_market_data(['000985.XSHG'], rqdatac.get_previous_trading_date(start_date), end_date, 'close')['000985.XSHG'].pct_change()[1:]
 
     # 计算无风险日收益率
 
@@ -119,7 +121,7 @@ def get_recent_five_annual_shares(stock_list, date):
 
         next_trading_date = rqdatac.get_next_trading_date(report_date)
 
-        recent_five_annual_shares[report_date] = rqdatac.get_shares(stock_list, start_date = next_trading_date.strftime('%Y-%m-%d'), end_date = next_trading_date.strftime('%Y-%m-%d'), fields='total_a').iloc[0]
+        recent_five_annual_shares[report_date] = get_market_data_on_date(stock_list, next_trading_date, 'total_a')
 
     # 调整股本 dataframe 的列名，方便相除计算每股收入
 
@@ -130,7 +132,7 @@ def get_recent_five_annual_shares(stock_list, date):
 
 # 计算原生指标过去十二个月的滚动值（利润表、现金流量表滚动求和）
 
-def get_ttm_sum(financial_indicator,recent_report_type):
+def get_ttm_sum(field, recent_report_type, date=None):
 
     def _get_ttm_date(quarter):
         # 假设最新的为年报，则为年报数值
@@ -146,8 +148,8 @@ def get_ttm_sum(financial_indicator,recent_report_type):
 
     # 获得所有股票中最新的quarter
     max_quarter = max(recent_report_type)
-    # 获得所有股票前8期的财报数据
-    financial_data = rqdatac.get_financials(rqdatac.query(financial_indicator),quarter=max_quarter, interval="8q", country='cn').T
+    # 获得所有股票前8期的财报数据（本地财务报表数据仓库），剔除在 date 之后才公告的数据
+    financial_data = get_financial_statements(field, get_previous_quarters(max_quarter, 8), date)
 
     effective_quarter = pd.DataFrame(recent_report_type.apply(_get_ttm_date).to_dict()).T
 
@@ -179,32 +181,28 @@ def get_ttm_sum(financial_indicator,recent_report_type):
 
 # 调取最近一期财报数据
 
-def get_last_reported_values(financial_indicator, recent_report_type):
+def get_last_reported_values(field, recent_report_type, date=None):
 
-    # 取出当天所有出现的财报类型
+    # 取出当天所有出现的财报类型，各报告期的全市场数据从本地财务报表数据仓库读取，剔除在 date 之后才公告的数据
 
     unique_recent_report_type = recent_report_type.unique().tolist()
 
-    last_reported_values = pd.Series()
+    financial_statements = get_financial_statements(field, unique_recent_report_type, date)
 
-    # 循环每一类型的报告，再合并返回
+    last_reported_values = []
 
-    for report_type in unique_recent_report_type:
-
-        stock_list = recent_report_type[recent_report_type == report_type].index.tolist()
-
-        if len(stock_list) == 1:
+    # 每只股票取其最近一期报告的数据
 
-            last_reported_values = last_reported_values.append(rqdatac.get_financials(rqdatac.query(financial_indicator).filter(rqdatac.financials.stockcode.in_(stock_list)), report_type))
+    for report_type in unique_recent_report_type:
 
-        else:
+        stock_list = financial_statements.index.intersection(recent_report_type[recent_report_type == report_type].index)
 
-            last_reported_values = last_reported_values.append(rqdatac.get_financials(rqdatac.query(financial_indicator).filter(rqdatac.financials.stockcode.in_(stock_list)), report_type).iloc[0])
+        last_reported_values.append(financial_statements.loc[stock_list, report_type])
 
-    return last_reported_values
+    return pd.concat(last_reported_values)
 
 
-def recent_five_annual_values(financial_indicator, date, recent_report_type):
+def recent_five_annual_values(field, date, recent_report_type):
 
     previous_year = datetime.strptime(date, '%Y-%m-%d').year - 1
 
@@ -226,7 +224,7 @@ def recent_five_annual_values(financial_indicator, date, recent_report_type):
 
     # 获得最近一期报告为年报的股票列表
 
-    recent_five_reports = rqdatac.get_financials(rqdatac.query(financial_indicator), str(previous_year) + 'q4', '25q').T
+    recent_five_reports = get_financial_statements(field, sorted(set(annual_report_published_list + annual_report_not_published_list)), date)
 
     annual_report_published_values = recent_five_reports[annual_report_published_list].loc[annual_report_published_stocks]
 
@@ -243,31 +241,65 @@ def recent_five_annual_values(financial_indicator, date, recent_report_type):
     return recent_five_reports_values
 
 
-def get_financial_and_market_data(stock_list, latest_trading_date, trading_date_252_before):
+# 风格因子计算需要的财务报表字段：最近一期报告的数据，过去十二个月的滚动值，以及最近五期年报的数据
 
-    # 取出最近一期财务报告和年度报告字段，例如 '2016q3' 或  '2016q4'
+last_reported_fields = ['total_liabilities', 'total_assets', 'paid_in_capital', 'total_equity', 'non_current_liabilities', 'equity_prefer_stock']
 
-    recent_report_type, annual_report_type = get_recent_financial_report(latest_trading_date.strftime('%Y-%m-%d'))
+ttm_fields = ['profit_before_tax', 'cash_flow_from_operating_activities']
 
-    market_cap_on_current_day = rqdatac.get_factor(id_or_symbols=stock_list, factor='a_share_market_val', start_date=latest_trading_date.strftime('%Y-%m-%d'), end_date=latest_trading_date.strftime('%Y-%m-%d')).dropna()
+annual_report_fields = ['revenue', 'net_profit']
 
-    # 若市值出现缺失，取前22个交易日的市值平均值进行填补
 
-    if len(market_cap_on_current_day.index)< len(stock_list):
+def prefetch_financial_data(date, recent_report_type):
 
-        market_cap_on_current_day = market_cap_imputation(stock_list,market_cap_on_current_day,latest_trading_date)
+    # 一次计算所需的全部财务报表字段分两次请求下载：最近的报告期（含计算 ttm 的前8期）和最近六期年报，之后各因子函数从本地读取
 
-    stock_excess_return, market_portfolio_excess_return = get_daily_excess_return(stock_list, trading_date_252_before.strftime('%Y-%m-%d'), latest_trading_date.strftime('%Y-%m-%d'))
+    recent_quarters = sorted(set(get_previous_quarters(max(recent_report_type), 8)) | set(recent_report_type.unique()))
+
+    prefetch_financial_statements(last_reported_fields + ttm_fields, recent_quarters, date)
+
+    previous_year = datetime.strptime(date, '%Y-%m-%d').year - 1
+
+    annual_quarters = [str(year) + 'q4' for year in range(previous_year - 5, previous_year + 1)]
+
+    prefetch_financial_statements(annual_report_fields, annual_quarters, date)
+
+
+def get_financial_data(stock_list, latest_trading_date):
+
+    # 取出最近一期财务报告和年度报告字段，例如 '2016q3' 或  '2016q4'
+
+    recent_report_type, annual_report_type = get_recent_financial_report(latest_trading_date.strftime('%Y-%m-%d'))
+
+    prefetch_financial_data(latest_trading_date.strftime('%Y-%m-%d'), recent_report_type)
 
     recent_five_annual_shares = get_recent_five_annual_shares(stock_list, latest_trading_date.strftime('%Y-%m-%d'))
 
     # 当公司非流动性负债数据缺失时，则认为该公司没有非流动性负债，把缺失值替换为0
 
-    last_reported_non_current_liabilities = get_last_reported_values(rqdatac.financials.balance_sheet.non_current_liabilities, recent_report_type).fillna(value=0)
+    last_reported_non_current_liabilities = get_last_reported_values('non_current_liabilities', recent_report_type, latest_trading_date).fillna(value=0)
 
     # 当公司优先股数据缺失时，则认为该公司没有优先股，把缺失值替换为0
 
-    last_reported_preferred_stock = get_last_reported_values(rqdatac.financials.balance_sheet.equity_prefer_stock, recent_report_type).fillna(value=0)
+    last_reported_preferred_stock = get_last_reported_values('equity_prefer_stock', recent_report_type, latest_trading_date).fillna(value=0)
+
+    return recent_report_type, annual_report_type, recent_five_annual_shares, last_reported_non_current_liabilities, last_reported_preferred_stock
+
+
+def get_financial_and_market_data(stock_list, latest_trading_date, trading_date_252_before):
+
+    recent_report_type, annual_report_type, recent_five_annual_shares, \
+    last_reported_non_current_liabilities, last_reported_preferred_stock = get_financial_data(stock_list, latest_trading_date)
+
+    market_cap_on_current_day = get_market_data_on_date(stock_list, latest_trading_date, 'a_share_market_val').dropna()
+
+    # 若市值出现缺失，取前22个交易日的市值平均值进行填补
+
+    if len(market_cap_on_current_day.index)< len(stock_list):
+
+        market_cap_on_current_day = market_cap_imputation(stock_list,market_cap_on_current_day,latest_trading_date)
+
+    stock_excess_return, market_portfolio_excess_return = get_daily_excess_return(stock_list, trading_date_252_before.strftime('%Y-%m-%d'), latest_trading_date.strftime('%Y-%m-%d'))
 
     return recent_report_type, annual_report_type, market_cap_on_current_day, stock_excess_return, market_portfolio_excess_return, recent_five_annual_shares, last_reported_non_current_liabilities, last_reported_preferred_stock
 
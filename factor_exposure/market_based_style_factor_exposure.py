@@ -4,12 +4,12 @@ sys.path.append("/Users/jjj728/git/cne5_factors/factor_exposure/")
 
 from intermediate_variables import *
 from operators import *
+from market_data_store import *
 
 import numpy as np
 import pandas as pd
 from datetime import datetime
 from datetime import timedelta
-from sklearn import linear_model
 
 import rqdatac
 rqdatac.init("ricequant", "Ricequant123", ('rqdatad-pro.ricequant.com', 16004))
@@ -39,13 +39,9 @@ def non_linear_size(size_exposure, market_cap_on_current_day):
 
 def get_market_portfolio_beta(stock_excess_return, market_portfolio_excess_return, market_cap_on_current_day):
 
-    benchmark_variance = market_portfolio_excess_return.var()
-
-    beta = [market_portfolio_excess_return.cov(stock_excess_return[stock])/benchmark_variance for stock in stock_excess_return.columns]
-
     # 不考虑基准组合的贝塔
 
-    market_portfolio_beta = pd.Series(beta, index = stock_excess_return.columns)
+    market_portfolio_beta = get_beta_matrix(stock_excess_return, market_portfolio_excess_return)
 
     processed_market_portfolio_beta = winsorization_and_market_cap_weighed_standardization(market_portfolio_beta, market_cap_on_current_day)
 
@@ -71,7 +67,7 @@ def get_cumulative_range(stock_list, date, market_cap_on_current_day):
 
     trading_date_253_before = rqdatac.get_trading_dates(date - timedelta(days=500), date, country='cn')[-253]
 
-    daily_return = rqdatac.get_price(stock_list, trading_date_253_before, date, frequency='1d', fields='close').fillna(method='ffill').pct_change()[1:]
+    daily_return = get_market_data(stock_list, trading_date_253_before, date, 'close').fillna(method='ffill').pct_change()[1:]
 
     # 剔除收益率数据少于66个的股票
 
@@ -108,11 +104,13 @@ def get_historical_sigma(stock_excess_return, market_portfolio_excess_return, ma
 
     exp_weight = get_exponential_weight(half_life = 63, length = 252)
 
-    weighted_residual_volatiltiy = pd.Series()
+    # (stock_return - beta * market_return) * exp_weight 等价于对加权后的收益率计算 alpha 为0的残差
+
+    weighted_stock_excess_return = stock_excess_return.T.multiply(exp_weight).T
 
-    for stock in stock_excess_return.columns:
+    weighted_market_portfolio_excess_return = market_portfolio_excess_return.multiply(exp_weight)
 
-        weighted_residual_volatiltiy[stock] = ((stock_excess_return[stock] - market_portfolio_beta[stock] * market_portfolio_excess_return).multiply(exp_weight)).std()
+    alpha, weighted_residual_volatiltiy = get_alpha_and_residual_volatility(weighted_stock_excess_return, weighted_market_portfolio_excess_return, market_portfolio_beta, alpha=0)
 
     # 相对于贝塔正交化，降低波动率因子和贝塔因子的共线性
 
@@ -137,7 +135,7 @@ def get_momentum(stock_list, date, market_cap_on_current_day):
 
     # 提取股票价格数据，对于退市情况，考虑作股价向前填补（日收益率为0）
 
-    daily_return = rqdatac.get_price(stock_list, trading_date_505_before, trading_date_21_before, frequency='1d', fields='close').fillna(method='ffill').pct_change()[1:]
+    daily_return = get_market_data(stock_list, trading_date_505_before, trading_date_21_before, 'close').fillna(method='ffill').pct_change()[1:]
 
     # 剔除收益率数据少于66个的股票
 
@@ -164,9 +162,9 @@ def get_liquidity(stock_list, date, market_cap_on_current_day):
 
     stock_without_suspended_stock = drop_suspended_stock(stock_list,date)
 
-    trading_volume = rqdatac.get_price(stock_without_suspended_stock, trading_date_252_before, date, frequency='1d', fields='volume')
+    trading_volume = get_market_data(stock_without_suspended_stock, trading_date_252_before, date, 'volume')
 
-    outstanding_shares = rqdatac.get_shares(stock_without_suspended_stock, trading_date_252_before, date, fields='total_a')
+    outstanding_shares = get_market_data(stock_without_suspended_stock, trading_date_252_before, date, 'total_a')
 
     daily_turnover_rate = trading_volume.divide(outstanding_shares)
 
@@ -274,132 +272,125 @@ def get_book_leverage(date,market_cap_on_current_day):
     return processed_blev
 
 
-def get_sales_growth(date,year,market_cap_on_current_day):
-    recent_report, annual_report, annual_report_last_year, annual_report_2_year_ago, annual_report_3_year_ago, annual_report_4_year_ago = last_five_annual_report(
-        date)
+def last_five_annual_report(date):
+
+    recent_report_type, annual_report_type = get_recent_financial_report(date)
+
+    # 每只股票最近一期年报之前的四期年报，例如最近一期年报为 '2016q4'，则依次为 '2015q4'，'2014q4'，'2013q4'，'2012q4'
+
+    previous_annual_reports = [annual_report_type.apply(lambda quarter: str(int(quarter[:4]) - number_of_years) + 'q4') for number_of_years in range(1, 5)]
+
+    return (recent_report_type, annual_report_type) + tuple(previous_annual_reports)
+
+
+def get_growth_qualified_stocks(date, stock_list):
+
+    # 上市满五年的股票才计算成长因子；一次取出全部股票的上市日期，不再逐只股票调用 rqdatac.instruments
+
     growth_listed_date_threshold = (datetime.strptime(date, "%Y-%m-%d") - timedelta(days=1825)).strftime("%Y-%m-%d")
-    growth_qualified_stocks = [i for i in annual_report.index.tolist() if
-                               rqdatac.instruments(i).listed_date < growth_listed_date_threshold]
 
-    factor = pd.DataFrame(index=growth_qualified_stocks, columns=['SGRO'])
+    instruments = rqdatac.all_instruments(type='CS')
 
-    # 根据年报数据计算每只股票过去五年每年的sales per share
+    listed_date = pd.Series(instruments['listed_date'].values, index=instruments['order_book_id'].values)
 
-    for stock in growth_qualified_stocks:
+    listed_date = listed_date.reindex(stock_list)
 
-        query = rqdatac.query(rqdatac.financials.income_statement.revenue).filter(
-            rqdatac.financials.stockcode.in_([stock]))
-        sales_recent = rqdatac.get_financials(query, annual_report[stock], '1q')
+    return listed_date[listed_date < growth_listed_date_threshold].index.tolist()
 
-        latest_trading_date_recent = str(
-            rqdatac.get_previous_trading_date(
-                datetime.strptime(annual_report[stock][:4] + '-12-31', '%Y-%m-%d') + timedelta(days=1)))
 
-        shares_recent = rqdatac.get_shares(stock, start_date=latest_trading_date_recent,
-                                           end_date=latest_trading_date_recent, fields='total')
+def _select_annual_report_values(data, annual_reports):
 
-        sales_per_share_recent = sales_recent.values / shares_recent.values
+    # data 的 index 为股票代码，columns 为报告期；按每只股票的五期年报类型取值，返回 DataFrame，columns 与 annual_reports 的顺序一致
 
-        sales_last_year = rqdatac.get_financials(query, annual_report_last_year[stock], '1q')
+    annual_report_values = pd.DataFrame(index=data.index)
 
-        latest_trading_date_last_year = str(
-            rqdatac.get_previous_trading_date(
-                datetime.strptime(annual_report_last_year[stock][:4] + '-12-31', '%Y-%m-%d') + timedelta(days=1)))
+    for number, annual_report in enumerate(annual_reports):
 
-        shares_last_year = rqdatac.get_shares(stock, start_date=latest_trading_date_last_year,
-                                              end_date=latest_trading_date_last_year, fields='total')
+        column_positions = data.columns.get_indexer(annual_report.reindex(data.index))
 
-        sales_per_share_last_year = sales_last_year.values / shares_last_year.values
+        selected_values = data.values[np.arange(len(data.index)), column_positions]
 
-        sales_2_year_ago = rqdatac.get_financials(query, annual_report_2_year_ago[stock], '1q')
+        annual_report_values[number] = np.where(column_positions >= 0, selected_values, np.nan)
 
-        latest_trading_date_2_year_ago = str(
-            rqdatac.get_previous_trading_date(
-                datetime.strptime(annual_report_2_year_ago[stock][:4] + '-12-31', '%Y-%m-%d') + timedelta(days=1)))
+    return annual_report_values
 
-        shares_2_year_ago = rqdatac.get_shares(stock, start_date=latest_trading_date_2_year_ago,
-                                               end_date=latest_trading_date_2_year_ago, fields='total')
 
-        sales_per_share_2_year_ago = sales_2_year_ago.values / shares_2_year_ago.values
+def get_annual_report_values(fields, annual_reports, date):
 
-        sales_3_year_ago = rqdatac.get_financials(query, annual_report_3_year_ago[stock], '1q')
+    # 全部股票所需的年报（最多六期）通过一次多字段请求写入本地财务报表数据仓库，返回字典，key 为字段名称
 
-        latest_trading_date_3_year_ago = str(
-            rqdatac.get_previous_trading_date(
-                datetime.strptime(annual_report_3_year_ago[stock][:4] + '-12-31', '%Y-%m-%d') + timedelta(days=1)))
+    quarters = sorted(set(pd.concat(annual_reports).dropna()))
 
-        shares_3_year_ago = rqdatac.get_shares(stock, start_date=latest_trading_date_3_year_ago,
-                                               end_date=latest_trading_date_3_year_ago, fields='total')
+    prefetch_financial_statements(fields, quarters, date)
 
-        sales_per_share_3_year_ago = sales_3_year_ago.values / shares_3_year_ago.values
+    stock_list = annual_reports[0].index
 
-        sales_4_year_ago = rqdatac.get_financials(query, annual_report_4_year_ago[stock], '1q')
+    return {field: _select_annual_report_values(get_financial_statements(field, quarters, date).reindex(stock_list), annual_reports) for field in fields}
 
-        latest_trading_date_4_year_ago = str(
-            rqdatac.get_previous_trading_date(
-                datetime.strptime(annual_report_4_year_ago[stock][:4] + '-12-31', '%Y-%m-%d') + timedelta(days=1)))
 
-        shares_4_year_ago = rqdatac.get_shares(stock, start_date=latest_trading_date_4_year_ago,
-                                               end_date=latest_trading_date_4_year_ago, fields='total')
+def get_annual_report_shares(annual_reports):
 
-        sales_per_share_4_year_ago = sales_4_year_ago.values / shares_4_year_ago.values
+    # 以年报所属年度最后一个交易日的总股本作为当年的股本，每个年度只读取一次全部股票的股本
 
-        regression = linear_model.LinearRegression()
-        sales_per_share = pd.Series(
-            [sales_per_share_recent, sales_per_share_last_year, sales_per_share_2_year_ago, sales_per_share_3_year_ago,
-             sales_per_share_4_year_ago]).fillna(value=0)
-        regression.fit(year.reshape(-1, 1), sales_per_share)
-        factor['SGRO'][stock] = float(regression.coef_) / abs(sales_per_share).mean()
+    quarters = sorted(set(pd.concat(annual_reports).dropna()))
 
-    sale_growth = winsorization_and_market_cap_weighed_standardization(factor['SGRO'], market_cap_on_current_day)
+    stock_list = annual_reports[0].index.tolist()
 
-    return sale_growth
+    annual_shares = pd.DataFrame({quarter: get_market_data_on_date(stock_list, get_trading_calendar(calendar_start_date, quarter[:4] + '-12-31')[-1], 'total') for quarter in quarters})
 
+    return _select_annual_report_values(annual_shares.reindex(stock_list), annual_reports)
+
+
+def get_regression_slope(values, year):
+
+    # 每只股票的五期数据对 year 做一元线性回归，斜率 = sum((x - x_mean) * y) / sum((x - x_mean) ** 2)，结果与逐只股票调用 linear_model.LinearRegression 相同
+
+    demeaned_year = np.asarray(year, dtype=np.float64) - np.mean(year)
+
+    return pd.Series(values.fillna(value=0).values.dot(demeaned_year) / demeaned_year.dot(demeaned_year), index=values.index)
+
+
+def get_sales_growth(date,year,market_cap_on_current_day):
 
-def get_earnings_growth(date,year,market_cap_on_current_day):
     recent_report, annual_report, annual_report_last_year, annual_report_2_year_ago, annual_report_3_year_ago, annual_report_4_year_ago = last_five_annual_report(
         date)
-    growth_listed_date_threshold = (datetime.strptime(date, "%Y-%m-%d") - timedelta(days=1825)).strftime("%Y-%m-%d")
-    growth_qualified_stocks = [i for i in annual_report.index.tolist() if
-                               rqdatac.instruments(i).listed_date < growth_listed_date_threshold]
 
-    factor = pd.DataFrame(index=growth_qualified_stocks, columns=['EGRO'])
+    growth_qualified_stocks = get_growth_qualified_stocks(date, annual_report.index.tolist())
+
+    annual_reports = [report.loc[growth_qualified_stocks] for report in [annual_report, annual_report_last_year, annual_report_2_year_ago, annual_report_3_year_ago, annual_report_4_year_ago]]
+
+    # 根据年报数据计算每只股票过去五年每年的sales per share
+
+    sales = get_annual_report_values(['revenue'], annual_reports, date)['revenue']
 
-    for stock in growth_qualified_stocks:
-        # 实际操作中发现有部分公司会在财报发布后对报表进行多次调整，调整后eps为空，比如'601519.XSHG'，该公司报表在发布后经过多次调整，2014年年报主要财务指标表"基本eps"数据缺失，但是在利润表中"基本eps"数据存在，
-        # 所以在取数据时进行判断，如果financial_indicator为首选表，income_statement 为备选表
-        query_f = rqdatac.query(rqdatac.financials.financial_indicator.earnings_per_share).filter(
-            rqdatac.financials.stockcode.in_([stock]))
+    sales_per_share = (sales / get_annual_report_shares(annual_reports)).fillna(value=0)
+
+    factor = get_regression_slope(sales_per_share, year) / abs(sales_per_share).mean(axis=1)
+
+    sale_growth = winsorization_and_market_cap_weighed_standardization(factor, market_cap_on_current_day)
+
+    return sale_growth
+
+
+def get_earnings_growth(date,year,market_cap_on_current_day):
+
+    recent_report, annual_report, annual_report_last_year, annual_report_2_year_ago, annual_report_3_year_ago, annual_report_4_year_ago = last_five_annual_report(
+        date)
 
-        query_i = rqdatac.query(rqdatac.financials.income_statement.basic_earnings_per_share).filter(
-            rqdatac.financials.stockcode.in_([stock]))
+    growth_qualified_stocks = get_growth_qualified_stocks(date, annual_report.index.tolist())
 
-        eps_recent = rqdatac.get_financials(query_f, annual_report[stock], '1q') if \
-            rqdatac.get_financials(query_f, annual_report[stock], '1q').isnull().sum() == 0 \
-            else rqdatac.get_financials(query_i, annual_report[stock], '1q')
+    annual_reports = [report.loc[growth_qualified_stocks] for report in [annual_report, annual_report_last_year, annual_report_2_year_ago, annual_report_3_year_ago, annual_report_4_year_ago]]
 
-        eps_last_year = rqdatac.get_financials(query_f, annual_report_last_year[stock], '1q') if \
-            rqdatac.get_financials(query_f, annual_report_last_year[stock], '1q').isnull().sum() == 0 \
-            else rqdatac.get_financials(query_i, annual_report_last_year[stock], '1q')
+    # 实际操作中发现有部分公司会在财报发布后对报表进行多次调整，调整后eps为空，比如'601519.XSHG'，该公司报表在发布后经过多次调整，2014年年报主要财务指标表"基本eps"数据缺失，但是在利润表中"基本eps"数据存在，
+    # 所以在取数据时进行判断，如果financial_indicator为首选表，income_statement 为备选表
 
-        eps_2_year_ago = rqdatac.get_financials(query_f, annual_report_2_year_ago[stock], '1q') if \
-            rqdatac.get_financials(query_f, annual_report_2_year_ago[stock], '1q').isnull().sum() == 0 \
-            else rqdatac.get_financials(query_i, annual_report_2_year_ago[stock], '1q')
+    eps_values = get_annual_report_values(['earnings_per_share', 'basic_earnings_per_share'], annual_reports, date)
 
-        eps_3_year_ago = rqdatac.get_financials(query_f, annual_report_3_year_ago[stock], '1q') if \
-            rqdatac.get_financials(query_f, annual_report_3_year_ago[stock], '1q').isnull().sum() == 0 \
-            else rqdatac.get_financials(query_i, annual_report_3_year_ago[stock], '1q')
+    eps = eps_values['earnings_per_share'].where(eps_values['earnings_per_share'].notnull(), eps_values['basic_earnings_per_share']).fillna(value=0)
 
-        eps_4_year_ago = rqdatac.get_financials(query_f, annual_report_4_year_ago[stock], '1q') if \
-            rqdatac.get_financials(query_f, annual_report_4_year_ago[stock], '1q').isnull().sum() == 0 \
-            else rqdatac.get_financials(query_i, annual_report_4_year_ago[stock], '1q')
+    factor = get_regression_slope(eps, year) / abs(eps.mean(axis=1))
 
-        regression = linear_model.LinearRegression()
-        eps = pd.Series(
-            [eps_recent, eps_last_year, eps_2_year_ago, eps_3_year_ago, eps_4_year_ago]).fillna(value=0)
-        regression.fit(year.reshape(-1, 1), eps)
-        factor['EGRO'][stock] = float(regression.coef_) / abs(eps.mean())
-    earning_growth = winsorization_and_market_cap_weighed_standardization(factor['EGRO'], market_cap_on_current_day)
+    earning_growth = winsorization_and_market_cap_weighed_standardization(factor, market_cap_on_current_day)
 
     return earning_growth
 
@@ -418,7 +409,7 @@ def get_style_factors(date):
 
     stock_excess_return, market_portfolio_excess_return = get_daily_excess_return(stock_list, trading_date_252_before.strftime('%Y-%m-%d'), latest_trading_date.strftime('%Y-%m-%d'))
 
-    market_cap_on_current_day = rqdatac.get_factor(id_or_symbols=stock_excess_return.columns.tolist(),factor='a_share_market_val',start_date=latest_trading_date.strftime('%Y-%m-%d'),end_date=latest_trading_date.strftime('%Y-%m-%d'))
+    market_cap_on_current_day = get_market_data_on_date(stock_excess_return.columns.tolist(), latest_trading_date, 'a_share_market_val')
 
     size_exposure = size(market_cap_on_current_day)
 
@@ -0,0 +1,175 @@
+import sys
+
+sys.path.append("/Users/jjj728/git/cne5_factors/factor_exposure/")
+
+from intermediate_variables import *
+from operators import *
+from market_data_store import *
+
+import numpy as np
+import pandas as pd
+
+import rqdatac
+
+rqdatac.init("ricequant", "Ricequant123", ('rqdatad-pro.ricequant.com', 16004))
+
+
+# 动量因子需要最长的行情窗口（525 个交易日的收盘价）
+
+price_window_length = 525
+
+benchmark_list = ['000016.XSHG', '000300.XSHG', '000905.XSHG', '000906.XSHG', '000985.XSHG']
+
+# 经测试发现，中证全指（000985）作为 market portfolio 的效果最好
+
+market_portfolio = '000985.XSHG'
+
+
+class MarketContext(object):
+
+    # 计算日期的交易日历、行情数据、无风险收益率、市值和行业标记只在构建时获取一次，之后所有细分因子函数直接读取内存中的数据
+
+    def __init__(self, date):
+
+        self.latest_trading_date = get_trading_calendar(calendar_start_date, date)[-1].date()
+
+        self.trading_dates = get_trading_calendar(calendar_start_date, self.latest_trading_date)[-price_window_length:]
+
+        self.stock_list = rqdatac.all_instruments(type='CS', date=self.latest_trading_date)['order_book_id'].values.tolist()
+
+        # 行情数据（收盘价为后复权价格）
+
+        self.close_price = get_market_data(self.stock_list, self.trading_dates[0], self.latest_trading_date, 'close')
+
+        self.benchmark_close_price = get_market_data(benchmark_list, self.trading_dates[0], self.latest_trading_date, 'close')
+
+        self.trading_volume = get_market_data(self.stock_list, self.trading_date_before(252), self.latest_trading_date, 'volume')
+
+        self.outstanding_shares = get_market_data(self.stock_list, self.trading_date_before(252), self.latest_trading_date, 'total_a')
+
+        # 把复利无风险日收益率转为日收益率（取出全部期限，各因子按需选择 '0S' 或 '3M'）
+
+        compounded_risk_free_return = rqdatac.get_yield_curve(start_date=self.trading_dates[0], end_date=self.latest_trading_date)
+
+        compounded_risk_free_return.index = pd.DatetimeIndex(compounded_risk_free_return.index)
+
+        self.risk_free_return = ((1 + compounded_risk_free_return) ** (1 / 365)) - 1
+
+        # 过去 252 个交易日的日收益率，剔除收益率数据存在空值的股票
+
+        stock_daily_return = self.get_daily_return(self.trading_date_before(252), self.latest_trading_date)
+
+        inds = stock_daily_return.isnull().sum()[stock_daily_return.isnull().sum() > 0].index
+
+        self.stock_daily_return = stock_daily_return.drop(inds, axis=1)
+
+        market_portfolio_daily_return = self.get_benchmark_daily_return(market_portfolio, self.trading_date_before(252), self.latest_trading_date)
+
+        self.stock_excess_return = self.stock_daily_return.T.subtract(self.risk_free_return['3M'].loc[self.stock_daily_return.index]).T
+
+        self.market_portfolio_excess_return = market_portfolio_daily_return.subtract(self.risk_free_return['3M'].loc[market_portfolio_daily_return.index])
+
+        # 若市值出现缺失，取前22个交易日的市值平均值进行填补
+
+        self.market_cap_on_current_day = get_market_data_on_date(self.stock_list, self.latest_trading_date, 'a_share_market_val').dropna()
+
+        if len(self.market_cap_on_current_day.index) < len(self.stock_list):
+
+            self.market_cap_on_current_day = market_cap_imputation(self.stock_list, self.market_cap_on_current_day, self.latest_trading_date)
+
+        self.industry_label = get_shenwan_industry_label(self.stock_list, self.latest_trading_date.strftime('%Y-%m-%d'))
+
+    def trading_date_before(self, number_of_trading_days):
+
+        # 等价于 rqdatac.get_trading_dates(date - timedelta(days=...), latest_trading_date)[-number_of_trading_days]
+
+        return self.trading_dates[-number_of_trading_days].date()
+
+    def get_daily_return(self, start_date, end_date):
+
+        # 以 start_date 前一交易日的收盘价为起点计算日收益率；对于退市或停牌情况，股价向前填补（日收益率为0），填补范围不超出该窗口
+
+        close_price = self.close_price.loc[:pd.Timestamp(end_date)]
+
+        start_position = close_price.index.get_loc(pd.Timestamp(start_date))
+
+        return close_price.iloc[start_position - 1:].fillna(method='ffill').pct_change()[1:]
+
+    def get_benchmark_daily_return(self, benchmark, start_date, end_date):
+
+        close_price = self.benchmark_close_price[benchmark].loc[:pd.Timestamp(end_date)]
+
+        start_position = close_price.index.get_loc(pd.Timestamp(start_date))
+
+        return close_price.iloc[start_position - 1:].fillna(method='ffill').pct_change()[1:]
+
+
+class MarketPanel(object):
+
+    # 日期区间模式（get_style_factors_range）使用：区间起点前 525 个交易日至区间终点的行情数据只读取一次，之后逐日滚动计算
+
+    def __init__(self, start_date, end_date):
+
+        self.trading_dates_in_range = get_trading_calendar(start_date, end_date)
+
+        trading_calendar = get_trading_calendar(calendar_start_date, self.trading_dates_in_range[-1])
+
+        first_position = trading_calendar.get_loc(self.trading_dates_in_range[0])
+
+        self.trading_dates = trading_calendar[first_position - price_window_length + 1:]
+
+        # 每个交易日的股票池等价于 rqdatac.all_instruments(type='CS', date=date)：已上市且未退市的股票
+
+        instruments = rqdatac.all_instruments(type='CS')
+
+        listed_date = pd.to_datetime(instruments['listed_date'], errors='coerce')
+
+        de_listed_date = pd.to_datetime(instruments['de_listed_date'], errors='coerce')
+
+        in_panel = (listed_date <= self.trading_dates[-1]) & (de_listed_date.isnull() | (de_listed_date > self.trading_dates[0]))
+
+        self.stock_list = instruments['order_book_id'][in_panel].values.tolist()
+
+        self.listed_date = pd.Series(listed_date[in_panel].values, index=self.stock_list)
+
+        self.de_listed_date = pd.Series(de_listed_date[in_panel].values, index=self.stock_list)
+
+        # 行情数据（收盘价为后复权价格）
+
+        self.close_price = get_market_data(self.stock_list, self.trading_dates[0], self.trading_dates[-1], 'close')
+
+        self.benchmark_close_price = get_market_data(benchmark_list, self.trading_dates[0], self.trading_dates[-1], 'close')
+
+        self.trading_volume = get_market_data(self.stock_list, self.trading_dates[0], self.trading_dates[-1], 'volume')
+
+        self.outstanding_shares = get_market_data(self.stock_list, self.trading_dates[0], self.trading_dates[-1], 'total_a')
+
+        self.market_cap = get_market_data(self.stock_list, self.trading_dates[0], self.trading_dates[-1], 'a_share_market_val')
+
+        compounded_risk_free_return = rqdatac.get_yield_curve(start_date=self.trading_dates[0], end_date=self.trading_dates[-1])
+
+        compounded_risk_free_return.index = pd.DatetimeIndex(compounded_risk_free_return.index)
+
+        self.risk_free_return = (((1 + compounded_risk_free_return) ** (1 / 365)) - 1).reindex(self.trading_dates)
+
+    def is_listed(self, date):
+
+        # 返回布尔数组，顺序与 self.stock_list 一致
+
+        date = pd.Timestamp(date)
+
+        return ((self.listed_date <= date) & (self.de_listed_date.isnull() | (self.de_listed_date > date))).values
+
+    def get_market_cap_on_current_day(self, date):
+
+        stock_list = list(np.array(self.stock_list)[self.is_listed(date)])
+
+        market_cap_on_current_day = self.market_cap.loc[pd.Timestamp(date), stock_list].dropna()
+
+        # 若市值出现缺失，取前22个交易日的市值平均值进行填补
+
+        if len(market_cap_on_current_day.index) < len(stock_list):
+
+            market_cap_on_current_day = market_cap_imputation(stock_list, market_cap_on_current_day, pd.Timestamp(date).date())
+
+        return market_cap_on_current_day
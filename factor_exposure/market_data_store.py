@@ -0,0 +1,370 @@
+###### 本地行情数据仓库 ######
+
+
+### 模块说明 ###
+
+# 各因子函数（get_cumulative_range、get_momentum、get_liquidity、get_stock_beta、get_daily_excess_return 等）原本各自调用 rqdatac.get_price，
+
+# 对全市场股票重复下载长度为 252 ~ 525 个交易日、互相重叠的行情数据。本模块把收盘价、成交量、股本和市值保存在本地，所有模块统一通过 get_market_data 读取。
+
+# 数据按字段、按年份分区保存为 numpy 数组（.npy），读取时使用 memory mapping，只把所需的行和列读入内存；
+
+# 若本地数据缺少某些交易日（或某些股票），仅向数据服务器请求缺失部分，再写回本地。
+
+
+### 存储结构 ###
+
+# market_data_path/order_book_ids.pkl ：全局股票（指数）代码列表，只追加不删除，数组的列顺序与其一致；
+
+# market_data_path/trading_calendar.pkl ：交易日历；
+
+# market_data_path/<field>/<year>.npy ：该年份所有已保存交易日的数据（行：交易日，列：order_book_ids）；
+
+# market_data_path/<field>/<year>_dates.npy ：该年份已保存的交易日；
+
+# market_data_path/<field>/<year>_coverage.npy ：每个交易日已下载的股票数量（即 order_book_ids 的前 coverage 个代码已下载）。
+
+
+import os
+import fcntl
+import pickle
+import tempfile
+import contextlib
+
+import numpy as np
+import pandas as pd
+
+import rqdatac
+
+rqdatac.init("ricequant", "Ricequant123", ('rqdatad-pro.ricequant.com', 16004))
+
+
+### paths for saving files ###
+
+market_data_path = os.path.join(os.path.expanduser('~'), 'cne5_factors_data', 'market_data')
+
+calendar_start_date = '2000-01-01'
+
+
+# 收盘价保存后复权价格：后复权价格不会因为之后的分红送转而改变历史数据，且计算得到的日收益率与前复权价格一致
+
+market_data_fetchers = {
+
+    'close': lambda order_book_ids, start_date, end_date: rqdatac.get_price(order_book_ids, start_date, end_date, frequency='1d', fields='close', adjust_type='post'),
+
+    'unadjusted_close': lambda order_book_ids, start_date, end_date: rqdatac.get_price(order_book_ids, start_date, end_date, frequency='1d', fields='close', adjust_type='none'),
+
+    'volume': lambda order_book_ids, start_date, end_date: rqdatac.get_price(order_book_ids, start_date, end_date, frequency='1d', fields='volume'),
+
+    'total_a': lambda order_book_ids, start_date, end_date: rqdatac.get_shares(order_book_ids, start_date, end_date, fields='total_a'),
+
+    'total': lambda order_book_ids, start_date, end_date: rqdatac.get_shares(order_book_ids, start_date, end_date, fields='total'),
+
+    'a_share_market_val': lambda order_book_ids, start_date, end_date: rqdatac.get_factor(id_or_symbols=order_book_ids, factor='a_share_market_val', start_date=start_date, end_date=end_date)}
+
+
+def _save_array(path, array):
+
+    # 先写临时文件再替换，避免写入中断时损坏已有数据；临时文件名唯一，多个进程同时写入同一文件时互不覆盖临时文件
+
+    file_descriptor, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+
+    with os.fdopen(file_descriptor, 'wb') as temp_file:
+
+        np.save(temp_file, array)
+
+    os.replace(temp_path, path)
+
+
+def _save_pickle(path, data):
+
+    file_descriptor, temp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+
+    with os.fdopen(file_descriptor, 'wb') as temp_file:
+
+        pickle.dump(data, temp_file)
+
+    os.replace(temp_path, path)
+
+
+def _load_pickle(path):
+
+    with open(path, 'rb') as pkfl:
+
+        return pickle.load(pkfl)
+
+
+@contextlib.contextmanager
+def _file_lock(path, exclusive=True):
+
+    # 跨进程的文件锁（path + '.lock'）：读取-修改-写入由多个文件组成的分区时持有排他锁，只读取时持有共享锁
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    with open(path + '.lock', 'a') as lock_file:
+
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+
+        try:
+
+            yield
+
+        finally:
+
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+def get_trading_calendar(start_date, end_date):
+
+    start_date = pd.Timestamp(start_date).normalize()
+
+    end_date = pd.Timestamp(end_date).normalize()
+
+    complete_path = os.path.join(market_data_path, 'trading_calendar.pkl')
+
+    calendar_end_date, trading_calendar = _load_pickle(complete_path) if os.path.exists(complete_path) else (None, None)
+
+    # 本地日历未覆盖所需日期时，重新下载至所需年份年末
+
+    if calendar_end_date is None or end_date > calendar_end_date:
+
+        calendar_end_date = pd.Timestamp(str(end_date.year) + '-12-31')
+
+        trading_calendar = pd.DatetimeIndex(rqdatac.get_trading_dates(calendar_start_date, calendar_end_date, country='cn'))
+
+        os.makedirs(market_data_path, exist_ok=True)
+
+        _save_pickle(complete_path, (calendar_end_date, trading_calendar))
+
+    return trading_calendar[(trading_calendar >= start_date) & (trading_calendar <= end_date)]
+
+
+def get_trading_date_before(date, number_of_trading_days):
+
+    # 等价于 rqdatac.get_trading_dates(date - timedelta(days=...), date)[-number_of_trading_days]，但不需要访问数据服务器
+
+    trading_dates = get_trading_calendar(calendar_start_date, date)
+
+    return trading_dates[-number_of_trading_days].date()
+
+
+def _register_order_book_ids(order_book_ids, complete_path=None):
+
+    # 代码列表只追加不删除；多个进程同时登记新代码时，持有排他锁读取、追加并写回，避免互相覆盖
+
+    complete_path = os.path.join(market_data_path, 'order_book_ids.pkl') if complete_path is None else complete_path
+
+    all_order_book_ids = _load_pickle(complete_path) if os.path.exists(complete_path) else []
+
+    registered_order_book_ids = set(all_order_book_ids)
+
+    if all(order_book_id in registered_order_book_ids for order_book_id in order_book_ids):
+
+        return all_order_book_ids
+
+    with _file_lock(complete_path):
+
+        all_order_book_ids = _load_pickle(complete_path) if os.path.exists(complete_path) else []
+
+        registered_order_book_ids = set(all_order_book_ids)
+
+        new_order_book_ids = [order_book_id for order_book_id in pd.unique(pd.Series(order_book_ids)) if order_book_id not in registered_order_book_ids]
+
+        if len(new_order_book_ids) > 0:
+
+            all_order_book_ids = all_order_book_ids + new_order_book_ids
+
+            _save_pickle(complete_path, all_order_book_ids)
+
+    return all_order_book_ids
+
+
+def _partition_paths(field, year):
+
+    field_path = os.path.join(market_data_path, field)
+
+    return os.path.join(field_path, str(year) + '.npy'), os.path.join(field_path, str(year) + '_dates.npy'), os.path.join(field_path, str(year) + '_coverage.npy')
+
+
+def _load_partition(field, year, mmap_mode='r'):
+
+    values_path, dates_path, coverage_path = _partition_paths(field, year)
+
+    if not os.path.exists(coverage_path):
+
+        return pd.DatetimeIndex([]), np.zeros(0, dtype=np.int64), np.empty((0, 0))
+
+    dates, coverage, values = pd.DatetimeIndex(np.load(dates_path)), np.load(coverage_path), np.load(values_path, mmap_mode=mmap_mode)
+
+    # 三个文件分别替换，写入中断时行数可能不一致：视为分区不存在，需要的交易日重新下载
+
+    if not (len(dates) == len(coverage) == values.shape[0]):
+
+        return pd.DatetimeIndex([]), np.zeros(0, dtype=np.int64), np.empty((0, 0))
+
+    return dates, coverage, values
+
+
+def _save_partition(field, year, dates, coverage, values):
+
+    values_path, dates_path, coverage_path = _partition_paths(field, year)
+
+    os.makedirs(os.path.dirname(values_path), exist_ok=True)
+
+    # coverage 最后写入：写入中断时，已保存的 coverage 不会超过实际写入的数据（行数不一致时 _load_partition 视为分区不存在）
+
+    _save_array(values_path, values)
+
+    _save_array(dates_path, dates.values.astype('datetime64[D]'))
+
+    _save_array(coverage_path, coverage)
+
+
+def _fetch_market_data(field, order_book_ids, dates):
+
+    fetched_data = market_data_fetchers[field](order_book_ids, dates[0], dates[-1])
+
+    if fetched_data is None:
+
+        return pd.DataFrame(np.nan, index=dates, columns=order_book_ids)
+
+    # 只传入一只股票或只有一个交易日时，rqdatac 返回 Series
+
+    if isinstance(fetched_data, pd.Series):
+
+        fetched_data = fetched_data.to_frame(order_book_ids[0]) if len(order_book_ids) == 1 else fetched_data.to_frame(dates[0]).T
+
+    fetched_data.index = pd.DatetimeIndex(fetched_data.index).normalize()
+
+    return fetched_data.reindex(index=dates, columns=order_book_ids).astype(np.float64)
+
+
+def _update_partition(field, year, trading_dates, all_order_book_ids, required_coverage):
+
+    dates, coverage, values = _load_partition(field, year, mmap_mode=None)
+
+    stored_coverage = pd.Series(coverage, index=dates).reindex(trading_dates).fillna(0).astype(np.int64)
+
+    outdated_coverage = stored_coverage[stored_coverage < required_coverage]
+
+    if len(outdated_coverage) == 0:
+
+        return
+
+    updated_dates = dates.union(outdated_coverage.index)
+
+    updated_values = np.full((len(updated_dates), len(all_order_book_ids)), np.nan)
+
+    updated_values[updated_dates.get_indexer(dates), :values.shape[1]] = values
+
+    updated_coverage = pd.Series(coverage, index=dates).reindex(updated_dates).fillna(0).astype(np.int64)
+
+    # 已下载股票数量相同的交易日只需一次请求，下载的是尚未覆盖的全部股票，以便之后的请求直接命中本地数据
+
+    for covered_number, covered_dates in outdated_coverage.groupby(outdated_coverage):
+
+        fetched_data = _fetch_market_data(field, all_order_book_ids[covered_number:], covered_dates.index)
+
+        updated_values[np.ix_(updated_dates.get_indexer(covered_dates.index), np.arange(covered_number, len(all_order_book_ids)))] = fetched_data.values
+
+    # 数据服务器按交易日整体发布数据：晚于最后一个有数据的交易日的交易日（例如当天数据尚未发布）不标记为已下载，下次请求时重新下载；
+
+    # 不晚于该交易日的缺失值（停牌、未上市等）为真实的缺失，标记为已下载
+
+    published_dates = updated_dates[~np.isnan(updated_values).all(axis=1)]
+
+    if len(published_dates) > 0:
+
+        updated_coverage[outdated_coverage.index[outdated_coverage.index <= published_dates.max()]] = len(all_order_book_ids)
+
+    _save_partition(field, year, updated_dates, updated_coverage.values, updated_values)
+
+
+def _read_partition(field, year, trading_dates, all_order_book_ids, column_positions, required_coverage):
+
+    # 子进程可能同时读取和更新同一分区：数据已覆盖时持有共享锁读取，否则持有排他锁，只向数据服务器请求本地缺失的交易日和股票后再读取
+
+    partition_path = _partition_paths(field, year)[0]
+
+    with _file_lock(partition_path, exclusive=False):
+
+        dates, coverage, values = _load_partition(field, year)
+
+        stored_coverage = pd.Series(coverage, index=dates).reindex(trading_dates).fillna(0)
+
+        if (stored_coverage >= required_coverage).all():
+
+            return values[np.ix_(dates.get_indexer(trading_dates), column_positions)]
+
+    with _file_lock(partition_path):
+
+        # 其他进程可能已登记新的代码并按更长的代码列表写入分区，重新读取代码列表（只追加，已有代码的位置不变）
+
+        all_order_book_ids = _register_order_book_ids(all_order_book_ids)
+
+        _update_partition(field, year, trading_dates, all_order_book_ids, required_coverage)
+
+        dates, coverage, values = _load_partition(field, year)
+
+        return values[np.ix_(dates.get_indexer(trading_dates), column_positions)]
+
+
+def get_market_data(order_book_ids, start_date, end_date, field):
+
+    # 返回 DataFrame，index 为交易日，columns 为 order_book_ids；功能上替代 rqdatac.get_price / get_shares / get_factor 对应字段的调用
+
+    order_book_ids = list(order_book_ids)
+
+    trading_dates = get_trading_calendar(start_date, end_date)
+
+    all_order_book_ids = _register_order_book_ids(order_book_ids)
+
+    column_positions = pd.Series(np.arange(len(all_order_book_ids)), index=all_order_book_ids)[order_book_ids].values
+
+    required_coverage = column_positions.max() + 1 if len(column_positions) > 0 else 0
+
+    market_data = []
+
+    for year in sorted(set(trading_dates.year)):
+
+        trading_dates_in_year = trading_dates[trading_dates.year == year]
+
+        market_data.append(pd.DataFrame(_read_partition(field, year, trading_dates_in_year, all_order_book_ids, column_positions, required_coverage), index=trading_dates_in_year, columns=order_book_ids))
+
+    if len(market_data) == 0:
+
+        return pd.DataFrame(columns=order_book_ids, dtype=np.float64)
+
+    return pd.concat(market_data, axis=0)
+
+
+def get_market_data_on_date(order_book_ids, date, field):
+
+    # 单个交易日的横截面数据，返回 Series，index 为 order_book_ids
+
+    market_data = get_market_data(order_book_ids, date, date, field)
+
+    return market_data.iloc[-1] if len(market_data) > 0 else pd.Series(np.nan, index=list(order_book_ids))
+
+
+def backfill_market_data(start_date, end_date, fields=None):
+
+    # 预先下载一段时间内全部 A 股的行情数据（例如历史回填前运行一次），避免之后逐日计算时频繁访问数据服务器
+
+    fields = list(market_data_fetchers.keys()) if fields is None else fields
+
+    stock_list = rqdatac.all_instruments(type='CS')['order_book_id'].values.tolist()
+
+    for field in fields:
+
+        # 每次下载一年，控制单次请求的数据量
+
+        for year in range(pd.Timestamp(start_date).year, pd.Timestamp(end_date).year + 1):
+
+            year_start_date = max(pd.Timestamp(start_date), pd.Timestamp(str(year) + '-01-01'))
+
+            year_end_date = min(pd.Timestamp(end_date), pd.Timestamp(str(year) + '-12-31'))
+
+            get_market_data(stock_list, year_start_date, year_end_date, field)
+
+        print(field, 'market data backfill is done')
@@ -1,7 +1,5 @@
-import scipy.optimize as sc_opt
 import numpy as np
 import pandas as pd
-import statsmodels.api as st
 
 import rqdatac
 
@@ -12,6 +10,8 @@ import sys
 sys.path.append("/Users/rice/Documents/cne5_factors/factor_exposure/")
 
 from intermediate_variables import *
+from market_data_store import *
+from panel_operators import *
 
 
 def winsorization_and_market_cap_weighed_standardization(factor_exposure, market_cap_on_current_day):
@@ -35,38 +35,160 @@ def winsorization_and_market_cap_weighed_standardization(factor_exposure, market
     return standardized_factor_exposure
 
 
-def orthogonalize(target_variable, reference_variable, regression_weight):
+def _masked_values(data):
+
+    # 返回把缺失值替换为0的数组，以及标记非缺失值的 0/1 数组，用于矩阵运算中剔除缺失值
+
+    values = data.values.astype(np.float64)
+
+    mask = ~np.isnan(values)
+
+    return np.where(mask, values, 0), mask.astype(np.float64)
+
+
+def weighted_orthogonalization(target_variable, reference_variable, regression_weight):
+
+    # 加权最小二乘（不含截距项）的闭式解：coef = (R'WR)^(-1) R'Wt，等价于求解 sum(w * (t - R * coef) * R) = 0，即原来以 L-BFGS-B 数值求解的方程
+
+    # target_variable 为 Series 或 N×J 的 DataFrame（可一次正交化多个因子）；reference_variable 为 Series 或 N×K 的 DataFrame（可同时对多个因子正交化）
+
+    # 每个目标因子只使用其本身、全部参照因子和权重均不缺失的股票进行回归；返回正交化后的因子，以及回归系数（Series 或 J×K 的 DataFrame）
+
+    target_frame = target_variable.to_frame() if isinstance(target_variable, pd.Series) else target_variable
+
+    reference_frame = reference_variable.to_frame() if isinstance(reference_variable, pd.Series) else reference_variable
+
+    reference_frame = reference_frame.reindex(target_frame.index)
+
+    weight = pd.Series(regression_weight).reindex(target_frame.index).values.astype(np.float64)
+
+    target_values, target_mask = _masked_values(target_frame)
+
+    reference_values = reference_frame.values.astype(np.float64)
+
+    available = ~np.isnan(reference_values).any(axis=1) & ~np.isnan(weight)
+
+    reference_values = np.where(available[:, None], reference_values, 0)
+
+    # 第 j 个目标因子的回归权重，缺失位置的权重为0
+
+    masked_weight = target_mask * np.where(available, weight, 0)[:, None]
 
-    initial_guess = 1
+    normal_matrix = np.einsum('nj,nk,nl->jkl', masked_weight, reference_values, reference_values)
 
-    def objective_function(coef):
+    moment_vector = np.einsum('nj,nk->jk', masked_weight * target_values, reference_values)
 
-        return np.abs((regression_weight * (target_variable - coef * reference_variable) * reference_variable).sum())
+    # 使用伪逆，参照因子共线或有效股票数量不足时不会报错
 
-    res = sc_opt.minimize(objective_function, x0=initial_guess, method='L-BFGS-B')
+    coefficients = np.einsum('jkl,jl->jk', np.linalg.pinv(normal_matrix), moment_vector)
 
-    orthogonalized_target_variable = target_variable - res['x'] * reference_variable
+    fitted_values = reference_frame.values.astype(np.float64).dot(coefficients.T)
+
+    orthogonalized_target_variable = pd.DataFrame(target_frame.values - fitted_values, index=target_frame.index, columns=target_frame.columns)
+
+    coefficients = pd.DataFrame(coefficients, index=target_frame.columns, columns=reference_frame.columns)
+
+    if isinstance(target_variable, pd.Series):
+
+        return orthogonalized_target_variable.iloc[:, 0], coefficients.iloc[0]
+
+    return orthogonalized_target_variable, coefficients
+
+
+def orthogonalize(target_variable, reference_variable, regression_weight):
+
+    orthogonalized_target_variable, coefficients = weighted_orthogonalization(target_variable, reference_variable, regression_weight)
 
     return orthogonalized_target_variable
 
 
+def get_beta_matrix(stock_return, benchmark_return):
+
+    # 一次矩阵运算得到全部股票对（多个）基准的 beta，结果与逐只股票计算 benchmark_return.cov(stock_return[stock]) / benchmark_return.var() 相同
+
+    # stock_return 为 T×N 的 DataFrame；benchmark_return 为 Series 或 T×B 的 DataFrame，返回 Series 或 N×B 的 DataFrame
+
+    benchmark_frame = benchmark_return.to_frame() if isinstance(benchmark_return, pd.Series) else benchmark_return
+
+    benchmark_frame = benchmark_frame.reindex(stock_return.index)
+
+    # 协方差不受平移影响，先减去均值以减少数值误差
+
+    stock_values, stock_mask = _masked_values(stock_return - stock_return.mean())
+
+    benchmark_values, benchmark_mask = _masked_values(benchmark_frame - benchmark_frame.mean())
+
+    # 与 Series.cov 一致，每对序列只使用两者都不缺失的交易日
+
+    pairwise_count = stock_mask.T.dot(benchmark_mask)
+
+    stock_sum = stock_values.T.dot(benchmark_mask)
+
+    benchmark_sum = stock_mask.T.dot(benchmark_values)
+
+    cross_product_sum = stock_values.T.dot(benchmark_values)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        covariance = (cross_product_sum - stock_sum * benchmark_sum / pairwise_count) / (pairwise_count - 1)
+
+    covariance[pairwise_count < 2] = np.nan
+
+    beta = pd.DataFrame(covariance / benchmark_frame.var().values, index=stock_return.columns, columns=benchmark_frame.columns)
+
+    return beta.iloc[:, 0] if isinstance(benchmark_return, pd.Series) else beta
+
+
+def get_alpha_and_residual_volatility(stock_return, benchmark_return, beta, alpha=None):
+
+    # 一次矩阵运算得到全部股票回归残差的标准差，结果与逐只股票计算 (stock_return[stock] - beta[stock] * benchmark_return - alpha[stock]).std() 相同
+
+    # 若不指定 alpha，则 alpha = stock_return[stock].mean() - beta[stock] * benchmark_return.mean()
+
+    benchmark_return = benchmark_return.reindex(stock_return.index)
+
+    beta = beta.reindex(stock_return.columns)
+
+    if alpha is None:
+
+        alpha = stock_return.mean() - beta * benchmark_return.mean()
+
+    residual = stock_return.values - np.outer(benchmark_return.values, beta.values) - np.asarray(alpha, dtype=np.float64)
+
+    residual_values, residual_mask = _masked_values(pd.DataFrame(residual))
+
+    observation_count = residual_mask.sum(axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        residual_mean = residual_values.sum(axis=0) / observation_count
+
+        residual_variance = (((residual_values - residual_mean) * residual_mask) ** 2).sum(axis=0) / (observation_count - 1)
+
+    residual_variance[observation_count < 2] = np.nan
+
+    residual_volatility = pd.Series(np.sqrt(residual_variance), index=stock_return.columns)
+
+    return alpha, residual_volatility
+
+
 def market_cap_imputation(stock_list,market_cap_on_current_day,latest_trading_date):
 
     missing_market_cap_list = list(set(stock_list) - set(market_cap_on_current_day.index.tolist()))
 
-    price_on_current_day = rqdatac.get_price(missing_market_cap_list,start_date=latest_trading_date.strftime('%Y-%m-%d'),end_date=latest_trading_date.strftime('%Y-%m-%d'),frequency='1d',fields='close',adjust_type='none').T
+    price_on_current_day = get_market_data_on_date(missing_market_cap_list, latest_trading_date, 'unadjusted_close')
 
-    shares_on_current_day = rqdatac.get_shares(missing_market_cap_list,latest_trading_date.strftime('%Y-%m-%d'),latest_trading_date.strftime('%Y-%m-%d'),fields='total_a').T
+    shares_on_current_day = get_market_data_on_date(missing_market_cap_list, latest_trading_date, 'total_a')
 
-    market_cap = pd.Series(data = (price_on_current_day * shares_on_current_day)[latest_trading_date.strftime('%Y-%m-%d')],index=missing_market_cap_list)
+    market_cap = pd.Series(data = price_on_current_day * shares_on_current_day, index=missing_market_cap_list)
 
     if market_cap.isnull().any():
 
         missing_list = market_cap[market_cap.isnull()].index.tolist()
 
-        trading_date_22_before = rqdatac.get_trading_dates(latest_trading_date - timedelta(days=50), latest_trading_date, country='cn')[-22]
+        trading_date_22_before = get_trading_date_before(latest_trading_date, 22)
 
-        missing_market_cap = (rqdatac.get_factor(id_or_symbols=missing_list, factor='a_share_market_val', start_date=trading_date_22_before.strftime('%Y-%m-%d'), end_date=latest_trading_date.strftime('%Y-%m-%d')).mean()).fillna(market_cap_on_current_day.mean())
+        missing_market_cap = (get_market_data(missing_list, trading_date_22_before, latest_trading_date, 'a_share_market_val').mean()).fillna(market_cap_on_current_day.mean())
 
         market_cap = pd.concat([market_cap,missing_market_cap])
 
@@ -77,15 +199,11 @@ def market_cap_imputation(stock_list,market_cap_on_current_day,latest_trading_da
 
 def atomic_descriptors_imputation_and_combination(atomic_descriptors_df, atom_descriptors_weight):
 
-    missing_desriptors_position_label = atomic_descriptors_df.notnull() + 0
-
-    # 根据细分因子缺失位置，计算每一个股票的暴露度的归一化权重
+    # 根据细分因子缺失位置，计算每一个股票的暴露度的归一化权重（见 panel_operators.panel_atomic_descriptors_combination）
 
-    renormalized_weight = missing_desriptors_position_label.dot(atom_descriptors_weight)
+    style_factor = panel_atomic_descriptors_combination(atomic_descriptors_df.values, atom_descriptors_weight.reindex(atomic_descriptors_df.columns).values)
 
-    style_factor = atomic_descriptors_df.replace(np.nan, 0).dot(atom_descriptors_weight).divide(renormalized_weight)
-
-    return style_factor
+    return pd.Series(style_factor, index=atomic_descriptors_df.index)
 
 
 def get_shenwan_industry_label(stock_list, date):
@@ -109,114 +227,95 @@ def get_shenwan_industry_label(stock_list, date):
     return industry_classification['index_name']
 
 
-def style_factors_imputation(style_factors_exposure, market_cap_on_current_day, date):
-
-    import statsmodels.api as st
-
-    imputed_style_factors_exposure = style_factors_exposure.copy()
-
-    industry_label = get_shenwan_industry_label(style_factors_exposure.index.tolist(), date)
-
-    style_factors_exposure['market_cap'] = market_cap_on_current_day
-
-    style_factors_exposure['industry_label'] = industry_label
+def grouped_factor_imputation(factor_exposure, market_cap_on_current_day, industry_label):
 
     # 风格因子暴露度缺失值处理逻辑，是寻找同行业中市值类似的股票，然后以该股票的因子暴露度取值作为缺失股票的因子暴露度取值
 
     # 实现方法为在同行业的股票中，用没有缺失的股票因子暴露度对股票市值做回归（考虑截距项），得到相应的回归系数，再用出现因子暴露度缺失值的股票的市值乘以回归系数，得到股票因子暴露度缺失值的估计值。
 
-    for industry in industry_label.unique():
+    # 全部（行业，因子）的回归在一次分组矩阵运算中完成，结果与逐个行业、逐个因子调用 statsmodels.OLS 相同；factor_exposure 为 N×J 的 DataFrame
 
-        industry_style_factor_exposure = style_factors_exposure[style_factors_exposure['industry_label'] == industry]
+    market_cap = market_cap_on_current_day.reindex(factor_exposure.index).values.astype(np.float64)
 
-        for factor in imputed_style_factors_exposure.columns:
+    industry_codes, industries = pd.factorize(industry_label.reindex(factor_exposure.index))
 
-            # 若某一行业中，股票对于特定因子的暴露度没有缺失，则跳过缺失值填补流程
+    factor_values, factor_mask = _masked_values(factor_exposure)
 
-            if industry_style_factor_exposure[factor].isnull().any() == False:
+    # 参与回归的股票：因子暴露度、市值和行业标记均不缺失
 
-                continue
+    sample_mask = (factor_mask > 0) & (~np.isnan(market_cap) & (industry_codes >= 0))[:, None]
 
-            else:
+    market_cap_values = np.where(sample_mask, market_cap[:, None], 0)
 
-                missing_data_stock_list = industry_style_factor_exposure[factor].index[industry_style_factor_exposure[factor].astype(np.float).apply(np.isnan)]
+    factor_values = np.where(sample_mask, factor_values, 0)
 
-                y = industry_style_factor_exposure[[factor, 'market_cap']].dropna()[factor].values
+    # G×N 的行业哑变量矩阵，与之相乘即得到每个（行业，因子）的分组求和
 
-                x = np.stack([industry_style_factor_exposure[[factor, 'market_cap']].dropna()['market_cap'].values, np.ones(len(y))]).T
+    industry_dummy = (industry_codes == np.arange(len(industries))[:, None]).astype(np.float64)
 
-                st_result = st.OLS(y, x).fit()
+    stock_position = np.maximum(industry_codes, 0)
 
-                exogenous_variables = pd.concat([industry_style_factor_exposure['market_cap'][missing_data_stock_list], pd.Series(data = 1, index = missing_data_stock_list)], axis = 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
 
-                imputed_style_factors_exposure.loc[missing_data_stock_list, factor] = exogenous_variables.dot(st_result.params)
+        sample_count = industry_dummy.dot(sample_mask.astype(np.float64))
 
-    return imputed_style_factors_exposure
+        market_cap_mean = industry_dummy.dot(market_cap_values) / sample_count
 
+        factor_mean = industry_dummy.dot(factor_values) / sample_count
 
-def individual_factor_imputation(stock_list, factor, market_cap_on_current_day, date):
+        # 先减去组内均值再求平方和与交叉乘积和，避免市值数量级较大时损失精度
 
-    industry_label = get_shenwan_industry_label(stock_list, date)
+        demeaned_market_cap = np.where(sample_mask, market_cap_values - market_cap_mean[stock_position], 0)
 
-    merged_df = pd.concat([factor, market_cap_on_current_day, industry_label], axis = 1)
+        demeaned_factor = np.where(sample_mask, factor_values - factor_mean[stock_position], 0)
 
-    merged_df.columns = ['factor', 'market_cap', 'industry_label']
+        market_cap_sum_of_squares = industry_dummy.dot(demeaned_market_cap ** 2)
 
-    imputed_factor = merged_df['factor'].copy()
+        slope = industry_dummy.dot(demeaned_market_cap * demeaned_factor) / market_cap_sum_of_squares
 
-    # 和因子暴露度缺失值填补逻辑类似，以回归法填补因子的缺失值
+        intercept = factor_mean - slope * market_cap_mean
 
-    for industry in industry_label.unique():
+        # 行业内只有一只股票（或市值全部相同）时回归矩阵不满秩，与 statsmodels.OLS 一样取最小范数解
 
-        industry_merged_df = merged_df[merged_df['industry_label'] == industry]
+        singular = (sample_count > 0) & ~(market_cap_sum_of_squares > 0)
 
-        if industry_merged_df['factor'].isnull().any() == False:
+        slope = np.where(singular, factor_mean * market_cap_mean / (market_cap_mean ** 2 + 1), slope)
 
-            continue
+        intercept = np.where(singular, factor_mean / (market_cap_mean ** 2 + 1), intercept)
 
-        else:
+    predicted_values = slope[stock_position] * market_cap[:, None] + intercept[stock_position]
 
-            missing_value_stock_list = industry_merged_df['factor'].index[industry_merged_df['factor'].astype(np.float).apply(np.isnan)]
+    imputation_mask = (factor_mask == 0) & (industry_codes >= 0)[:, None]
 
-            y = industry_merged_df.dropna()['factor'].values
+    return pd.DataFrame(np.where(imputation_mask, predicted_values, factor_exposure.values.astype(np.float64)), index=factor_exposure.index, columns=factor_exposure.columns)
 
-            x = np.stack([industry_merged_df.dropna()['market_cap'].values, np.ones(len(y))]).T
 
-            st_result = st.OLS(y, x).fit()
+def style_factors_imputation(style_factors_exposure, market_cap_on_current_day, date, industry_label=None):
 
-            exogenous_variables = pd.concat([industry_merged_df['market_cap'][missing_value_stock_list], pd.Series(data = 1, index = missing_value_stock_list)], axis = 1)
+    # 若调用方已经获取行业标记（例如 MarketContext），则不再重复请求
 
-            imputed_factor.loc[missing_value_stock_list] = exogenous_variables.dot(st_result.params)
+    if industry_label is None:
 
-    return imputed_factor
+        industry_label = get_shenwan_industry_label(style_factors_exposure.index.tolist(), date)
 
+    return grouped_factor_imputation(style_factors_exposure, market_cap_on_current_day, industry_label)
 
-def factor_imputation(market_cap_on_current_day,style_factors_exposure):
 
-    imputed_factor_exposure = style_factors_exposure.copy()
+def individual_factor_imputation(stock_list, factor, market_cap_on_current_day, date, industry_label=None):
 
-    style_factors_exposure['market_cap'] = market_cap_on_current_day
+    if industry_label is None:
 
-    for factor in style_factors_exposure.columns:
+        industry_label = get_shenwan_industry_label(stock_list, date)
 
-        if style_factors_exposure[factor].isnull().any() == False:
+    # 和因子暴露度缺失值填补逻辑类似，以回归法填补因子的缺失值；结果包含因子、市值和行业标记中出现的全部股票
 
-            continue
+    stock_index = factor.index.union(market_cap_on_current_day.index).union(industry_label.index)
 
-        else:
+    return grouped_factor_imputation(factor.reindex(stock_index).to_frame(), market_cap_on_current_day, industry_label).iloc[:, 0]
 
-            missing_data_stock_list = style_factors_exposure[factor].index[style_factors_exposure[factor].astype(np.float).apply(np.isnan)]
 
-            y = style_factors_exposure[[factor, 'market_cap']].dropna()[factor].values
-
-            x = np.stack([style_factors_exposure[[factor, 'market_cap']].dropna()['market_cap'].values,
-                          np.ones(len(y))]).T
-
-            st_result = st.OLS(y, x).fit()
-
-            exogenous_variables = pd.concat([style_factors_exposure['market_cap'][missing_data_stock_list],
-                                             pd.Series(data=1, index=missing_data_stock_list)], axis=1)
+def factor_imputation(market_cap_on_current_day,style_factors_exposure):
 
-            imputed_factor_exposure.loc[missing_data_stock_list, factor] = exogenous_variables.dot(st_result.params)
+    # 使用全市场股票进行回归，即全部股票属于同一组
 
-    return imputed_factor_exposure
+    return grouped_factor_imputation(style_factors_exposure, market_cap_on_current_day, pd.Series(0, index=style_factors_exposure.index))
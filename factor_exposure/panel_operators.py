@@ -0,0 +1,155 @@
+###### 面板数据算子 ######
+
+
+### 模块说明 ###
+
+# operators.winsorization_and_market_cap_weighed_standardization 每次只处理一个交易日的横截面（Series），
+
+# 历史回填时需要逐日、逐因子调用。本模块的算子一次处理整个面板：factor_exposure 为 T×N（交易日×股票）或 T×N×K（交易日×股票×因子）的数组，
+
+# 对每个交易日（及每个因子）的横截面分别进行标准化和 Winsorization，结果与逐个 Series 调用相同。
+
+# mask 为 T×N 的布尔数组，标记每个交易日参与计算的股票（例如当天已上市的股票），其余位置视为不在横截面中，结果为 NaN。
+
+# panel_atomic_descriptors_combination 同样一次处理整个面板，按每个交易日的细分因子权重把细分因子组合为风格因子暴露度。
+
+
+import numpy as np
+
+
+def _prepare_panel(factor_exposure, market_cap=None, mask=None):
+
+    factor_exposure = np.asarray(factor_exposure, dtype=np.float64)
+
+    market_cap = None if market_cap is None else np.asarray(market_cap, dtype=np.float64)
+
+    if mask is not None:
+
+        mask = np.asarray(mask, dtype=bool)
+
+        factor_exposure = np.where(mask if factor_exposure.ndim == 2 else mask[:, :, None], factor_exposure, np.nan)
+
+        market_cap = None if market_cap is None else np.where(mask, market_cap, np.nan)
+
+    # 市值对所有因子相同，扩展一维与 T×N×K 的因子暴露度对齐
+
+    if market_cap is not None and factor_exposure.ndim == 3:
+
+        market_cap = market_cap[:, :, None]
+
+    return factor_exposure, market_cap
+
+
+def get_cross_sectional_mean_and_std(factor_exposure):
+
+    # 与 pandas 的 Series.mean() 和 Series.std() 相同：忽略缺失值，标准差除以（样本数 - 1）
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        observation_count = np.sum(~np.isnan(factor_exposure), axis=1, keepdims=True)
+
+        mean = np.nansum(factor_exposure, axis=1, keepdims=True) / observation_count
+
+        variance = np.nansum((factor_exposure - mean) ** 2, axis=1, keepdims=True) / (observation_count - 1)
+
+    variance[observation_count < 2] = np.nan
+
+    return mean, np.sqrt(variance)
+
+
+def panel_winsorization(standardized_factor_exposure):
+
+    # 把超出（均值 ± 3 倍标准差）的取值替换为上下限，缺失值不变
+
+    mean, std = get_cross_sectional_mean_and_std(standardized_factor_exposure)
+
+    upper_limit = mean + 3 * std
+
+    lower_limit = mean - 3 * std
+
+    with np.errstate(invalid='ignore'):
+
+        winsorized_factor_exposure = np.where(standardized_factor_exposure > upper_limit, upper_limit, standardized_factor_exposure)
+
+        winsorized_factor_exposure = np.where(winsorized_factor_exposure < lower_limit, lower_limit, winsorized_factor_exposure)
+
+    return winsorized_factor_exposure
+
+
+def panel_winsorization_and_standardization(factor_exposure, mask=None):
+
+    # 等权均值和等权标准差标准化，再以 3 倍标准差进行 Winsorization，用于风格暴露度分析和业绩归因
+
+    factor_exposure, market_cap = _prepare_panel(factor_exposure, None, mask)
+
+    mean, std = get_cross_sectional_mean_and_std(factor_exposure)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        standardized_factor_exposure = (factor_exposure - mean) / std
+
+    return panel_winsorization(standardized_factor_exposure)
+
+
+def panel_winsorization_and_market_cap_weighed_standardization(factor_exposure, market_cap, mask=None, standardize_first=False):
+
+    # 市值加权均值和等权标准差标准化，与逐日调用 operators.winsorization_and_market_cap_weighed_standardization 相同
+
+    # standardize_first=True 时先进行等权标准化，再进行市值加权标准化（风格暴露度标准化 factor_exposure_estimation_and_standarization 使用）
+
+    # （存在缺失值时两者不同：市值加权均值的分母包括因子暴露度缺失的股票）
+
+    factor_exposure, market_cap = _prepare_panel(factor_exposure, market_cap, mask)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        if standardize_first:
+
+            mean, std = get_cross_sectional_mean_and_std(factor_exposure)
+
+            factor_exposure = (factor_exposure - mean) / std
+
+        # 分母为横截面中全部股票的市值之和（包括因子暴露度缺失的股票），与 Series 版本一致
+
+        market_cap_weighted_mean = np.nansum(market_cap * factor_exposure, axis=1, keepdims=True) / np.nansum(market_cap, axis=1, keepdims=True)
+
+        mean, std = get_cross_sectional_mean_and_std(factor_exposure)
+
+        standardized_factor_exposure = (factor_exposure - market_cap_weighted_mean) / std
+
+    return panel_winsorization(standardized_factor_exposure)
+
+
+def panel_atomic_descriptors_combination(atomic_descriptors_exposure, atomic_descriptors_weight):
+
+    # atomic_descriptors_exposure 为 T×N×K（交易日×股票×细分因子）或 N×K 的数组；atomic_descriptors_weight 为 T×K 的数组（每个交易日的细分因子权重可以不同）或长度为 K 的数组
+
+    # 细分因子缺失时，用其余细分因子的权重重新归一化，即风格因子暴露度 = sum(w * x) / sum(w)，两个求和都只包括不缺失的细分因子；全部细分因子缺失时为 NaN
+
+    atomic_descriptors_exposure = np.asarray(atomic_descriptors_exposure, dtype=np.float64)
+
+    atomic_descriptors_weight = np.asarray(atomic_descriptors_weight, dtype=np.float64)
+
+    single_cross_section = atomic_descriptors_exposure.ndim == 2
+
+    if single_cross_section:
+
+        atomic_descriptors_exposure = atomic_descriptors_exposure[None, :, :]
+
+    if atomic_descriptors_weight.ndim == 1:
+
+        atomic_descriptors_weight = np.broadcast_to(atomic_descriptors_weight, (atomic_descriptors_exposure.shape[0], atomic_descriptors_weight.shape[0]))
+
+    available_descriptors = ~np.isnan(atomic_descriptors_exposure)
+
+    weighted_sum = np.einsum('tnk,tk->tn', np.where(available_descriptors, atomic_descriptors_exposure, 0), atomic_descriptors_weight)
+
+    renormalized_weight = np.einsum('tnk,tk->tn', available_descriptors.astype(np.float64), atomic_descriptors_weight)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        style_factor_exposure = weighted_sum / renormalized_weight
+
+    style_factor_exposure[~available_descriptors.any(axis=2)] = np.nan
+
+    return style_factor_exposure[0] if single_cross_section else style_factor_exposure
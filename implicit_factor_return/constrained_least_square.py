@@ -0,0 +1,171 @@
+###### 带行业约束的加权最小二乘 ######
+
+
+### 模块说明 ###
+
+# 因子收益率回归为加权最小二乘，且行业因子收益率满足市值加权之和为 0 的约束（推导参见 Bloomberg <China A Share Equity Fundamental Factor Model>）。
+
+# 原来的实现构造 N×N 的 np.diag(weight)（全市场约 3600 只股票时约 100 MB），再对拉格朗日乘子法的 (K+1)×(K+1) 方程组求逆。
+
+# 本模块以广播计算 X'WX（内存为 O(NK)），并用约束消去一个行业因子：选取行业市值最大的行业 j，f_j = -sum(c_i * f_i) / c_j，
+
+# 其余因子的收益率为无约束加权最小二乘的解，以奇异值分解求解 K-1 维的正规方程，同时得到正规方程的条件数。
+
+# solve_multi_universe_constrained_weighted_least_square 对多个股票池共用一个暴露度矩阵，以行掩码计算各股票池的正规方程并批量求解。
+
+
+import numpy as np
+import pandas as pd
+
+
+def solve_constrained_weighted_least_square(Y, X, weight, industry_total_market_cap, unconstrained_variables, constrained_variables):
+
+    # 返回因子收益率（Series，index 为 X 的列）和正规方程的条件数；X 的列依次为 unconstrained_variables 个风格因子、constrained_variables 个行业因子，其余为不加约束的因子（市场联动）
+
+    exposure = np.asarray(X, dtype=np.float64)
+
+    weight = np.asarray(weight, dtype=np.float64)
+
+    number_of_factors = exposure.shape[1]
+
+    constraint = np.zeros(number_of_factors)
+
+    constraint[unconstrained_variables:unconstrained_variables + constrained_variables] = np.asarray(industry_total_market_cap, dtype=np.float64)
+
+    # 约束 constraint'f = 0 的参数化：f = transformation * g，transformation 为 K×(K-1) 的矩阵
+
+    eliminated_factor = unconstrained_variables + np.argmax(np.abs(constraint[unconstrained_variables:unconstrained_variables + constrained_variables]))
+
+    remaining_factors = np.delete(np.arange(number_of_factors), eliminated_factor)
+
+    transformation = np.zeros((number_of_factors, number_of_factors - 1))
+
+    transformation[remaining_factors, np.arange(number_of_factors - 1)] = 1
+
+    transformation[eliminated_factor] = -constraint[remaining_factors] / constraint[eliminated_factor]
+
+    # X'WX 与 X'WY，不构造 N×N 的权重矩阵
+
+    weighted_exposure = exposure * weight[:, None]
+
+    reduced_exposure_covariance = transformation.T.dot(weighted_exposure.T.dot(exposure)).dot(transformation)
+
+    reduced_exposure_return = transformation.T.dot(weighted_exposure.T.dot(np.asarray(Y, dtype=np.float64)))
+
+    # 正规方程奇异时（例如某行业没有股票）lstsq 给出最小范数解
+
+    reduced_factor_returns, residuals, rank, singular_values = np.linalg.lstsq(reduced_exposure_covariance, reduced_exposure_return, rcond=None)
+
+    condition_number = singular_values[0] / singular_values[-1] if singular_values[-1] > 0 else np.inf
+
+    factor_returns = pd.Series(transformation.dot(reduced_factor_returns), index=X.columns)
+
+    return factor_returns, condition_number
+
+
+def constrainted_weighted_least_square(Y, X, weight, industry_total_market_cap, unconstrained_variables, constrained_variables):
+
+    factor_returns, condition_number = solve_constrained_weighted_least_square(Y, X, weight, industry_total_market_cap, unconstrained_variables, constrained_variables)
+
+    return factor_returns
+
+
+def _solve_universe_normal_equations(exposure, returns, weight, masks, constraint, missing_industry, unconstrained_variables, industry_factors):
+
+    # 对各股票池（每个股票池至少有一个行业参与约束）批量求解约束消元后的正规方程，返回因子收益率（U×K）和条件数
+
+    number_of_universes, number_of_factors = constraint.shape
+
+    # 每个股票池消去行业市值最大的行业：f = transformation * g，transformation 为 U×K×(K-1)
+
+    eliminated_factor = unconstrained_variables + np.argmax(constraint[:, industry_factors], axis=1)
+
+    transformation = np.zeros((number_of_universes, number_of_factors, number_of_factors - 1))
+
+    for universe_number, eliminated in enumerate(eliminated_factor):
+
+        remaining_factors = np.delete(np.arange(number_of_factors), eliminated)
+
+        transformation[universe_number, remaining_factors, np.arange(number_of_factors - 1)] = 1
+
+        transformation[universe_number, eliminated] = -constraint[universe_number, remaining_factors] / constraint[universe_number, eliminated]
+
+    # 没有配置的行业：暴露度在该股票池中全为 0，正规方程对应的行和列为 0，最小范数解中其收益率为 0
+
+    universe_weight = np.where(masks, weight, 0)
+
+    exposure_covariance = np.einsum('nk,un,nl->ukl', exposure, universe_weight, exposure)
+
+    exposure_return = np.einsum('nk,un->uk', exposure, universe_weight * np.nan_to_num(returns))
+
+    reduced_exposure_covariance = np.einsum('ukm,ukl,uln->umn', transformation, exposure_covariance, transformation)
+
+    reduced_exposure_return = np.einsum('ukm,uk->um', transformation, exposure_return)
+
+    left_singular_vectors, singular_values, right_singular_vectors = np.linalg.svd(reduced_exposure_covariance)
+
+    cutoff = singular_values[:, :1] * max(reduced_exposure_covariance.shape[1:]) * np.finfo(np.float64).eps
+
+    effective_singular_values = singular_values > cutoff
+
+    inverse_singular_values = np.where(effective_singular_values, 1 / np.where(effective_singular_values, singular_values, 1), 0)
+
+    reduced_factor_returns = np.einsum('uji,uj,ukj,uk->ui', right_singular_vectors, inverse_singular_values, left_singular_vectors, reduced_exposure_return)
+
+    factor_returns_values = np.einsum('ukm,um->uk', transformation, reduced_factor_returns)
+
+    factor_returns_values[:, industry_factors] = np.where(missing_industry, 0, factor_returns_values[:, industry_factors])
+
+    condition_number = singular_values[:, 0] / np.where(effective_singular_values, singular_values, np.inf).min(axis=1)
+
+    return factor_returns_values, condition_number
+
+
+def solve_multi_universe_constrained_weighted_least_square(Y, X, weight, market_cap, universe_masks, unconstrained_variables, constrained_variables, minimum_industry_market_cap=100):
+
+    # 多个股票池（全市场、各指数成分股或自定义股票列表）共用同一个暴露度矩阵 X（N×K）、收益率 Y 和回归权重 weight，universe_masks 为字典：key 为股票池名称，value 为长度 N 的布尔数组
+
+    # 各股票池的 X'WX 和 X'WY 以行掩码一次算出，约束消元后的正规方程以批量奇异值分解一次求解；返回因子收益率（DataFrame，index 为因子，columns 为股票池名称）和各股票池正规方程的条件数
+
+    # 股票池中行业市值之和小于 minimum_industry_market_cap 的行业视为没有配置，不参与约束，因子收益率为 0；收益率或权重缺失的股票不参与回归
+
+    # 所有行业都没有配置的股票池（空的股票列表，或指数基日之前没有成分股）无法求解，不参与批量求解，因子收益率和条件数为 NaN，不影响其余股票池
+
+    exposure = np.asarray(X, dtype=np.float64)
+
+    returns = np.asarray(Y, dtype=np.float64)
+
+    weight = np.asarray(weight, dtype=np.float64)
+
+    universe_names = list(universe_masks.keys())
+
+    masks = np.array([np.asarray(universe_masks[name], dtype=bool) for name in universe_names]).reshape(len(universe_names), len(returns)) & ~np.isnan(returns) & ~np.isnan(weight)
+
+    number_of_factors = exposure.shape[1]
+
+    industry_factors = np.arange(unconstrained_variables, unconstrained_variables + constrained_variables)
+
+    # 各股票池的行业市值之和（U×行业数）
+
+    industry_total_market_cap = (masks * np.nan_to_num(np.asarray(market_cap, dtype=np.float64))).dot(exposure[:, industry_factors])
+
+    missing_industry = industry_total_market_cap < minimum_industry_market_cap
+
+    constraint = np.zeros((len(universe_names), number_of_factors))
+
+    constraint[:, industry_factors] = np.where(missing_industry, 0, industry_total_market_cap)
+
+    valid_universes = ~missing_industry.all(axis=1)
+
+    factor_returns_values = np.full((len(universe_names), number_of_factors), np.nan)
+
+    condition_number = np.full(len(universe_names), np.nan)
+
+    if valid_universes.any():
+
+        factor_returns_values[valid_universes], condition_number[valid_universes] = _solve_universe_normal_equations(exposure, returns, weight, masks[valid_universes], constraint[valid_universes],
+                                                                                                                    missing_industry[valid_universes], unconstrained_variables, industry_factors)
+
+    factor_returns = pd.DataFrame(factor_returns_values.T, index=X.columns, columns=universe_names)
+
+    return factor_returns, pd.Series(condition_number, index=universe_names)
@@ -0,0 +1,94 @@
+###### 因子收益率和特异收益率时间序列 ######
+
+
+### 模块说明 ###
+
+# get_implicit_factor_return 每次只计算一个交易日的因子收益率，协方差估计所需的 252 个交易日以上的历史序列原本只能从 rqdatac.barra.get_factor_return 获取。
+
+# 本模块按交易日区间生成自己的因子收益率和特异收益率序列：尚未计算的交易日由 backfill 多进程并行计算（每个交易日的结果同时作为断点记录），
+
+# 结果追加写入本地因子数据仓库（factor_store），已保存的交易日不再重新计算。每天更新时只需计算新增的一个交易日。
+
+
+### 存储结构 ###
+
+# implicit_factor_return_<universe> ：各股票池的因子收益率（行：交易日，列：因子）；
+
+# specific_return ：全市场回归的特异收益率（行：交易日，列：股票代码）。
+
+
+import os
+import sys
+
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'factor_exposure'))
+
+from factor_store import *
+from backfill import run_backfill, load_backfill_results, get_trading_calendar
+
+
+factor_return_task = 'factor_and_specific_return'
+
+specific_return_name = 'specific_return'
+
+
+def _factor_return_name(universe):
+
+    return 'implicit_factor_return_' + universe
+
+
+def update_factor_return_series(start_date, end_date, processes=None):
+
+    # 计算区间内尚未保存的交易日并写入仓库，返回计算失败的交易日
+
+    # 因子收益率和特异收益率同时写入，以特异收益率已保存的交易日为准
+
+    missing_dates = get_missing_dates([specific_return_name], get_trading_calendar(start_date, end_date))
+
+    if len(missing_dates) == 0:
+
+        return []
+
+    failed_dates = run_backfill(factor_return_task, missing_dates[0].strftime('%Y-%m-%d'), missing_dates[-1].strftime('%Y-%m-%d'), processes)
+
+    results = load_backfill_results(factor_return_task, missing_dates[0], missing_dates[-1])
+
+    results = {trading_date: results[trading_date] for trading_date in missing_dates if trading_date in results}
+
+    if len(results) == 0:
+
+        return failed_dates
+
+    factor_returns = {trading_date: result[0] for trading_date, result in results.items()}
+
+    for universe in next(iter(factor_returns.values())).columns:
+
+        append_factor_data(_factor_return_name(universe), pd.DataFrame({trading_date: factor_return[universe] for trading_date, factor_return in factor_returns.items()}).T)
+
+    append_factor_data(specific_return_name, pd.DataFrame({trading_date: result[1] for trading_date, result in results.items()}).T)
+
+    return failed_dates
+
+
+def get_factor_return_series(start_date, end_date, universe='whole_market', processes=None):
+
+    update_factor_return_series(start_date, end_date, processes)
+
+    return get_factor_data(_factor_return_name(universe), start_date, end_date)
+
+
+def get_specific_return_series(start_date, end_date, order_book_ids=None, processes=None):
+
+    update_factor_return_series(start_date, end_date, processes)
+
+    return get_factor_data(specific_return_name, start_date, end_date, order_book_ids)
+
+
+if __name__ == '__main__':
+
+    start_date, end_date = sys.argv[1], sys.argv[2]
+
+    processes = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    update_factor_return_series(start_date, end_date, processes)
@@ -10,6 +10,8 @@ import rqdatac
 
 rqdatac.init('rice', 'rice', ('192.168.10.64', 16030))
 
+from constrained_least_square import *
+
 
 def get_shenwan_industry_exposure(stock_list, date):
 
@@ -50,29 +52,6 @@ def get_exposure(stock_list,date):
     return factor_exposure
 
 
-def constrainted_weighted_least_square(Y, X, weight, industry_total_market_cap, unconstrained_variables, constrained_variables):
-
-    # 直接求解线性方程组（推导参见 Bloomberg <China A Share Equity Fundamental Factor Model>）
-
-    upper_left_block = 2*np.dot(X.T, np.dot(np.diag(weight), X))
-
-    upper_right_block = np.append(np.append(np.zeros(unconstrained_variables), -industry_total_market_cap.values), np.zeros(1))
-
-    upper_block = np.concatenate((upper_left_block, upper_right_block.reshape(unconstrained_variables + constrained_variables + 1, 1)), axis=1)
-
-    lower_block = np.append(upper_right_block, 0)
-
-    complete_matrix = np.concatenate((upper_block, lower_block.reshape(1, unconstrained_variables + constrained_variables + 2)), axis=0)
-
-    right_hand_side_vector = np.append(2*np.dot(X.T, np.multiply(weight, Y)), 0)
-
-    factor_returns_values = np.dot(np.linalg.inv(complete_matrix.astype(np.float)), right_hand_side_vector.T)
-
-    factor_returns = pd.Series(factor_returns_values[:-1], index = X.columns)
-
-    return factor_returns
-
-
 def customized_factor_return_estimation(date, factor_exposure,stock_list):
 
     latest_trading_date = rqdatac.get_previous_trading_date(datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1))
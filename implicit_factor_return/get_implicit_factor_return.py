@@ -8,6 +8,8 @@ import rqdatac
 
 rqdatac.init('rice', 'rice', ('192.168.10.64', 16030))
 
+from constrained_least_square import *
+
 
 def get_shenwan_industry_exposure(stock_list, date):
 
@@ -48,30 +50,39 @@ def get_exposure(stock_list,date):
     return factor_exposure
 
 
-def constrainted_weighted_least_square(Y, X, weight, industry_total_market_cap, unconstrained_variables, constrained_variables):
+# 估计因子收益率的股票池：key 为股票池名称，value 为指数代码（取前一交易日的成分股）、自定义股票列表，或 None（全市场）
 
-    # 直接求解线性方程组（推导参见 Bloomberg <China A Share Equity Fundamental Factor Model>）
+benchmark_universes = {'whole_market': None, 'csi_300': '000300.XSHG', 'csi_500': '000905.XSHG', 'csi_800': '000906.XSHG'}
 
-    upper_left_block = 2*np.dot(X.T, np.dot(np.diag(weight), X))
 
-    upper_right_block = np.append(np.append(np.zeros(unconstrained_variables), -industry_total_market_cap.values), np.zeros(1))
+def get_universe_masks(universes, stock_list, date):
 
-    upper_block = np.concatenate((upper_left_block, upper_right_block.reshape(unconstrained_variables + constrained_variables + 1, 1)), axis=1)
+    universe_masks = {}
 
-    lower_block = np.append(upper_right_block, 0)
+    for universe_name, universe in universes.items():
 
-    complete_matrix = np.concatenate((upper_block, lower_block.reshape(1, unconstrained_variables + constrained_variables + 2)), axis=0)
+        if universe is None:
 
-    right_hand_side_vector = np.append(2*np.dot(X.T, np.multiply(weight, Y)), 0)
+            universe_components = stock_list
 
-    factor_returns_values = np.dot(np.linalg.inv(complete_matrix.astype(np.float)), right_hand_side_vector.T)
+        elif isinstance(universe, str):
 
-    factor_returns = pd.Series(factor_returns_values[:-1], index = X.columns)
+            universe_components = rqdatac.index_components(index_name = universe, date = date)
 
-    return factor_returns
+            # 指数基日之前没有成分股，返回 None
+
+            universe_components = [] if universe_components is None else universe_components
+
+        else:
+
+            universe_components = universe
 
+        universe_masks[universe_name] = pd.Index(stock_list).isin(universe_components)
 
-def factor_return_estimation(date, factor_exposure):
+    return universe_masks
+
+
+def factor_return_estimation(date, factor_exposure, universes = benchmark_universes):
 
     latest_trading_date = rqdatac.get_previous_trading_date(datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1))
 
@@ -103,8 +114,6 @@ def factor_return_estimation(date, factor_exposure):
 
     normalized_regression_weight = market_cap.pow(0.5)/market_cap.pow(0.5).sum()
 
-    # 各行业市值之和，用于行业收益率约束条件
-
     if str(previous_trading_date) > '2014-01-01':
 
         industry_factors = ['农林牧渔', '采掘', '化工', '钢铁', '有色金属', '电子', '家用电器', '食品饮料', '纺织服装', '轻工制造',\
@@ -116,72 +125,29 @@ def factor_return_estimation(date, factor_exposure):
                             '交运设备', '食品饮料', '电子', '信息设备', '交通运输', '轻工制造', '公用事业', '机械设备',
                             '纺织服装', '农林牧渔', '商业贸易', '化工', '信息服务', '采掘', '黑色金属']
 
-    industry_total_market_cap = market_cap.dot(factor_exposure.loc[market_cap.index][industry_factors])
-
-    factor_return_series = pd.DataFrame()
-
-    # 对10个风格因子不添加约束，对 GICS 32个行业添加约束
-
-    factor_return_series['whole_market'] = constrainted_weighted_least_square(Y = daily_excess_return[market_cap.index].values[0], X = factor_exposure.loc[market_cap.index], weight = normalized_regression_weight,\
-                                                                     industry_total_market_cap = industry_total_market_cap, unconstrained_variables = 10, constrained_variables = len(industry_total_market_cap))
-
-    ### 沪深300
-
-    csi_300_components = rqdatac.index_components(index_name='000300.XSHG', date=previous_trading_date)
-
-    csi_300_components = list(set(market_cap.index.tolist()).intersection(set(csi_300_components)))
-
-    # 各行业市值之和，用于行业收益率约束条件
-
-    csi_300_industry_total_market_cap = market_cap[csi_300_components].dot(factor_exposure[industry_factors].loc[csi_300_components])
-
-    # 若行业市值之和小于100，则认为基准没有配置该行业
-
-    missing_industry = csi_300_industry_total_market_cap[csi_300_industry_total_market_cap < 100].index
+    # 各股票池共用全市场的暴露度、收益率和回归权重，对10个风格因子不添加约束，对行业因子添加约束（行业市值之和小于100的行业认为该股票池没有配置）
 
-    csi_300_industry_total_market_cap = csi_300_industry_total_market_cap.drop(missing_industry)
+    # 特异收益率以全市场回归为准，股票池中不包括全市场时同时估计全市场的因子收益率（批量求解，几乎不增加计算量），返回时再去掉
 
-    factor_return_series['csi_300'] = constrainted_weighted_least_square(Y = daily_excess_return[factor_exposure.index][csi_300_components].values[0], X = factor_exposure.drop(missing_industry, axis =1).loc[csi_300_components], weight = normalized_regression_weight[factor_exposure.index][csi_300_components],\
-                                                                industry_total_market_cap = csi_300_industry_total_market_cap, unconstrained_variables = 10, constrained_variables = len(csi_300_industry_total_market_cap))
+    estimation_universes = universes if 'whole_market' in universes else dict(universes, whole_market = None)
 
+    universe_masks = get_universe_masks(estimation_universes, market_cap.index.tolist(), previous_trading_date)
 
-    ### 中证500
+    factor_return_series, condition_number = solve_multi_universe_constrained_weighted_least_square(Y = daily_excess_return[market_cap.index].values[0], X = factor_exposure.loc[market_cap.index], weight = normalized_regression_weight,\
+                                                                                                   market_cap = market_cap, universe_masks = universe_masks, unconstrained_variables = 10, constrained_variables = len(industry_factors))
 
-    csi_500_components = rqdatac.index_components(index_name = '000905.XSHG', date = previous_trading_date)
-
-    csi_500_components = list(set(market_cap.index.tolist()).intersection(set(csi_500_components)))
-
-    csi_500_industry_total_market_cap = market_cap[csi_500_components].dot(factor_exposure[industry_factors].loc[csi_500_components])
-
-    missing_industry = csi_500_industry_total_market_cap[csi_500_industry_total_market_cap < 100].index
-
-    csi_500_industry_total_market_cap = csi_500_industry_total_market_cap.drop(missing_industry)
-
-    factor_return_series['csi_500'] = constrainted_weighted_least_square(Y = daily_excess_return[factor_exposure.index][csi_500_components].values[0], X = factor_exposure.drop(missing_industry, axis =1).loc[csi_500_components], weight = normalized_regression_weight[factor_exposure.index][csi_500_components],\
-                                                                industry_total_market_cap = csi_500_industry_total_market_cap, unconstrained_variables = 10, constrained_variables = len(csi_500_industry_total_market_cap))
-
-
-    ### 中证800
-
-    csi_800_components = rqdatac.index_components(index_name = '000906.XSHG', date = previous_trading_date)
-
-    csi_800_components = list(set(market_cap.index.tolist()).intersection(set(csi_800_components)))
-
-    csi_800_industry_total_market_cap = market_cap[csi_800_components].dot(factor_exposure[industry_factors].loc[csi_800_components])
+    # 若指数在特定行业中没有配置任何股票，则因子收益率为 0
 
-    missing_industry = csi_800_industry_total_market_cap[csi_800_industry_total_market_cap < 100].index
+    factor_return_series = factor_return_series.replace(np.nan, 0)
 
-    csi_800_industry_total_market_cap = csi_800_industry_total_market_cap.drop(missing_industry)
+    # 特异收益率：股票超额收益率减去全市场回归的因子收益率所解释的部分
 
-    factor_return_series['csi_800'] = constrainted_weighted_least_square(Y = daily_excess_return[factor_exposure.index][csi_800_components].values[0], X = factor_exposure.drop(missing_industry, axis =1).loc[csi_800_components], weight = normalized_regression_weight[factor_exposure.index][csi_800_components],\
-                                                                industry_total_market_cap = csi_800_industry_total_market_cap, unconstrained_variables = 10, constrained_variables = len(csi_800_industry_total_market_cap))
+    specific_return = daily_excess_return[market_cap.index].iloc[0] - factor_exposure.loc[market_cap.index].dot(factor_return_series['whole_market'])
 
-    # 若指数在特定行业中没有配置任何股票，则因子收益率为 0
+    return factor_return_series[list(universes)], specific_return
 
-    return factor_return_series.replace(np.nan, 0)
 
-
-def get_implicit_factor_return(date):
+def get_implicit_factor_and_specific_return(date, universes = benchmark_universes):
 
     latest_trading_date = str(rqdatac.get_previous_trading_date(datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)))
 
@@ -201,11 +167,20 @@ def get_implicit_factor_return(date):
 
     # 根据上述四类暴露度计算因子收益率
 
-    factor_returns = factor_return_estimation(date, factor_exposure)
+    factor_returns, specific_return = factor_return_estimation(date, factor_exposure, universes)
+
+    return factor_returns, specific_return
+
+
+def get_implicit_factor_return(date, universes = benchmark_universes):
+
+    factor_returns, specific_return = get_implicit_factor_and_specific_return(date, universes)
 
     return factor_returns
 
 
-date = '2018-07-18'
+if __name__ == '__main__':
+
+    date = '2018-07-18'
 
-factor_returns = get_implicit_factor_return(date)
+    factor_returns = get_implicit_factor_return(date)
@@ -1,3 +1,4 @@
+import sys
 import numpy as np
 import pandas as pd
 import statsmodels.api as st
@@ -13,30 +14,7 @@ rqdatac.init('rice','rice',('192.168.10.64',16008))
 sys.path.append("/Users/jjj728/git/cne5_factors/style_factor_exposure/")
 
 from get_factor_exposure import *
-
-
-
-def constrainted_weighted_least_square(Y, X, weight, industry_total_market_cap, unconstrained_variables, constrained_variables):
-
-    # 直接求解线性方程组（推导参见 Bloomberg <China A Share Equity Fundamental Factor Model>）
-
-    upper_left_block = 2*np.dot(X.T, np.dot(np.diag(weight), X))
-
-    upper_right_block = np.append(np.append(np.zeros(unconstrained_variables), -industry_total_market_cap.values), np.zeros(1))
-
-    upper_block = np.concatenate((upper_left_block, upper_right_block.reshape(unconstrained_variables + constrained_variables + 1, 1)), axis=1)
-
-    lower_block = np.append(upper_right_block, 0)
-
-    complete_matrix = np.concatenate((upper_block, lower_block.reshape(1, unconstrained_variables + constrained_variables + 2)), axis=0)
-
-    right_hand_side_vector = np.append(2*np.dot(X.T, np.multiply(weight, Y)), 0)
-
-    factor_returns_values = np.dot(np.linalg.inv(complete_matrix), right_hand_side_vector.T)
-
-    factor_returns = pd.Series(factor_returns_values[:-1], index = X.columns)
-
-    return factor_returns
+from constrained_least_square import *
 
 
 
@@ -163,45 +141,46 @@ def pure_factor_return(date):
     return factor_returns
 
 
-test_trading_dates = rqdatac.get_trading_dates('2017-01-01', '2018-04-02')
+if __name__ == '__main__':
 
+    test_trading_dates = rqdatac.get_trading_dates('2017-01-01', '2018-04-02')
 
 
 
 
-factor_returns = pure_factor_return('2018-02-02')
 
-industry_factors = ['CNE5S_ENERGY', 'CNE5S_CHEM', 'CNE5S_CONMAT', 'CNE5S_MTLMIN', 'CNE5S_MATERIAL', 'CNE5S_AERODEF', \
-                    'CNE5S_BLDPROD', 'CNE5S_CNSTENG', 'CNE5S_ELECEQP', 'CNE5S_INDCONG', 'CNE5S_MACH', 'CNE5S_TRDDIST', \
-                    'CNE5S_COMSERV', 'CNE5S_AIRLINE', 'CNE5S_MARINE', 'CNE5S_RDRLTRAN', 'CNE5S_AUTO', 'CNE5S_HOUSEDUR', \
-                    'CNE5S_LEISLUX', 'CNE5S_CONSSERV', 'CNE5S_MEDIA', 'CNE5S_RETAIL', 'CNE5S_PERSPRD', 'CNE5S_BEV', \
-                    'CNE5S_FOODPROD', 'CNE5S_HEALTH', 'CNE5S_BANKS', 'CNE5S_DVFININS', 'CNE5S_REALEST',
-                    'CNE5S_SOFTWARE', 'CNE5S_HDWRSEMI', 'CNE5S_UTILITIE']
+    factor_returns = pure_factor_return('2018-02-02')
 
-style_factors = ['CNE5S_BETA', 'CNE5S_MOMENTUM', 'CNE5S_SIZE', 'CNE5S_EARNYILD', 'CNE5S_RESVOL', 'CNE5S_GROWTH',
-                 'CNE5S_BTOP', 'CNE5S_LEVERAGE', 'CNE5S_LIQUIDTY', 'CNE5S_SIZENL']
+    industry_factors = ['CNE5S_ENERGY', 'CNE5S_CHEM', 'CNE5S_CONMAT', 'CNE5S_MTLMIN', 'CNE5S_MATERIAL', 'CNE5S_AERODEF', \
+                        'CNE5S_BLDPROD', 'CNE5S_CNSTENG', 'CNE5S_ELECEQP', 'CNE5S_INDCONG', 'CNE5S_MACH', 'CNE5S_TRDDIST', \
+                        'CNE5S_COMSERV', 'CNE5S_AIRLINE', 'CNE5S_MARINE', 'CNE5S_RDRLTRAN', 'CNE5S_AUTO', 'CNE5S_HOUSEDUR', \
+                        'CNE5S_LEISLUX', 'CNE5S_CONSSERV', 'CNE5S_MEDIA', 'CNE5S_RETAIL', 'CNE5S_PERSPRD', 'CNE5S_BEV', \
+                        'CNE5S_FOODPROD', 'CNE5S_HEALTH', 'CNE5S_BANKS', 'CNE5S_DVFININS', 'CNE5S_REALEST',
+                        'CNE5S_SOFTWARE', 'CNE5S_HDWRSEMI', 'CNE5S_UTILITIE']
 
-country_factor = ['CNE5S_COUNTRY']
+    style_factors = ['CNE5S_BETA', 'CNE5S_MOMENTUM', 'CNE5S_SIZE', 'CNE5S_EARNYILD', 'CNE5S_RESVOL', 'CNE5S_GROWTH',
+                     'CNE5S_BTOP', 'CNE5S_LEVERAGE', 'CNE5S_LIQUIDTY', 'CNE5S_SIZENL']
 
-all_factors = style_factors + country_factor + industry_factors
+    country_factor = ['CNE5S_COUNTRY']
 
-barra_factor_returns = rqdatac.barra.get_factor_return('2018-02-02', '2018-02-02', style_factors)
+    all_factors = style_factors + country_factor + industry_factors
 
-barra_index = pd.Series([1,2, 3, 4, 5, 6, 7, 8, 9, 10], index=style_factors)
+    barra_factor_returns = rqdatac.barra.get_factor_return('2018-02-02', '2018-02-02', style_factors)
 
-rq_index = pd.Series([1,2, 3, 4, 5, 6, 7, 8, 9, 10], index=style_factors)
+    barra_index = pd.Series([1,2, 3, 4, 5, 6, 7, 8, 9, 10], index=style_factors)
 
-style_factors_exposure.columns = ['beta', 'momentum', 'size', 'earnings_yield', 'residual_volatility', 'growth',
-                                  'book_to_price', 'leverage', 'liquidity', 'non_linear_size']
+    rq_index = pd.Series([1,2, 3, 4, 5, 6, 7, 8, 9, 10], index=style_factors)
 
+    style_factors_exposure.columns = ['beta', 'momentum', 'size', 'earnings_yield', 'residual_volatility', 'growth',
+                                      'book_to_price', 'leverage', 'liquidity', 'non_linear_size']
 
-merged_factor_returns = pd.concat([factor_returns['whole_market'], barra_factor_returns.T], axis = 1)
 
-merged_factor_returns.columns = ['replicated_factor_return', 'original_factor_return']
+    merged_factor_returns = pd.concat([factor_returns['whole_market'], barra_factor_returns.T], axis = 1)
 
-#merged_factor_returns.loc[industry_factors]
+    merged_factor_returns.columns = ['replicated_factor_return', 'original_factor_return']
 
-merged_factor_returns.loc[style_factors]
+    #merged_factor_returns.loc[industry_factors]
 
-print('corr', merged_factor_returns.corr())
+    merged_factor_returns.loc[style_factors]
 
+    print('corr', merged_factor_returns.corr())